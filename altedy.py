@@ -4,30 +4,61 @@ Main Altedy Bot script
 
 import asyncio
 
-from aiogram import Bot, Dispatcher, executor
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram import Bot
 
 from configs.logger_conf import configure_logger
 from configs.bot_conf import BotConfig
-from database.database import UserDatabase, ClassroomDatabase, DeadlineDatabase
+from database.async_database import AsyncUserDatabase, AsyncClassroomDatabase, AsyncDeadlineDatabase, run_blocking
+from database.blob_store import get_blob_store
+from database.pool import get_pool_stats, close_clients
+from database.cache import get_cache_stats
+from database.write_buffer import close_write_buffers
+from infrastructure.fsm_storage import get_fsm_storage
 from infrastructure.message_handler import Handler
-from infrastructure.task import check_deadlines
+from infrastructure.outbox import get_outbox_stats
+from infrastructure.reminders import start_reminders
+from infrastructure.task import start_scheduler, stop_scheduler
+from infrastructure.updates import create_dispatcher, start_updates
 
 LOGGER = configure_logger(__name__)
 
 
-async def init_bot(dispatcher, bot):
+async def init_bot(dispatcher):
     """
-    Async function to call init_db and init translator and handler
+    Async function to call init_db and init translator and handler (before updates are processed,
+    so the ones queued while the bot was down reach the handlers)
     """
 
-    db = UserDatabase()
-    class_db = ClassroomDatabase()
-    deadlines_db = DeadlineDatabase()
+    bot = dispatcher.bot
+    db = AsyncUserDatabase()
+    class_db = AsyncClassroomDatabase()
+    deadlines_db = AsyncDeadlineDatabase()
+    for database in (db, class_db, deadlines_db):
+        await database.ensure_indexes()
+        await database.check_query_plans()
+    await run_blocking(get_blob_store().collect_garbage)
     await asyncio.sleep(3)
 
     Handler(bot, db, class_db, deadlines_db, dispatcher)
-    check_deadlines(bot)
+    await start_scheduler(bot)
+    start_reminders(bot)
+
+
+async def shutdown_bot(dispatcher):
+    """
+    Finish received updates, log database and FSM storage statistics, stop scheduler (leadership goes to another
+    instance), flush buffered writes and release shared connections
+    """
+
+    await dispatcher.workers.join()
+    LOGGER.info("Update workers statistics: %s", dispatcher.workers.stats())
+    LOGGER.info("MongoDB pool statistics: %s", get_pool_stats())
+    LOGGER.info("Records cache statistics: %s", get_cache_stats())
+    LOGGER.info("Outbox statistics: %s", get_outbox_stats())
+    LOGGER.info("FSM storage statistics: %s", await get_fsm_storage().stats())
+    await stop_scheduler()
+    close_write_buffers()
+    close_clients()
 
 if __name__ == "__main__":
     LOGGER.info("Starting bot")
@@ -37,6 +68,5 @@ if __name__ == "__main__":
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    dispatcher = Dispatcher(bot, storage=MemoryStorage(), loop=loop)
-    dispatcher.loop.create_task(init_bot(dispatcher, bot))
-    executor.start_polling(dispatcher, skip_updates=True)
+    dispatcher = create_dispatcher(bot, storage=get_fsm_storage(), loop=loop)
+    start_updates(dispatcher, on_startup=init_bot, on_shutdown=shutdown_bot)
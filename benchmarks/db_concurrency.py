@@ -0,0 +1,83 @@
+"""
+Benchmark: concurrent database updates from event loop handlers
+
+Compares direct blocking wrapper calls (old behaviour) with awaited thread-offloaded calls.
+Each simulated handler performs one UserDatabase.update, while a ticker coroutine measures
+how long the event loop was unable to serve anything else.
+Runs against the backend from database_config.json ("backend": "memory" needs no MongoDB server).
+
+Usage: python -m benchmarks.db_concurrency --updates 500
+"""
+
+import time
+import asyncio
+import argparse
+
+from database.database import UserDatabase
+from database.async_database import AsyncUserDatabase
+
+BENCH_PREFIX = "benchmark-user"
+
+
+async def _ticker(stop: asyncio.Event, interval: float, lags: list):
+    """
+    Measure event loop lag: how late each tick wakes up
+    """
+
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def _run(mode: str, updates: int, tick: float) -> dict:
+    db = AsyncUserDatabase()
+
+    async def blocking_handler(index):
+        db.sync.update(f"{BENCH_PREFIX}-{index}", {"counter": index})
+
+    async def async_handler(index):
+        await db.update(f"{BENCH_PREFIX}-{index}", {"counter": index})
+
+    handler = blocking_handler if mode == "blocking" else async_handler
+    stop, lags = asyncio.Event(), []  # type: ignore
+    ticker = asyncio.create_task(_ticker(stop, tick, lags))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(index) for index in range(updates)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await ticker
+    return {
+        "mode": mode,
+        "updates": updates,
+        "seconds": elapsed,
+        "updates_per_sec": updates / elapsed if elapsed else float("inf"),
+        "max_loop_lag_ms": max(lags, default=0) * 1000,
+    }
+
+
+def main():
+    """
+    Run both modes and print results table
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=500, help="number of concurrent updates per mode")
+    parser.add_argument("--tick", type=float, default=0.005, help="event loop lag probe interval, seconds")
+    args = parser.parse_args()
+
+    try:
+        for mode in ("blocking", "async"):
+            res = asyncio.run(_run(mode, args.updates, args.tick))
+            print(f"{res['mode']:>9}: {res['updates']} updates in {res['seconds']:.3f}s "
+                  f"({res['updates_per_sec']:.1f}/s), max loop lag {res['max_loop_lag_ms']:.1f} ms")
+    finally:
+        cleanup = UserDatabase()
+        cleanup.client[cleanup.db_name][cleanup.default_collection].delete_many(
+            {"user_id": {"$regex": f"^{BENCH_PREFIX}-"}})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark: per-call logging overhead of Database.find_one
+
+Compares the old eager f-string message with the whole record (`Found record: {res}`) and
+the deferred size-capped summary now used by the database layer. The record imitates a classroom
+with not migrated embedded binaries. Messages go through a file handler writing to os.devnull,
+so formatting and handler work are measured without disk latency.
+
+Usage: python -m benchmarks.db_logging --calls 200 --file-kb 512
+"""
+
+import os
+import time
+import logging
+import argparse
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+
+from database.log_summary import Summary
+
+
+def _record(files: int, file_kb: int, students: int) -> dict:
+    payload = Binary(os.urandom(file_kb * 1024))
+    return {
+        "_id": ObjectId(),
+        "classroom_id": "benchmark-classroom",
+        "name": "Benchmark classroom",
+        "teachers": [1, 2],
+        "students": [{"id": index, "name": f"Student {index}"} for index in range(students)],
+        "tasks": [{"id": index, "name": f"Task {index}", "files": [{"filename": f"task{index}.pdf", "file": payload}]}
+                  for index in range(files)],
+    }
+
+
+def _logger(level) -> logging.Logger:
+    logger = logging.getLogger("benchmarks.db_logging")
+    logger.propagate = False
+    logger.handlers = [logging.FileHandler(os.devnull)]
+    logger.setLevel(level)
+    return logger
+
+
+def _measure(logger: logging.Logger, mode: str, record: dict, calls: int) -> float:
+    """
+    :return: microseconds per call
+    """
+
+    query = {"classroom_id": record["classroom_id"]}
+    records = logging.getLogger("benchmarks.db_logging.records")
+    records.setLevel(logging.INFO)  # opt-in channel is off by default
+    started = time.perf_counter()
+    for _ in range(calls):
+        if mode == "eager":
+            logger.info(f"Found record: {record} by query: {query}")  # pylint: disable=logging-fstring-interpolation
+        else:
+            logger.info("Found record %s in '%s' by query: %s", Summary(record), "classrooms", Summary(query))
+            records.debug("Found record: %r", record)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    """
+    Run both modes with INFO enabled and disabled and print results table
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200, help="log calls per mode")
+    parser.add_argument("--files", type=int, default=5, help="embedded files in record")
+    parser.add_argument("--file-kb", type=int, default=512, help="size of each embedded file, KiB")
+    parser.add_argument("--students", type=int, default=30, help="students in record")
+    args = parser.parse_args()
+
+    record = _record(args.files, args.file_kb, args.students)
+    for level in (logging.INFO, logging.WARNING):
+        logger = _logger(level)
+        eager = _measure(logger, "eager", record, args.calls)
+        lazy = _measure(logger, "lazy", record, args.calls)
+        print(f"{logging.getLevelName(level):>7}: eager {eager:10.1f} us/call, lazy {lazy:8.1f} us/call "
+              f"({eager / lazy:.0f}x less overhead)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark: update ingestion throughput, long polling and webhook
+
+Compares aiogram's own update processing (every polled batch at once, webhook updates inside the request)
+with UpdateWorkers (bounded concurrency, updates of one chat in order). A backlog of updates from a number of chats
+is processed by a handler that waits `latency` seconds, like a handler making one Telegram API call.
+Polling reads the backlog from a fake getUpdates with `rtt` seconds of network delay, webhook updates are posted
+to a local aiohttp server by `connections` parallel senders (Telegram's max_connections). Needs no network.
+
+Usage: python -m benchmarks.update_throughput --updates 2000 --chats 200
+"""
+
+import time
+import asyncio
+import argparse
+
+import aiohttp
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY, WebhookRequestHandler
+
+from infrastructure.updates import QueuedWebhookHandler, WorkerDispatcher
+
+BENCH_TOKEN = "123456789:" + "A" * 35
+WEBHOOK_PATH = "/bot"
+
+
+# pylint: disable = too-few-public-methods, too-many-instance-attributes
+
+
+def _backlog(updates: int, chats: int) -> list:
+    return [{"update_id": index + 1,
+             "message": {"message_id": index + 1, "date": 0, "text": "benchmark",
+                         "chat": {"id": index % chats + 1, "type": "private"},
+                         "from": {"id": index % chats + 1, "is_bot": False, "first_name": "benchmark"}}}
+            for index in range(updates)]
+
+
+class _Probe:
+    """
+    Handler counting processed updates, handlers running at once and updates of one chat handled out of order
+    or while another update of the chat was still running (handlers keep per-chat state, both break it)
+    """
+
+    def __init__(self, total: int, latency: float):
+        self.total = total
+        self.latency = latency
+        self.running = self.max_running = self.handled = self.out_of_order = self.overlaps = 0
+        self.last_seen: dict = {}
+        self.chat_running: dict = {}
+        self.finished = asyncio.Event()
+
+    async def handle(self, message: types.Message):
+        """
+        Message handler simulating one Telegram API call
+        """
+
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        if message.message_id < self.last_seen.get(message.chat.id, 0):
+            self.out_of_order += 1
+        self.last_seen[message.chat.id] = message.message_id
+        if self.chat_running.get(message.chat.id):
+            self.overlaps += 1
+        self.chat_running[message.chat.id] = self.chat_running.get(message.chat.id, 0) + 1
+        await asyncio.sleep(self.latency)
+        self.chat_running[message.chat.id] -= 1
+        self.running -= 1
+        self.handled += 1
+        if self.handled == self.total:
+            self.finished.set()
+
+
+def _dispatcher(workers: bool, args) -> Dispatcher:
+    bot = Bot(token=BENCH_TOKEN)
+    if workers:
+        return WorkerDispatcher(bot, concurrency=args.concurrency, max_pending=args.max_pending)
+    return Dispatcher(bot)
+
+
+async def _polling(dispatcher: Dispatcher, backlog: list, rtt: float):
+    async def get_updates(limit=None, offset=None, **kwargs):  # pylint: disable=unused-argument
+        await asyncio.sleep(rtt)
+        start = (offset or 1) - 1
+        return [types.Update(**update) for update in backlog[start:start + (limit or 100)]]
+
+    dispatcher.bot.get_updates = get_updates  # type: ignore
+    return asyncio.create_task(dispatcher.start_polling(reset_webhook=False, relax=0))
+
+
+async def _webhook(dispatcher: Dispatcher, backlog: list, connections: int, handler) -> web.AppRunner:
+    app = web.Application()
+    app[BOT_DISPATCHER_KEY] = dispatcher
+    app.router.add_route("*", WEBHOOK_PATH, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}{WEBHOOK_PATH}"
+
+    async def sender(session, index):  # one chat is served by one connection, so updates of a chat arrive in order
+        for update in backlog:
+            if update["message"]["chat"]["id"] % connections == index:
+                async with session.post(url, json=update) as response:
+                    await response.read()
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections)) as session:
+        await asyncio.gather(*(sender(session, index) for index in range(connections)))
+    return runner
+
+
+async def _run(mode: str, workers: bool, args) -> dict:
+    backlog = _backlog(args.updates, args.chats)
+    dispatcher = _dispatcher(workers, args)
+    probe = _Probe(args.updates, args.latency)
+    dispatcher.register_message_handler(probe.handle)
+    Dispatcher.set_current(dispatcher)
+    Bot.set_current(dispatcher.bot)
+
+    started = time.perf_counter()
+    if mode == "polling":
+        polling = await _polling(dispatcher, backlog, args.rtt)
+        await probe.finished.wait()
+        elapsed = time.perf_counter() - started
+        dispatcher.stop_polling()
+        await polling
+    else:
+        handler = QueuedWebhookHandler if workers else WebhookRequestHandler
+        runner = await _webhook(dispatcher, backlog, args.connections, handler)
+        await probe.finished.wait()
+        elapsed = time.perf_counter() - started
+        await runner.cleanup()
+    await (await dispatcher.bot.get_session()).close()
+    return {
+        "mode": f"{mode}/{'workers' if workers else 'aiogram'}",
+        "seconds": elapsed,
+        "updates_per_sec": args.updates / elapsed if elapsed else float("inf"),
+        "max_running": probe.max_running,
+        "out_of_order": probe.out_of_order,
+        "overlaps": probe.overlaps,
+    }
+
+
+def main():
+    """
+    Run both ingestion modes with and without workers and print results table
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000, help="number of updates in the backlog")
+    parser.add_argument("--chats", type=int, default=200, help="number of chats the updates come from")
+    parser.add_argument("--latency", type=float, default=0.05, help="handler duration, seconds")
+    parser.add_argument("--rtt", type=float, default=0.05, help="getUpdates network delay, seconds")
+    parser.add_argument("--connections", type=int, default=40, help="parallel webhook requests")
+    parser.add_argument("--concurrency", type=int, default=32, help="UpdateWorkers concurrency")
+    parser.add_argument("--max-pending", type=int, default=1000, help="UpdateWorkers pending limit")
+    args = parser.parse_args()
+
+    for mode in ("polling", "webhook"):
+        for workers in (False, True):
+            res = asyncio.run(_run(mode, workers, args))
+            print(f"{res['mode']:>16}: {args.updates} updates in {res['seconds']:.3f}s ({res['updates_per_sec']:.1f}/s), "
+                  f"max {res['max_running']} handlers at once, {res['out_of_order']} out of chat order, "
+                  f"{res['overlaps']} overlapping in chat")
+
+
+if __name__ == "__main__":
+    main()
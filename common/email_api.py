@@ -22,7 +22,7 @@ def send_mail(mail_to, subject, text_message, attachments=None) -> bool:
     :param mail_to: str or list of receivers
     :param subject: str
     :param text_message: str
-    :param attachments: list of dicts {"filename": name, "file": Binary}
+    :param attachments: list of dicts {"filename": name, "file": Binary or readable binary stream}
     :return:
     """
 
@@ -42,9 +42,10 @@ def send_mail(mail_to, subject, text_message, attachments=None) -> bool:
     email_message["To"] = ",".join(mail_to)
     email_message["Subject"] = subject
 
-    for attachment in attachments:
+    for attachment in attachments or []:
+        contents = attachment["file"]
         part = MIMEApplication(
-            attachment["file"],
+            contents.read() if hasattr(contents, "read") else contents,
             Name=attachment["filename"]
         )
         part["Content-Disposition"] = f'attachment; filename="{attachment["filename"]}"'
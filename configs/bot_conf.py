@@ -55,6 +55,105 @@ DEFAULT_SCHEMA = {
                 }
             },
             "required": ["API_URL", "API_KEY"]
+        },
+        "OUTBOX": {
+            "type": "object",
+            "properties": {
+                "RATE": {
+                    "type": "number",
+                    "exclusiveMinimum": 0
+                },
+                "CHAT_RATE": {
+                    "type": "number",
+                    "exclusiveMinimum": 0
+                },
+                "CHAT_BURST": {
+                    "type": "integer",
+                    "minimum": 1
+                },
+                "CONCURRENCY": {
+                    "type": "integer",
+                    "minimum": 1
+                },
+                "MAX_RETRIES": {
+                    "type": "integer",
+                    "minimum": 0
+                }
+            }
+        },
+        "FSM": {
+            "type": "object",
+            "properties": {
+                "PERSISTENT": {
+                    "type": "boolean"
+                },
+                "PATH": {
+                    "type": "string"
+                },
+                "TTL_HOURS": {
+                    "type": "number",
+                    "exclusiveMinimum": 0
+                },
+                "MAX_SESSIONS": {
+                    "type": "integer",
+                    "minimum": 1
+                },
+                "FLUSH_INTERVAL": {
+                    "type": "number",
+                    "minimum": 0
+                }
+            }
+        },
+        "UPDATES": {
+            "type": "object",
+            "properties": {
+                "MODE": {
+                    "enum": ["polling", "webhook"]
+                },
+                "CONCURRENCY": {
+                    "type": "integer",
+                    "minimum": 1
+                },
+                "MAX_PENDING": {
+                    "type": "integer",
+                    "minimum": 1
+                },
+                "POLLING_TIMEOUT": {
+                    "type": "integer",
+                    "minimum": 0
+                },
+                "WEBHOOK_URL": {
+                    "type": "string"
+                },
+                "WEBHOOK_PATH": {
+                    "type": "string"
+                },
+                "HOST": {
+                    "type": "string"
+                },
+                "PORT": {
+                    "type": "integer"
+                },
+                "MAX_CONNECTIONS": {
+                    "type": "integer",
+                    "minimum": 1,
+                    "maximum": 100
+                },
+                "CHECK_IP": {
+                    "type": "boolean"
+                }
+            },
+            "if": {
+                "properties": {
+                    "MODE": {
+                        "const": "webhook"
+                    }
+                },
+                "required": ["MODE"]
+            },
+            "then": {
+                "required": ["WEBHOOK_URL"]
+            }
         }
     },
     "required": ["BOT"]
@@ -0,0 +1,82 @@
+"""
+Asyncio facade for database handlers
+Blocking pymongo calls are offloaded to a thread pool, so one slow round trip
+does not stall the event loop for every other chat
+"""
+
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from database.database import Database, UserDatabase, ClassroomDatabase, DeadlineDatabase
+
+DB_WORKERS = 20  # Upper bound of simultaneously running blocking database calls
+EXECUTOR = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="altedy-db")
+
+
+# pylint: disable = too-few-public-methods
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run blocking callable in database thread pool and wait for the result without blocking the loop
+
+    :param func: callable to run
+    :param args: positional arguments for func
+    :param kwargs: keyword arguments for func
+    :return: func result
+    """
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+class AsyncDatabase:
+    """
+    General awaitable wrapper over synchronous Database handlers.
+    Exposes every public method of the wrapped handler as a coroutine with the same signature,
+    e.g. `await AsyncUserDatabase().get_type(user_id)`
+    """
+
+    def __init__(self, database: Database):
+        self.sync = database
+
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await run_blocking(attr, *args, **kwargs)
+
+        setattr(self, name, wrapper)  # cache wrapper, next lookups won't reach __getattr__
+        return wrapper
+
+
+class AsyncUserDatabase(AsyncDatabase):
+    """
+    Awaitable handler for users actions in DB (see UserDatabase)
+    """
+
+    def __init__(self, database: UserDatabase = None):
+        super().__init__(database or UserDatabase())
+
+
+class AsyncClassroomDatabase(AsyncDatabase):
+    """
+    Awaitable handler for classrooms actions in DB (see ClassroomDatabase)
+    """
+
+    def __init__(self, database: ClassroomDatabase = None):
+        super().__init__(database or ClassroomDatabase())
+
+
+class AsyncDeadlineDatabase(AsyncDatabase):
+    """
+    Awaitable handler for deadlines actions in DB (see DeadlineDatabase)
+    """
+
+    def __init__(self, database: DeadlineDatabase = None):
+        super().__init__(database or DeadlineDatabase())
@@ -0,0 +1,355 @@
+"""
+Attachments storage
+Task and submission files are kept out of classroom documents: records store only a lightweight reference
+{"filename": ..., "blob_id": ..., "size": ...}, bytes are streamed from the blob store on demand.
+Blobs are content-addressed (blob_id is SHA-256 of contents), so a file attached to several tasks or submitted
+again is stored once. References are counted in "blob_refs" collection of the classrooms database,
+blobs nobody refers to any more are removed by collect_garbage. A blob being removed has its counter marked "deleting":
+put waits until the removal is over and stores the contents anew, so a blob put concurrently is never lost.
+Configure with the optional "blobs" section of database_config.json:
+{"backend": "gridfs", "bucket": "attachments"} (stored in classrooms database), {"backend": "local", "path": "..."}
+or {"backend": "memory"} (default for the in-memory database backend)
+"""
+
+import io
+import os
+import abc
+import hashlib
+import time
+import tempfile
+import threading
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple, Union
+
+import gridfs
+
+from bson.objectid import ObjectId
+from gridfs.errors import FileExists
+from pymongo.errors import DuplicateKeyError
+
+from configs.logger_conf import configure_logger
+from database.database import ClassroomDatabase, _load_from_json
+from database.pool import get_client
+
+LOGGER = configure_logger(__name__)
+
+CHUNK_SIZE = 255 * 1024  # GridFS default chunk size, used for local copying as well
+GARBAGE_GRACE_PERIOD = timedelta(hours=1)  # Unreferenced blobs are kept this long in case they are put again
+DELETION_TIMEOUT = timedelta(minutes=1)  # Blob removal marked longer ago is considered abandoned (process stopped)
+DELETION_POLL = 0.05  # Seconds between checks whether a blob being removed is gone
+
+
+def _as_stream(source: Union[bytes, BinaryIO]) -> BinaryIO:
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+
+def _hashed_spool(stream: BinaryIO) -> Tuple[str, int, BinaryIO]:
+    """
+    Copy stream to a spooled temporary file computing SHA-256 on the way
+
+    :return: (hex digest, size, spooled file positioned at start)
+    """
+
+    digest, size = hashlib.sha256(), 0
+    spooled = tempfile.SpooledTemporaryFile(max_size=16 * CHUNK_SIZE)  # pylint: disable=consider-using-with
+    while chunk := stream.read(CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return digest.hexdigest(), size, spooled  # type: ignore
+
+
+class BlobStore(abc.ABC):
+    """
+    General interface of content-addressed attachments storage with reference counting
+    """
+
+    def __init__(self, refs=None):
+        """
+        :param refs: collection of reference counters
+        {"_id": blob_id, "refs": ..., "size": ..., "released_at": ..., "deleting": ...},
+        leave empty to disable counting (blobs are never collected)
+        """
+
+        self._refs = refs
+
+    def put(self, source: Union[bytes, BinaryIO], filename: str) -> dict:
+        """
+        Store file contents (once for equal contents) and acquire a reference to them
+
+        :param source: bytes or readable binary stream
+        :param filename: original file name
+        :return: reference to keep in MongoDB record: {"filename": ..., "blob_id": ..., "size": ...}
+        """
+
+        blob_id, size, spooled = _hashed_spool(_as_stream(source))
+        with spooled:
+            self._acquire(blob_id, size)  # contents are stored after that, so collect_garbage can not remove them
+            try:
+                stored = self._store(blob_id, spooled, filename)
+            except Exception:
+                self.release(blob_id)
+                raise
+        LOGGER.info("[%s] %s %s (%d bytes) as %s", type(self).__name__, "Stored" if stored else "Deduplicated",
+                    filename, size, blob_id)
+        return {"filename": filename, "blob_id": blob_id, "size": size}
+
+    def _acquire(self, blob_id, size: int):
+        """
+        Count one more reference to blob, wait while collect_garbage is removing it
+        """
+
+        if self._refs is None:
+            return
+        while True:
+            try:
+                self._refs.update_one({"_id": blob_id, "deleting": {"$exists": False}},
+                                      {"$inc": {"refs": 1}, "$set": {"size": size}, "$unset": {"released_at": ""}},
+                                      upsert=True)
+                return
+            except DuplicateKeyError:  # counter is marked "deleting"
+                self._refs.delete_one({"_id": blob_id, "deleting": {"$lt": datetime.utcnow() - DELETION_TIMEOUT}})
+                time.sleep(DELETION_POLL)
+
+    @abc.abstractmethod
+    def _store(self, blob_id: str, stream: BinaryIO, filename: str) -> bool:
+        """
+        Save contents under their hash unless already saved
+
+        :param blob_id: SHA-256 of contents
+        :param stream: contents positioned at start
+        :param filename:
+        :return: whether contents were new
+        """
+
+    def release(self, blob_id):
+        """
+        Drop one reference to blob (when a record referring to it is replaced or removed)
+
+        :param blob_id:
+        :return: None
+        """
+
+        if self._refs is not None:
+            self._refs.update_one({"_id": blob_id, "refs": {"$gt": 0}},
+                                  {"$inc": {"refs": -1}, "$currentDate": {"released_at": True}})
+
+    def release_files(self, files: list):
+        """
+        Drop references of record attachments
+
+        :param files: [{"filename": ..., "blob_id": ...}, ...] (embedded legacy files are skipped)
+        :return: None
+        """
+
+        for file in files:
+            if "blob_id" in file:
+                self.release(file["blob_id"])
+
+    def collect_garbage(self, grace_period: timedelta = GARBAGE_GRACE_PERIOD) -> int:
+        """
+        Remove blobs without references released more than grace_period ago
+
+        :param grace_period:
+        :return: number of removed blobs
+        """
+
+        if self._refs is None:
+            return 0
+        removed = 0
+        now = datetime.utcnow()
+        expired = {"refs": {"$lte": 0}, "released_at": {"$lt": now - grace_period},
+                   "$or": [{"deleting": {"$exists": False}}, {"deleting": {"$lt": now - DELETION_TIMEOUT}}]}
+        for record in list(self._refs.find(expired, {"_id": 1})):
+            # counter is marked instead of removed: put waits for the end of removal instead of deduplicating
+            if self._refs.update_one({"_id": record["_id"], **expired}, {"$currentDate": {"deleting": True}}).modified_count:
+                self.delete(record["_id"])
+                self._refs.delete_one({"_id": record["_id"], "deleting": {"$exists": True}})
+                removed += 1
+        LOGGER.info("[%s] Removed %d unreferenced blobs", type(self).__name__, removed)
+        return removed
+
+    def put_file(self, file_path) -> dict:
+        """
+        Store file from disk without reading it into memory at once
+
+        :param file_path:
+        :return: reference dict (see put)
+        """
+
+        with open(file_path, "rb") as file:
+            return self.put(file, Path(file_path).name)
+
+    @abc.abstractmethod
+    def open(self, blob_id) -> BinaryIO:
+        """
+        Open stored file for streaming read
+
+        :param blob_id:
+        :return: readable binary stream (close after use)
+        """
+
+    def read(self, blob_id) -> bytes:
+        """
+        Read whole stored file
+
+        :param blob_id:
+        :return: bytes
+        """
+
+        with self.open(blob_id) as stream:
+            return stream.read()
+
+    @abc.abstractmethod
+    def delete(self, blob_id):
+        """
+        Remove stored file
+
+        :param blob_id:
+        :return: None
+        """
+
+
+class GridFSBlobStore(BlobStore):
+    """
+    Blob store on top of MongoDB GridFS bucket
+    """
+
+    def __init__(self, client, db_name, bucket_name="attachments", refs=None):
+        super().__init__(refs)
+        self._files = client[db_name][f"{bucket_name}.files"]
+        self._bucket = gridfs.GridFSBucket(client[db_name], bucket_name=bucket_name, chunk_size_bytes=CHUNK_SIZE)
+
+    @staticmethod
+    def _file_id(blob_id):
+        # Blobs uploaded before content addressing have ObjectId identifiers
+        return ObjectId(blob_id) if ObjectId.is_valid(blob_id) and len(str(blob_id)) == 24 else blob_id
+
+    def _store(self, blob_id, stream, filename):
+        if self._files.find_one({"_id": blob_id}, {"_id": 1}) is not None:
+            return False
+        try:
+            self._bucket.upload_from_stream_with_id(blob_id, filename, stream)
+        except FileExists:  # same contents uploaded concurrently
+            return False
+        return True
+
+    def open(self, blob_id):
+        return self._bucket.open_download_stream(self._file_id(blob_id))
+
+    def delete(self, blob_id):
+        self._bucket.delete(self._file_id(blob_id))
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Content-addressed directory: files are named by SHA-256 of their contents
+    """
+
+    def __init__(self, root, refs=None):
+        super().__init__(refs)
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, blob_id) -> Path:
+        return self._root / blob_id[:2] / blob_id
+
+    def _store(self, blob_id, stream, filename):
+        path = self._path(blob_id)
+        if path.exists():
+            return False
+        with tempfile.NamedTemporaryFile(dir=self._root, delete=False) as temp_file:
+            while chunk := stream.read(CHUNK_SIZE):
+                temp_file.write(chunk)
+        path.parent.mkdir(exist_ok=True)
+        os.replace(temp_file.name, path)  # same contents - same name, so concurrent overwriting is harmless
+        return True
+
+    def open(self, blob_id):
+        return open(self._path(blob_id), "rb")  # pylint: disable=consider-using-with
+
+    def delete(self, blob_id):
+        self._path(blob_id).unlink(missing_ok=True)
+
+
+class MemoryBlobStore(BlobStore):
+    """
+    Process-local blob store for the in-memory database backend (tests and benchmarks)
+    """
+
+    def __init__(self, refs=None):
+        super().__init__(refs)
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def _store(self, blob_id, stream, filename):
+        with self._lock:
+            if blob_id in self._blobs:
+                return False
+            self._blobs[blob_id] = stream.read()
+        return True
+
+    def open(self, blob_id):
+        with self._lock:
+            return io.BytesIO(self._blobs[blob_id])
+
+    def delete(self, blob_id):
+        with self._lock:
+            self._blobs.pop(blob_id, None)
+
+
+_STORE: Optional[BlobStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """
+    Get process-wide blob store configured in database_config.json
+
+    :return: BlobStore
+    """
+
+    global _STORE  # pylint: disable=global-statement
+    with _STORE_LOCK:
+        if _STORE is None:
+            config = _load_from_json(ClassroomDatabase._default_file_path)  # pylint: disable=protected-access
+            blobs, classrooms = config.get("blobs", {}), config["classrooms"]
+            client = get_client(classrooms["url"], config.get("pool"), config.get("backend"))
+            db_name = blobs.get("db_name", classrooms["db_name"])
+            refs = client[db_name][blobs.get("refs_collection", "blob_refs")]
+            backend = blobs.get("backend", "memory" if config.get("backend") == "memory" else "gridfs")
+            if backend == "local":
+                _STORE = LocalBlobStore(blobs.get("path", Path(__file__).resolve().parent.parent / "blobs"), refs)
+            elif backend == "memory":
+                _STORE = MemoryBlobStore(refs)
+            else:
+                _STORE = GridFSBlobStore(client, db_name, blobs.get("bucket", "attachments"), refs)
+        return _STORE
+
+
+def open_attachment(attachment: dict) -> BinaryIO:
+    """
+    Open attachment stored either as a reference or (not migrated records) as embedded binary
+
+    :param attachment: {"filename": ..., "blob_id": ...} or {"filename": ..., "file": Binary}
+    :return: readable binary stream
+    """
+
+    if "file" in attachment:
+        return io.BytesIO(bytes(attachment["file"]))
+    return get_blob_store().open(attachment["blob_id"])
+
+
+def read_attachment(attachment: dict) -> bytes:
+    """
+    Read attachment contents (see open_attachment)
+
+    :param attachment:
+    :return: bytes
+    """
+
+    with open_attachment(attachment) as stream:
+        return stream.read()
@@ -0,0 +1,165 @@
+"""
+Bounded read-through cache for frequently requested records
+Entries expire after TTL, least recently used entries are evicted when the cache is full.
+Empty values (records not found) live only EMPTY_TTL: a record created right after a miss, e.g. by registration
+on another bot instance, becomes visible quickly
+"""
+
+import copy
+import time
+import threading
+
+from collections import OrderedDict
+from typing import Dict
+
+EMPTY_TTL = 2.0  # Seconds empty values (records not found) are cached, absorbs repeated lookups within one update
+
+_MISSING = object()
+
+
+# pylint: disable = too-many-instance-attributes
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with entries time-to-live.
+    Keys are tuples, the first element is a record ID used for invalidation: (record_id, *variant)
+    """
+
+    def __init__(self, max_size=1024, ttl=60.0, empty_ttl=EMPTY_TTL):
+        """
+        :param max_size: max number of entries
+        :param ttl: entry time-to-live, seconds
+        :param empty_ttl: time-to-live of empty values (e.g. {} for a record not found), 0 to not cache them
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.empty_ttl = min(empty_ttl, ttl)
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped on invalidation, protects from caching values loaded before a write
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, default=None):
+        """
+        Get cached value (a copy, so callers may modify it)
+
+        :param key: tuple (record_id, *variant)
+        :param default: returned on miss
+        :return: cached value or default
+        """
+
+        with self._lock:
+            expires_at, value = self._entries.get(key, (0.0, _MISSING))
+            if value is not _MISSING and expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(value)
+
+    def set(self, key, value, generation=None):
+        """
+        Store value, evicting least recently used entries if needed
+
+        :param key: tuple (record_id, *variant)
+        :param value:
+        :param generation: skip storing if cache was invalidated since this generation was read
+        :return: None
+        """
+
+        ttl = self.empty_ttl if value in (None, {}, []) else self.ttl
+        if ttl <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        Read-through access: get cached value or call loader and cache its result
+
+        :param key: tuple (record_id, *variant)
+        :param loader: callable without arguments returning value
+        :return: value
+        """
+
+        generation = self._generation
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self, record_id=_MISSING):
+        """
+        Drop every cached variant of record, or the whole cache if record_id is not passed
+
+        :param record_id:
+        :return: None
+        """
+
+        with self._lock:
+            self._generation += 1
+            if record_id is _MISSING:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == record_id]:
+                    del self._entries[key]
+
+    def stats(self) -> dict:
+        """
+        Cache counters for size tuning
+
+        :return: dict
+        """
+
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl, "empty_ttl": self.empty_ttl,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "expirations": self.expirations}
+
+
+_CACHES: Dict[str, TTLCache] = {}
+_LOCK = threading.Lock()
+
+
+def get_cache(name: str, max_size=1024, ttl=60.0, empty_ttl=EMPTY_TTL) -> TTLCache:
+    """
+    Get process-wide named cache, create it on first request.
+    Size and TTL are applied only when the cache is created
+
+    :param name: e.g. "users"
+    :param max_size: max number of entries
+    :param ttl: entry time-to-live, seconds
+    :param empty_ttl: time-to-live of empty values, seconds
+    :return: TTLCache
+    """
+
+    with _LOCK:
+        if name not in _CACHES:
+            _CACHES[name] = TTLCache(max_size, ttl, empty_ttl)
+        return _CACHES[name]
+
+
+def get_cache_stats() -> dict:
+    """
+    Statistics of every created cache
+
+    :return: {name: {"hits": ..., "misses": ..., "evictions": ..., ...}}
+    """
+
+    with _LOCK:
+        caches = dict(_CACHES)
+    return {name: cache.stats() for name, cache in caches.items()}
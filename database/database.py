@@ -4,22 +4,36 @@ Designed for MongoDB
 Edit database_config.json for custom settings
 """
 
+import os
 import json
+import logging
 
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 
-import pymongo
+from pymongo import ASCENDING, IndexModel, ReplaceOne, UpdateOne, UpdateMany, DeleteOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 from configs.logger_conf import configure_logger
 from configs.bot_conf import ConfigException
+from database.pool import get_client
+from database.cache import TTLCache, get_cache
+from database.write_buffer import WriteBuffer, get_write_buffer
+from database.log_summary import Summary
 
 LOGGER = configure_logger(__name__)
 
+# Full records are dumped only when this channel is enabled: set ALTEDY_LOG_RECORDS=1
+RECORDS_LOGGER = logging.getLogger(f"{__name__}.records")
+RECORDS_LOGGER.setLevel(logging.DEBUG if os.environ.get("ALTEDY_LOG_RECORDS") else logging.INFO)
 
-# pylint: disable = too-many-lines, no-name-in-module, import-error, multiple-imports, logging-fstring-interpolation, too-many-arguments # noqa
 
+# pylint: disable = too-many-lines, no-name-in-module, import-error, multiple-imports, too-many-arguments # noqa
 
+
+@lru_cache(maxsize=None)
 def _load_from_json(_path) -> dict:
     try:
         with open(_path, encoding="utf-8") as cfg_file:
@@ -33,27 +47,149 @@ class Database:
     General wrapper class for MongoDB default methods
     """
 
-    def __init__(self, url, db_name, default_collection=None):
-        self.client = pymongo.MongoClient(url)
+    # Index manifest: collection attribute name (e.g. "default_collection") -> indexes to create at startup
+    INDEXES: Dict[str, List[IndexModel]] = {}
+    # Typical queries of the wrapper: collection attribute name -> filters expected to use an index
+    QUERY_SHAPES: Dict[str, List[dict]] = {}
+
+    def __init__(self, url, db_name, default_collection=None, pool_options=None,
+                 write_behind=None, backend=None):
+        self.client = get_client(url, pool_options, backend)
+        self.backend = backend or "mongodb"
         self.db_name = db_name
         self.default_collection = default_collection
 
-    def upload(self, primary_key, data, collection_name=None):
+        # Opt-in write-behind buffer ("write_behind" section of database_config.json)
+        self._write_buffer: Optional[WriteBuffer] = None
+        if write_behind and write_behind.get("enabled"):
+            self._write_buffer = get_write_buffer(self.client, url, db_name, write_behind)
+
+        # Read-through cache of default collection records, set up by subclasses (see cached_find_one).
+        # Writes invalidate it in this process only: writes of other bot instances become visible after
+        # the cache TTL ("ttl" of the "cache" section, 60 s by default; "empty_ttl", 2 s, for records not found)
+        self._cache: Optional[TTLCache] = None
+        self._cache_field: Optional[str] = None  # record ID field, e.g. "user_id"
+
+    def _invalidate(self, primary_key: dict, collection_name):
+        """
+        Drop cached copies of records affected by write
+        """
+
+        if self._cache is None or collection_name != self.default_collection:
+            return
+        record_id = primary_key.get(self._cache_field)
+        if record_id is None or isinstance(record_id, dict):  # not an exact record key, e.g. {"$in": [...]}
+            self._cache.invalidate()
+        else:
+            self._cache.invalidate(record_id)
+
+    def _buffer_write(self, collection_name, operation, primary_key, buffered=True) -> bool:
+        """
+        Queue write in write-behind buffer (if enabled).
+        Unbuffered writes wait for already queued ones, so the order of writes is kept
+
+        :return: True if write was queued and should not be executed now
+        """
+
+        if self._write_buffer is None:
+            return False
+        if not buffered:
+            self._write_buffer.flush(collection_name)
+            return False
+        self._write_buffer.add(collection_name, operation)
+        self._invalidate(primary_key, collection_name)
+        LOGGER.debug("Buffered write to '%s': %s", collection_name, Summary(primary_key))
+        return True
+
+    def _flush_writes(self, collection_name=None):
+        """
+        Send buffered writes before reading, so the process always reads its own writes
+        """
+
+        if self._write_buffer is not None:
+            self._write_buffer.flush(collection_name)
+
+    def cached_find_one(self, record_id, projection=None) -> dict:
+        """
+        Find default collection record by ID through read-through cache
+        (falls back to find_one if cache is not set up). The record may be up to the cache TTL stale
+        when another bot instance changed it, use find_one where that matters
+
+        :param record_id: value of record ID field (e.g. user_id)
+        :param projection: fields to return, leave empty to get whole record
+        :return: dict
+        """
+
+        def load():
+            return self.find_one({self._cache_field: record_id}, projection=projection)
+
+        if self._cache is None:
+            return load()
+        key = (record_id, json.dumps(projection, sort_keys=True, default=str) if projection else None)
+        return self._cache.get_or_load(key, load)
+
+    def ensure_indexes(self):
+        """
+        Create indexes declared in INDEXES manifest (already existing indexes are left as is)
+
+        :return: None
+        """
+
+        for collection_attr, indexes in self.INDEXES.items():
+            collection_name = getattr(self, collection_attr)
+            try:
+                created = self.client[self.db_name][collection_name].create_indexes(indexes)
+                LOGGER.info("Ensured indexes %s on collection '%s'", created, collection_name)
+            except OperationFailure as err:
+                LOGGER.error("Could not create indexes on collection '%s': %s", collection_name, err)
+
+    def check_query_plans(self) -> list:
+        """
+        Explain QUERY_SHAPES queries and log those executed as a collection scan
+
+        :return: list of (collection_name, query) doing COLLSCAN
+        """
+
+        if self.backend == "memory":  # no query planner
+            return []
+
+        def has_collscan(plan: dict) -> bool:
+            return plan.get("stage") == "COLLSCAN" or any(
+                has_collscan(child) for child in [plan.get("queryPlan", {}), plan.get("inputStage", {}),
+                                                  *plan.get("inputStages", [])] if child)
+
+        collscans = []
+        for collection_attr, queries in self.QUERY_SHAPES.items():
+            collection_name = getattr(self, collection_attr)
+            for query in queries:
+                plan = self.client[self.db_name][collection_name].find(query).explain()
+                if has_collscan(plan.get("queryPlanner", {}).get("winningPlan", {})):
+                    LOGGER.warning("Query %s on collection '%s' does a COLLSCAN", query, collection_name)
+                    collscans.append((collection_name, query))
+        return collscans
+
+    def upload(self, primary_key, data, collection_name=None, buffered=True):
         """
         Upload/update data in MongoDB
 
         :param collection_name: Name of db collection to upload info in
         :param primary_key: For updating data
         :param data: Data to be uploaded
+        :param buffered: allow queueing in write-behind buffer (if enabled)
         :return: None
         """
 
         if not collection_name:
             collection_name = self.default_collection
 
+        if self._buffer_write(collection_name, ReplaceOne(primary_key, data, upsert=True), primary_key, buffered):
+            return
+
         collection = self.client[self.db_name][collection_name]
         collection.replace_one(primary_key, data, upsert=True)
-        LOGGER.info(f"Uploaded data to MongoDB: {primary_key}")
+        self._invalidate(primary_key, collection_name)
+        LOGGER.info("Uploaded data to '%s': %s", collection_name, Summary(primary_key))
+        RECORDS_LOGGER.debug("Uploaded record: %r", data)
 
     def aggregate(self, aggregation: list, collection_name=None):
         """
@@ -67,17 +203,20 @@ class Database:
         if not collection_name:
             collection_name = self.default_collection
 
+        self._flush_writes()  # aggregation stages may read other collections
         collection = self.client[self.db_name][collection_name]
         res = list(collection.aggregate(aggregation))
-        LOGGER.info(f"Found {len(res)} items by aggregation: {aggregation}")
+        LOGGER.info("Found %d items in '%s' by aggregation: %s", len(res), collection_name, Summary(aggregation))
         return res
 
-    def find(self, collection_name=None, query=None):
+    def find(self, collection_name=None, query=None, projection=None, sort=None):
         """
         Find info by query. Leave query empty if need to extract all data
 
         :param collection_name:
         :param query:
+        :param projection: fields to return (e.g. {"name": 1}), leave empty to get whole records
+        :param sort: list of (key, direction) pairs, e.g. [("_id", 1)]
         :return: list
         """
 
@@ -87,17 +226,19 @@ class Database:
         if not collection_name:
             collection_name = self.default_collection
 
+        self._flush_writes(collection_name)
         collection = self.client[self.db_name][collection_name]
-        res = list(collection.find(query))
-        LOGGER.info(f"Found {len(res)} items by query: {query}")
+        res = list(collection.find(query, projection, sort=sort))
+        LOGGER.info("Found %d items in '%s' by query: %s", len(res), collection_name, Summary(query))
         return res
 
-    def find_one(self, query=None, collection_name: str = None) -> dict:
+    def find_one(self, query=None, collection_name: str = None, projection=None) -> dict:
         """
         Find only one exact record by query. Leave query empty if need to extract all data
 
         :param collection_name:
         :param query:
+        :param projection: fields to return (e.g. {"name": 1}), leave empty to get whole record
         :return: dict
         """
 
@@ -107,109 +248,185 @@ class Database:
         if not collection_name:
             collection_name = self.default_collection
 
+        self._flush_writes(collection_name)
         collection = self.client[self.db_name][collection_name]
-        res = collection.find_one(query) or {}
+        res = collection.find_one(query, projection) or {}
         if res:
-            LOGGER.info(f"Found record: {res} by query: {query}")
+            LOGGER.info("Found record %s in '%s' by query: %s", Summary(res), collection_name, Summary(query))
+            RECORDS_LOGGER.debug("Found record: %r", res)
         else:
-            LOGGER.warning(f"Nothing found by query: {query}")
+            LOGGER.warning("Nothing found in '%s' by query: %s", collection_name, Summary(query))
         return res
 
-    def update(self, primary_key: dict, info: dict, collection_name=None) -> bool:
+    def update(self, primary_key: dict, info: dict, collection_name=None, upsert=True, buffered=True) -> bool:
         """
         Update information on MongoDB
         :param collection_name:
         :param primary_key: key to find data to update (e.g. {"user_id": user_id}
         :param info: dict containing info for update
+        :param upsert: create record if nothing found by primary_key
+        :param buffered: allow queueing in write-behind buffer (if enabled), then True is returned without waiting
         :return: bool
         """
 
         if not collection_name:
             collection_name = self.default_collection
 
+        if self._buffer_write(collection_name, UpdateOne(primary_key, {"$set": info}, upsert=upsert), primary_key,
+                              buffered):
+            return True
+
         collection = self.client[self.db_name][collection_name]
-        response = collection.update_one(primary_key, {"$set": info}, upsert=True).raw_result
+        response = collection.update_one(primary_key, {"$set": info}, upsert=upsert).raw_result
+        self._invalidate(primary_key, collection_name)
         if response['n']:
-            LOGGER.info(f"Successfully updated {response['n']} record. Response from mongoDB: {response}")
+            LOGGER.info("Successfully updated %d record. Response from mongoDB: %s", response['n'], response)
             return True
-        LOGGER.warning(f"Could not find anything to update. Check key: {primary_key}, response: {response}")
+        LOGGER.warning("Could not find anything to update. Check key: %s, response: %s", Summary(primary_key), response)
         return False
 
-    def array_remove(self, primary_key: dict, array_name: str, array_key: dict, collection_name=None) -> bool:
+    def update_with(self, primary_key: dict, operations: dict, collection_name=None, upsert=False,
+                    buffered=True) -> bool:
         """
-        Remove element from array in MongoDB
+        Apply MongoDB update operators to one record in a single atomic request
+        (e.g. {"$set": {...}, "$inc": {"version": 1}, "$currentDate": {"updated_at": True}})
 
-        :param primary_key: To find record in MongoDB
-        :param array_name: Array to remove element from
-        :param array_key: Key to find the element to remove
+        :param primary_key: key to find data to update
+        :param operations: update document with operators
         :param collection_name:
-        :return:
+        :param upsert: create record if nothing found by primary_key
+        :param buffered: allow queueing in write-behind buffer (if enabled), then True is returned without waiting
+        :return: bool
         """
 
         if not collection_name:
             collection_name = self.default_collection
 
+        if self._buffer_write(collection_name, UpdateOne(primary_key, operations, upsert=upsert), primary_key,
+                              buffered):
+            return True
+
         collection = self.client[self.db_name][collection_name]
-        response = collection.update_one(primary_key, {'$pull': {array_name: array_key}}).raw_result
+        try:
+            response = collection.update_one(primary_key, operations, upsert=upsert).raw_result
+        except DuplicateKeyError:
+            # Concurrent upsert inserted the record first (unique index), now it can be matched and updated
+            response = collection.update_one(primary_key, operations).raw_result
+        self._invalidate(primary_key, collection_name)
         if response['n']:
-            LOGGER.info(f"Successfully updated {response['n']} record. Response from mongoDB: {response}")
+            LOGGER.info("Successfully updated %d record. Response from mongoDB: %s", response['n'], response)
             return True
-        LOGGER.warning(f"Could not find anything to remove. "
-                       f"Check key: {primary_key}, array_name: {array_name}, response: {response}")
+        LOGGER.warning("Could not find anything to update. Check key: %s, response: %s", Summary(primary_key), response)
         return False
 
-    def array_append(self, primary_key, array_name, *elements, collection_name=None) -> bool:
+    def update_many(self, query: dict, operations: dict, collection_name=None, buffered=True) -> bool:
         """
-        Add element to array in MongoDB record
+        Apply MongoDB update operators to every record matching query in a single request
 
-        :param array_name: Array to append elements to
-        :param primary_key: key to find data to update (e.g. {"user_id": user_id}
+        :param query: filter of records to update
+        :param operations: update document with operators
         :param collection_name:
-        :param elements: Elements to append to array
-        :return:
+        :param buffered: allow queueing in write-behind buffer (if enabled), then True is returned without waiting
+        :return: bool
         """
 
         if not collection_name:
             collection_name = self.default_collection
 
+        if self._buffer_write(collection_name, UpdateMany(query, operations), query, buffered):
+            return True
+
         collection = self.client[self.db_name][collection_name]
-        response = collection.update_one(primary_key, {'$push': {array_name: {'$each': elements}}}).raw_result
+        response = collection.update_many(query, operations).raw_result
+        self._invalidate(query, collection_name)
         if response['n']:
-            LOGGER.info(f"Successfully updated {response['n']} record. Response from mongoDB: {response}")
+            LOGGER.info("Successfully updated %d records. Response from mongoDB: %s", response['n'], response)
             return True
-        LOGGER.warning(f"Could not find anything to update. "
-                       f"Check key: {primary_key}, array_name: {array_name}, response: {response}")
+        LOGGER.warning("Could not find anything to update. Check query: %s, response: %s", Summary(query), response)
         return False
 
-    def move_element(self, primary_key, array_from, element_id, array_to, collection_name=None) -> bool:
+    def delete(self, primary_key: dict, collection_name=None, buffered=True) -> bool:
         """
-        Move element from one array to another.
-        Example use case: archive tasks
+        Delete one record from MongoDB
 
-        :param primary_key: key to find a MongoDB record with array_from
-        :param array_from: name of array from element will be moved
-        :param element_id: id array element to move
-        :param array_to: name of array to which an element will be moved
-        :param collection_name: leave empty to use the default one
-        :return: bool response (success/fail)
+        :param primary_key: key to find record to delete
+        :param collection_name:
+        :param buffered: allow queueing in write-behind buffer (if enabled), then True is returned without waiting
+        :return: bool
         """
 
         if not collection_name:
             collection_name = self.default_collection
+
+        if self._buffer_write(collection_name, DeleteOne(primary_key), primary_key, buffered):
+            return True
+
         collection = self.client[self.db_name][collection_name]
+        deleted = collection.delete_one(primary_key).deleted_count
+        self._invalidate(primary_key, collection_name)
+        if deleted:
+            LOGGER.info("Deleted record: %s", Summary(primary_key))
+            return True
+        LOGGER.warning("Could not find anything to delete. Check key: %s", Summary(primary_key))
+        return False
+
+    def array_remove(self, primary_key: dict, array_name: str, array_key: dict,
+                     collection_name=None, buffered=True) -> bool:
+        """
+        Remove element from array in MongoDB
+
+        :param primary_key: To find record in MongoDB
+        :param array_name: Array to remove element from
+        :param array_key: Key to find the element to remove
+        :param collection_name:
+        :param buffered: allow queueing in write-behind buffer (if enabled), then True is returned without waiting
+        :return:
+        """
+
+        if not collection_name:
+            collection_name = self.default_collection
+
+        if self._buffer_write(collection_name, UpdateOne(primary_key, {'$pull': {array_name: array_key}}),
+                              primary_key, buffered):
+            return True
+
+        collection = self.client[self.db_name][collection_name]
+        response = collection.update_one(primary_key, {'$pull': {array_name: array_key}}).raw_result
+        self._invalidate(primary_key, collection_name)
+        if response['n']:
+            LOGGER.info("Successfully updated %d record. Response from mongoDB: %s", response['n'], response)
+            return True
+        LOGGER.warning("Could not find anything to remove. Check key: %s, array_name: %s, response: %s",
+                       Summary(primary_key), array_name, response)
+        return False
+
+    def array_append(self, primary_key, array_name, *elements, collection_name=None, buffered=True) -> bool:
+        """
+        Add element to array in MongoDB record
+
+        :param array_name: Array to append elements to
+        :param primary_key: key to find data to update (e.g. {"user_id": user_id}
+        :param collection_name:
+        :param elements: Elements to append to array
+        :param buffered: allow queueing in write-behind buffer (if enabled), then True is returned without waiting
+        :return:
+        """
+
+        if not collection_name:
+            collection_name = self.default_collection
 
-        record = collection.find_one(primary_key)
-        element = record[array_from][element_id]
+        if self._buffer_write(collection_name, UpdateOne(primary_key, {'$push': {array_name: {'$each': elements}}}),
+                              primary_key, buffered):
+            return True
 
-        response = collection.update(primary_key, {
-            "$pull": {array_from: element},
-            "$addToSet": {array_to: element}
-        })
+        collection = self.client[self.db_name][collection_name]
+        response = collection.update_one(primary_key, {'$push': {array_name: {'$each': elements}}}).raw_result
+        self._invalidate(primary_key, collection_name)
         if response['n']:
-            LOGGER.info(f"Successfully updated {response['n']} record. Response from mongoDB: {response}")
+            LOGGER.info("Successfully updated %d record. Response from mongoDB: %s", response['n'], response)
             return True
-        LOGGER.warning(f"Could not find anything to move. "
-                       f"Check key: {primary_key}, array_from: {array_from}, array_to: {array_to}, el_id: {element_id}")
+        LOGGER.warning("Could not find anything to update. Check key: %s, array_name: %s, response: %s",
+                       Summary(primary_key), array_name, response)
         return False
 
 
@@ -220,20 +437,33 @@ class UserDatabase(Database):
 
     _default_file_path = Path(__file__).resolve().parent.parent / "configs" / "database_config.json"
 
+    INDEXES = {
+        "default_collection": [IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique")],
+    }
+    QUERY_SHAPES = {
+        "default_collection": [{"user_id": 0}],
+    }
+
     def __init__(self):
-        self._data = _load_from_json(self._default_file_path)["users"]
+        config = _load_from_json(self._default_file_path)
+        self._data = config["users"]
         super().__init__(url=self._data["url"], db_name=self._data["db_name"],
-                         default_collection=self._data["collection"])
+                         default_collection=self._data["collection"], pool_options=config.get("pool"),
+                         write_behind=config.get("write_behind"), backend=config.get("backend"))
+        self._cache, self._cache_field = get_cache("users", **self._data.get("cache", {})), "user_id"
 
-    def update(self, user_id, info: dict, collection_name=None):  # pylint: disable=arguments-renamed
+    def update(self, user_id, info: dict, collection_name=None, upsert=True,  # pylint: disable=arguments-renamed
+               buffered=True) -> bool:
         """
         Update information on MongoDB
         :param user_id:
         :param info:
         :param collection_name:
-        :return:
+        :param upsert: create user record if it does not exist
+        :param buffered: allow queueing in write-behind buffer (see Database.update)
+        :return: bool
         """
-        super().update({"user_id": user_id}, info, collection_name)
+        return super().update({"user_id": user_id}, info, collection_name, upsert, buffered)
 
     def exists(self, user_id) -> bool:
         """
@@ -242,7 +472,7 @@ class UserDatabase(Database):
         :return:
         """
 
-        return bool(self.find_one({"user_id": user_id}))
+        return bool(self.get_info(user_id))
 
     def get_info(self, user_id):
         """
@@ -251,7 +481,7 @@ class UserDatabase(Database):
         :return:
         """
 
-        return self.find_one({"user_id": user_id})
+        return self.cached_find_one(user_id)
 
     def get_type(self, user_id):
         """
@@ -260,7 +490,7 @@ class UserDatabase(Database):
         :return:
         """
 
-        return self.find_one({"user_id": user_id})["type"]
+        return self.get_info(user_id)["type"]
 
     def add_raw(self, user_id, additional: dict = None):
         """
@@ -281,25 +511,205 @@ class UserDatabase(Database):
 
 class ClassroomDatabase(Database):
     """
-    Handler class for users actions in DB
+    Handler class for classrooms actions in DB.
+    Tasks, students' submissions and archived tasks are stored in their own collections
+    (keyed by classroom_id + task id, classroom_id + task_id + student_id), not inside classroom records
     """
 
     _default_file_path = Path(__file__).resolve().parent.parent / "configs" / "database_config.json"
 
+    INDEXES = {
+        "default_collection": [IndexModel([("classroom_id", ASCENDING)], unique=True, name="classroom_id_unique")],
+        "tasks_collection": [IndexModel([("classroom_id", ASCENDING), ("id", ASCENDING)], unique=True,
+                                        name="classroom_task_unique")],
+        "archived_tasks_collection": [IndexModel([("classroom_id", ASCENDING), ("id", ASCENDING)], unique=True,
+                                                 name="classroom_task_unique")],
+        "submissions_collection": [IndexModel([("classroom_id", ASCENDING), ("task_id", ASCENDING),
+                                               ("student_id", ASCENDING)], unique=True,
+                                              name="classroom_task_student_unique")],
+    }
+    QUERY_SHAPES = {
+        "default_collection": [{"classroom_id": ""}, {"classroom_id": {"$in": [""]}}],
+        "tasks_collection": [{"classroom_id": ""}, {"classroom_id": "", "id": ""}],
+        "archived_tasks_collection": [{"classroom_id": "", "id": ""}],
+        "submissions_collection": [{"classroom_id": "", "task_id": ""},
+                                   {"classroom_id": "", "task_id": "", "student_id": 0}],
+    }
+
     def __init__(self):
-        self._data = _load_from_json(self._default_file_path)["classrooms"]
+        config = _load_from_json(self._default_file_path)
+        self._data = config["classrooms"]
         super().__init__(url=self._data["url"], db_name=self._data["db_name"],
-                         default_collection=self._data["collection"])
+                         default_collection=self._data["collection"], pool_options=config.get("pool"),
+                         write_behind=config.get("write_behind"), backend=config.get("backend"))
+        self.tasks_collection = self._data.get("tasks_collection", "tasks")
+        self.submissions_collection = self._data.get("submissions_collection", "submissions")
+        self.archived_tasks_collection = self._data.get("archived_tasks_collection", "archived_tasks")
+        self._cache, self._cache_field = get_cache("classrooms", **self._data.get("cache", {})), "classroom_id"
 
-    def get_info(self, classroom_id) -> dict:
+    def get_info(self, classroom_id, projection=None) -> dict:
         """
         Get group info
 
         :param classroom_id:
+        :param projection: fields to return, leave empty to get the whole record
         :return: {'_id': ObjectID, 'name': ..., 'classroom_id': ..., 'teachers': [...], 'students': [...]}
         """
 
-        return self.find_one({"classroom_id": classroom_id})
+        return self.cached_find_one(classroom_id, projection)
+
+    def get_names(self, classroom_ids: list) -> list:
+        """
+        Get names of several groups in one request
+
+        :param classroom_ids:
+        :return: [{'classroom_id': ..., 'name': ...}] in classroom_ids order (unknown IDs are skipped)
+        """
+
+        if not classroom_ids:
+            return []
+        records = self.find(query={"classroom_id": {"$in": classroom_ids}},
+                            projection={"_id": 0, "classroom_id": 1, "name": 1})
+        groups = {group["classroom_id"]: group for group in records}
+        return [groups[classroom_id] for classroom_id in classroom_ids if classroom_id in groups]
+
+    def get_task_summaries(self, classroom_id) -> list:
+        """
+        Get group active tasks (in creation order) without attachments references (only file names)
+
+        :param classroom_id:
+        :return: [{'id': ..., 'creator_id': ..., 'description': ..., 'deadline': ..., 'active': ..., 'files': [...]}]
+        """
+
+        projection = {"_id": 0, **{field: 1 for field in ("id", "creator_id", "description", "deadline", "active",
+                                                          "files.filename")}}
+        return self.find(self.tasks_collection, {"classroom_id": classroom_id}, projection, sort=[("_id", 1)])
+
+    def get_task(self, classroom_id, task_id) -> dict:
+        """
+        Get single group active task
+
+        :param classroom_id:
+        :param task_id:
+        :return: {'id': ..., 'creator_id': ..., 'description': ..., 'files': [...], ...} or {} if not found
+        """
+
+        return self.find_one({"classroom_id": classroom_id, "id": task_id}, self.tasks_collection)
+
+    def get_tasks(self, tasks: Iterable[Tuple], projection: dict = None) -> Dict[Tuple, dict]:
+        """
+        Get several group active tasks in one request
+
+        :param tasks: (classroom_id, task_id) pairs
+        :param projection: fields to return (classroom_id and id are always included)
+        :return: {(classroom_id, task_id): task} (tasks not found are skipped)
+        """
+
+        tasks = list(tasks)
+        if not tasks:
+            return {}
+        if projection is not None:
+            projection = {**projection, "classroom_id": 1, "id": 1}
+        query = {"$or": [{"classroom_id": classroom_id, "id": task_id} for classroom_id, task_id in tasks]}
+        return {(task["classroom_id"], task["id"]): task for task in self.find(self.tasks_collection, query, projection)}
+
+    def update_task(self, classroom_id, task_id, info: dict) -> bool:
+        """
+        Update fields of group active task
+
+        :param classroom_id:
+        :param task_id:
+        :param info: dict containing info for update (e.g. {"deadline": date})
+        :return: bool
+        """
+
+        return self.update({"classroom_id": classroom_id, "id": task_id}, info, self.tasks_collection, upsert=False)
+
+    def archive_task(self, classroom_id, task_id) -> bool:
+        """
+        Move task from active tasks to archived ones
+
+        :param classroom_id:
+        :param task_id:
+        :return: bool
+        """
+
+        key = {"classroom_id": classroom_id, "id": task_id}
+        # Copied on server side, task record is not downloaded. Relies on classroom_task_unique index (see INDEXES)
+        self.aggregate([{"$match": key}, {"$unset": "_id"},
+                        {"$merge": {"into": self.archived_tasks_collection, "on": ["classroom_id", "id"],
+                                    "whenMatched": "replace", "whenNotMatched": "insert"}}], self.tasks_collection)
+        return self.delete(key, self.tasks_collection)
+
+    def get_submissions(self, classroom_id, task_id) -> list:
+        """
+        Get students' answers on task
+
+        :param classroom_id:
+        :param task_id:
+        :return: [{'student_id': ..., 'task_id': ..., 'description': ..., 'files': [...]}]
+        """
+
+        return self.find(self.submissions_collection, {"classroom_id": classroom_id, "task_id": task_id})
+
+    def get_submission(self, classroom_id, task_id, student_id, projection=None) -> dict:
+        """
+        Get student's answer on task
+
+        :param classroom_id:
+        :param task_id:
+        :param student_id:
+        :param projection: fields to return, leave empty to get the whole record
+        :return: {'student_id': ..., 'task_id': ..., 'description': ..., 'files': [...]} or {} if not found
+        """
+
+        return self.find_one({"classroom_id": classroom_id, "task_id": task_id, "student_id": student_id},
+                             self.submissions_collection, projection)
+
+    def get_submitted_students(self, tasks: Iterable[Tuple]) -> Dict[Tuple, set]:
+        """
+        Get students who have submitted answers on several tasks in one request
+
+        :param tasks: (classroom_id, task_id) pairs
+        :return: {(classroom_id, task_id): {student_id, ...}}
+        """
+
+        tasks = list(tasks)
+        submitted: Dict[Tuple, set] = {task: set() for task in tasks}
+        if not tasks:
+            return submitted
+        query = {"$or": [{"classroom_id": classroom_id, "task_id": task_id} for classroom_id, task_id in tasks]}
+        for record in self.find(self.submissions_collection, query,
+                                {"_id": 0, "classroom_id": 1, "task_id": 1, "student_id": 1}):
+            submitted[(record["classroom_id"], record["task_id"])].add(record["student_id"])
+        return submitted
+
+    def get_student_ids(self, classroom_ids: list) -> Dict:
+        """
+        Get IDs of students of several groups in one request
+
+        :param classroom_ids:
+        :return: {classroom_id: [student_id, ...]} (unknown IDs are skipped)
+        """
+
+        if not classroom_ids:
+            return {}
+        records = self.find(query={"classroom_id": {"$in": classroom_ids}},
+                            projection={"_id": 0, "classroom_id": 1, "students.id": 1})
+        return {group["classroom_id"]: [member["id"] if isinstance(member, dict) else member
+                                        for member in group.get("students", [])] for group in records}
+
+    def get_member_ids(self, classroom_id) -> dict:
+        """
+        Get IDs of group teachers and students
+
+        :param classroom_id:
+        :return: {'teachers': [...], 'students': [...]}
+        """
+
+        info = self.get_info(classroom_id, {"teachers": 1, "students.id": 1})
+        return {role: [member["id"] if isinstance(member, dict) else member for member in info.get(role, [])]
+                for role in ("teachers", "students")}
 
     def add_raw(self, classroom_id, teacher_id, additional: dict = None):
         """
@@ -327,7 +737,8 @@ class ClassroomDatabase(Database):
         :return:
         """
 
-        return self.array_append({"classroom_id": classroom_id}, "students", {"id": student_id}, collection_name=None)
+        return self.array_append({"classroom_id": classroom_id}, "students", {"id": student_id}, collection_name=None,
+                                 buffered=False)  # result tells whether classroom exists
 
     def add_teacher(self, teacher_id, classroom_id):
         """
@@ -338,7 +749,8 @@ class ClassroomDatabase(Database):
         :return:
         """
 
-        return self.array_append({"classroom_id": classroom_id}, "teachers", {"id": teacher_id}, collection_name=None)
+        return self.array_append({"classroom_id": classroom_id}, "teachers", {"id": teacher_id}, collection_name=None,
+                                 buffered=False)  # membership must not be lost with a failed buffered flush
 
     def add_task(self, task_id, creator_id, classroom_id, info: dict):
         """
@@ -351,29 +763,23 @@ class ClassroomDatabase(Database):
         :return:
         """
 
-        return self.array_append({"classroom_id": classroom_id}, "tasks",
-                                 {"id": task_id, "creator_id": creator_id, **info}, collection_name=None)
+        key = {"classroom_id": classroom_id, "id": task_id}
+        self.upload(key, {**key, "creator_id": creator_id, **info}, self.tasks_collection)
 
     def submit_task(self, student_id, classroom_id, info: dict):
         """
-        Send student's answer to database
+        Send student's answer to database (replaces previous answer on the same task).
+        Single atomic upsert: submission time is set by server, version grows on every resubmission
 
         :param student_id:
         :param classroom_id:
-        :param info:
-        :return:
+        :param info: {"task_id": ..., "description": ..., "files": [...]}
+        :return: bool
         """
 
-        students_list = self.find_one({"classroom_id": classroom_id})["students"]
-        student_array_id = None
-        for index, student in enumerate(students_list):
-            if student["id"] == student_id:
-                student_array_id = index
-                break
-
-        self.array_remove({"classroom_id": classroom_id}, f"students.{student_array_id}.tasks",
-                          {"task_id": info["task_id"]})
-        self.array_append({"classroom_id": classroom_id}, f"students.{student_array_id}.tasks", info)
+        key = {"classroom_id": classroom_id, "task_id": info["task_id"], "student_id": student_id}
+        return self.update_with(key, {"$set": info, "$currentDate": {"submitted_at": True}, "$inc": {"version": 1}},
+                                self.submissions_collection, upsert=True, buffered=False)  # student is told it is saved
 
 
 class DeadlineDatabase(Database):
@@ -383,10 +789,20 @@ class DeadlineDatabase(Database):
 
     _default_file_path = Path(__file__).resolve().parent.parent / "configs" / "database_config.json"
 
+    INDEXES = {
+        "default_collection": [IndexModel([("task_id", ASCENDING)], unique=True, name="task_id_unique"),
+                               IndexModel([("date", ASCENDING)], name="date")],
+    }
+    QUERY_SHAPES = {
+        "default_collection": [{"task_id": ""}, {"date": {"$gt": datetime.min, "$lte": datetime.max}, "reminded": {"$ne": ""}}],
+    }
+
     def __init__(self):
-        self._data = _load_from_json(self._default_file_path)["deadlines"]
+        config = _load_from_json(self._default_file_path)
+        self._data = config["deadlines"]
         super().__init__(url=self._data["url"], db_name=self._data["db_name"],
-                         default_collection=self._data["collection"])
+                         default_collection=self._data["collection"], pool_options=config.get("pool"),
+                         write_behind=config.get("write_behind"), backend=config.get("backend"))
 
     def add_deadline(self, classroom_id, task_id, date, additional: dict = None):
         """
@@ -405,25 +821,42 @@ class DeadlineDatabase(Database):
 
         self.upload({"task_id": task_id}, info)
 
-    def get_deadlines_between(self, date_from, date_to):
+    def get_deadlines(self) -> list:
+        """
+        Get list of all pending deadlines (scanned once at startup to schedule missing jobs)
+        :return:
+        """
+
+        return self.find(projection={"_id": 0})
+
+    def remove_deadline(self, task_id) -> bool:
+        """
+        Remove deadline after it has come
+        :param task_id:
+        :return: bool
+        """
+
+        return self.delete({"task_id": task_id})
+
+    def get_deadlines_to_remind(self, reminder, date_from, date_to) -> list:
         """
-        Get list of deadlines between two dates
-        (one day and different hours/minutes/seconds is a possible case)
+        Get deadlines in (date_from, date_to] which have not got the reminder yet (range scan over date index)
+        :param reminder: reminder name, e.g. "1h"
         :param date_from:
         :param date_to:
         :return:
         """
 
-        return self.find(query={"date": {"$gte": date_from, "$lt": date_to}})
+        return self.find(query={"date": {"$gt": date_from, "$lte": date_to}, "reminded": {"$ne": reminder}},
+                         projection={"_id": 0})
 
-    def get_today_deadlines(self):
+    def mark_reminded(self, task_ids: list, reminders: list) -> bool:
         """
-        Get list of current day deadlines
-        (from 00:00 to 23:59 of todays's date)
-        :return:
+        Remember that reminders were sent for deadlines (record is replaced when deadline moves, so they are sent again)
+        :param task_ids:
+        :param reminders: reminder names
+        :return: bool
         """
 
-        today = datetime.today()
-        today_begin = today.replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = today.replace(hour=23, minute=59, second=59, microsecond=999)
-        return self.get_deadlines_between(today_begin, today_end)
+        return self.update_many({"task_id": {"$in": task_ids}}, {"$addToSet": {"reminded": {"$each": reminders}}},
+                                buffered=False)
@@ -0,0 +1,34 @@
+"""
+Persistent APScheduler job store
+Scheduled jobs are kept in the deadlines database (collection "scheduled_jobs", set "jobs_collection"
+in the "deadlines" section of database_config.json to change it), so they survive bot restarts
+"""
+
+from apscheduler.jobstores.mongodb import MongoDBJobStore
+
+from database.database import DeadlineDatabase, _load_from_json
+from database.pool import get_client
+
+
+class SharedClientJobStore(MongoDBJobStore):
+    """
+    MongoDBJobStore on a client of the shared registry: scheduler shutdown leaves the client open,
+    it is closed with the others by close_clients
+    """
+
+    def shutdown(self):
+        pass
+
+
+def get_job_store() -> SharedClientJobStore:
+    """
+    Create job store in the deadlines database
+
+    :return: SharedClientJobStore
+    """
+
+    config = _load_from_json(DeadlineDatabase._default_file_path)  # pylint: disable=protected-access
+    deadlines = config["deadlines"]
+    client = get_client(deadlines["url"], config.get("pool"), config.get("backend"))
+    return SharedClientJobStore(database=deadlines["db_name"], collection=deadlines.get("jobs_collection", "scheduled_jobs"),
+                                client=client)
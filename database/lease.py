@@ -0,0 +1,134 @@
+"""
+Leases for leader election between bot instances
+A lease is held by one owner until it expires; the owner renews it well before that, others take it over
+only after it has expired. Stored in "leases" collection of the deadlines database, or in a local SQLite file
+when instances share a host but no MongoDB (and with the in-memory database backend).
+Configure with the optional "leader" section of database_config.json:
+{"backend": "mongodb", "lease_seconds": 30} or {"backend": "file", "path": "...", "lease_seconds": 30}
+"""
+
+import abc
+import sqlite3
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from pymongo.errors import DuplicateKeyError
+
+from database.database import DeadlineDatabase, _load_from_json
+from database.pool import get_client
+
+LEASE_SECONDS = 30  # Default lease time: failover happens at most this long after the leader is gone
+
+
+class Lease(abc.ABC):
+    """
+    Named lease of owner, see MongoLease and FileLease
+    """
+
+    def __init__(self, name: str, owner: str, seconds: float = LEASE_SECONDS):
+        self.name = name
+        self.owner = owner
+        self.seconds = seconds
+
+    @abc.abstractmethod
+    def acquire(self) -> bool:
+        """
+        Take lease if it is free or expired, renew it if it is already ours
+
+        :return: True if we hold the lease for the next `seconds`
+        """
+
+    @abc.abstractmethod
+    def release(self):
+        """
+        Give lease up (if held), so another instance does not have to wait for expiration
+
+        :return: None
+        """
+
+
+class MongoLease(Lease):
+    """
+    Lease record {"_id": name, "owner": ..., "expires_at": ...}, taken and renewed with one conditional upsert
+    """
+
+    def __init__(self, collection, name: str, owner: str, seconds: float = LEASE_SECONDS):
+        super().__init__(name, owner, seconds)
+        self._collection = collection
+
+    def acquire(self) -> bool:
+        now = datetime.utcnow()
+        try:
+            self._collection.update_one({"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                                        {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.seconds)}},
+                                        upsert=True)
+            return True
+        except DuplicateKeyError:  # record exists and is held by someone else
+            return False
+
+    def release(self):
+        self._collection.delete_one({"_id": self.name, "owner": self.owner})
+
+
+class FileLease(Lease):
+    """
+    Lease row in SQLite file: the check and the update run in one write transaction, so processes sharing the file
+    can not take the lease at the same time
+    """
+
+    def __init__(self, path, name: str, owner: str, seconds: float = LEASE_SECONDS):
+        super().__init__(name, owner, seconds)
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=self.seconds / 3, isolation_level=None)
+
+    def acquire(self) -> bool:
+        now = datetime.utcnow().timestamp()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+            if row is not None and row[0] != self.owner and row[1] >= now:
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (self.name, self.owner, now + self.seconds))
+            connection.execute("COMMIT")
+            return True
+        finally:
+            connection.close()
+
+    def release(self):
+        connection = self._connect()
+        try:
+            connection.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (self.name, self.owner))
+        finally:
+            connection.close()
+
+
+def get_lease(name: str, owner: str) -> Lease:
+    """
+    Create lease configured in database_config.json
+
+    :param name: what the lease guards, e.g. "scheduler"
+    :param owner: unique ID of this instance
+    :return: Lease
+    """
+
+    config = _load_from_json(DeadlineDatabase._default_file_path)  # pylint: disable=protected-access
+    leader, deadlines = config.get("leader", {}), config["deadlines"]
+    seconds = leader.get("lease_seconds", LEASE_SECONDS)
+    backend = leader.get("backend", "file" if config.get("backend") == "memory" else "mongodb")
+    if backend == "file":
+        path = leader.get("path", Path(__file__).resolve().parent.parent / "temp" / "leases.sqlite3")
+        return FileLease(path, name, owner, seconds)
+    client = get_client(deadlines["url"], config.get("pool"), config.get("backend"))
+    collection = client[deadlines["db_name"]][leader.get("collection", "leases")]
+    return MongoLease(collection, name, owner, seconds)
@@ -0,0 +1,70 @@
+"""
+Compact log representation of MongoDB records and queries
+Records may hold large arrays and (not migrated) embedded binaries, so logs get a size-capped summary:
+scalars are kept, binaries are shown by size and nested containers by length.
+Summary objects are formatted only when the log record is actually emitted
+"""
+
+from typing import Any
+
+SUMMARY_LIMIT = 300  # max length of summary string
+SUMMARY_DEPTH = 3  # nesting levels shown before containers are collapsed to their length
+
+
+# pylint: disable = too-many-return-statements, too-few-public-methods
+
+
+def summarize(value: Any, limit: int = SUMMARY_LIMIT, depth: int = SUMMARY_DEPTH) -> str:
+    """
+    Short description of record or query, e.g. {'_id': ObjectId(...), 'files': <3 items>, 'file': <52431 bytes>}
+
+    :param value: record, query, response or any other value
+    :param limit: max length of result, longer summaries are truncated
+    :param depth: nesting levels to show
+    :return: str
+    """
+
+    text = _describe(value, depth, limit)
+    return text if len(text) <= limit else f"{text[:limit]}...<{len(text) - limit} chars more>"
+
+
+def _describe(value, depth: int, budget: int) -> str:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict):
+        if depth <= 0:
+            return f"<dict of {len(value)}>"
+        parts, used = [], 0
+        for key, item in value.items():
+            if used > budget:  # rest will be truncated anyway
+                parts.append("...")
+                break
+            part = f"{key!r}: {_describe(item, depth - 1, budget - used)}"
+            parts.append(part)
+            used += len(part) + 2
+        return "{" + ", ".join(parts) + "}"
+    if isinstance(value, (list, tuple, set)):
+        if depth <= 0 or len(value) > 3:
+            return f"<{len(value)} items>"
+        return "[" + ", ".join(_describe(item, depth - 1, budget) for item in value) + "]"
+    if isinstance(value, str) and len(value) > budget:
+        return repr(value[:budget])
+    return repr(value)
+
+
+class Summary:
+    """
+    Deferred summarize(value): pass as a %-style logging argument,
+    so nothing is formatted if the message is filtered out by level
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: int = SUMMARY_LIMIT):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        return summarize(self.value, self.limit)
+
+    __repr__ = __str__
@@ -0,0 +1,48 @@
+"""
+In-process stand-in for MongoDB
+mongomock client, so handlers, pack_answers, load tests and benchmarks run without a MongoDB server.
+Data lives only as long as the process. Select with "backend": "memory" in database_config.json.
+
+mongomock lacks a few features the database wrappers use:
+    $unset and $merge aggregation stages (archive_task) - added here
+    explain - Database.check_query_plans skips this backend
+    "$[]" update path element (migrations) - not supported, migrate a real database
+"""
+
+import mongomock
+
+from mongomock import aggregate
+from pymongo.errors import OperationFailure
+
+
+# pylint: disable = unused-argument
+
+
+def _unset_stage(documents: list, database, fields) -> list:
+    fields = [fields] if isinstance(fields, str) else fields
+    return aggregate._handle_project_stage(documents, database, {field: 0 for field in fields})  # pylint: disable=protected-access
+
+
+def _merge_stage(documents: list, database, options) -> list:
+    options = {"into": options} if isinstance(options, str) else options
+    if not isinstance(options["into"], str) or options.get("whenMatched", "merge") not in ("replace", "merge") \
+            or options.get("whenNotMatched", "insert") != "insert":
+        raise OperationFailure(f"$merge options {options} are not supported by the memory backend")
+    on = options.get("on", "_id")
+    on = [on] if isinstance(on, str) else on
+    target = database.get_collection(options["into"])
+    for document in documents:
+        key = {field: document[field] for field in on}
+        fields = {field: value for field, value in document.items() if field not in ("_id", *on)}
+        if options.get("whenMatched", "merge") == "replace":
+            target.replace_one(key, {**key, **fields}, upsert=True)
+        else:
+            target.update_one(key, {"$set": fields} if fields else {"$setOnInsert": key}, upsert=True)
+    return []
+
+
+for _stage, _handler in (("$unset", _unset_stage), ("$merge", _merge_stage)):
+    aggregate._PIPELINE_HANDLERS[_stage] = aggregate._PIPELINE_HANDLERS[_stage] or _handler  # pylint: disable=protected-access
+
+
+MemoryClient = mongomock.MongoClient  # with the aggregation stages above
@@ -0,0 +1,148 @@
+"""
+Data migrations for existing MongoDB records
+
+Stop the bot before running a migration: documents are rewritten as a whole.
+
+Usage: python -m database.migrate attachments [--dry-run]
+       python -m database.migrate normalize [--dry-run]
+"""
+
+import argparse
+
+from configs.logger_conf import configure_logger
+from database.database import ClassroomDatabase
+from database.blob_store import BlobStore, get_blob_store
+
+LOGGER = configure_logger(__name__)
+
+
+# pylint: disable = logging-fstring-interpolation
+
+
+def _externalize_files(files: list, store: BlobStore, dry_run: bool) -> int:
+    """
+    Replace embedded binaries in attachments list with blob store references (in place)
+
+    :return: number of moved files
+    """
+
+    moved = 0
+    for index, file in enumerate(files):
+        if "file" not in file:
+            continue
+        moved += 1
+        if not dry_run:
+            files[index] = store.put(bytes(file["file"]), file["filename"])
+    return moved
+
+
+def migrate_attachments(dry_run: bool = False) -> int:
+    """
+    Move task and submission files embedded in MongoDB records to blob store.
+    Converted arrays: tasks[].files, archived_tasks[].files, students[].tasks[].files of classroom records
+    (not normalized layout) and files of tasks, archived tasks and submissions collections
+
+    :param dry_run: only count files to move
+    :return: number of moved files
+    """
+
+    classroom_db = ClassroomDatabase()
+    collection = classroom_db.client[classroom_db.db_name][classroom_db.default_collection]
+    store = get_blob_store()
+
+    total = 0
+    for classroom in collection.find({}, {"classroom_id": 1, "tasks": 1, "archived_tasks": 1, "students": 1}):
+        moved = 0
+        for array_name in ("tasks", "archived_tasks"):
+            for task in classroom.get(array_name, []):
+                moved += _externalize_files(task.get("files", []), store, dry_run)
+        for student in classroom.get("students", []):
+            for task in student.get("tasks", []):
+                moved += _externalize_files(task.get("files", []), store, dry_run)
+
+        if moved and not dry_run:
+            collection.update_one({"_id": classroom["_id"]}, {"$set": {
+                array_name: classroom[array_name] for array_name in ("tasks", "archived_tasks", "students")
+                if array_name in classroom
+            }})
+        if moved:
+            LOGGER.info(f"Classroom {classroom.get('classroom_id')}: {moved} attachments "
+                        f"{'to move' if dry_run else 'moved'} to blob store")
+        total += moved
+
+    for collection_name in (classroom_db.tasks_collection, classroom_db.archived_tasks_collection,
+                            classroom_db.submissions_collection):
+        records = classroom_db.client[classroom_db.db_name][collection_name]
+        for record in records.find({"files.file": {"$exists": True}}, {"files": 1}):
+            moved = _externalize_files(record["files"], store, dry_run)
+            if not dry_run:
+                records.update_one({"_id": record["_id"]}, {"$set": {"files": record["files"]}})
+            total += moved
+
+    LOGGER.info(f"Attachments migration finished: {total} files {'to move' if dry_run else 'moved'}")
+    return total
+
+
+def migrate_normalized(dry_run: bool = False) -> int:
+    """
+    Move tasks, archived tasks and students' submissions embedded in classroom documents
+    to their own collections (see ClassroomDatabase). Records are upserted by their keys,
+    so interrupted migration can be safely restarted
+
+    :param dry_run: only count records to move
+    :return: number of moved records
+    """
+
+    classroom_db = ClassroomDatabase()
+    database = classroom_db.client[classroom_db.db_name]
+    classrooms = database[classroom_db.default_collection]
+
+    total = 0
+    for classroom in classrooms.find({"$or": [{"tasks": {"$exists": True}}, {"archived_tasks": {"$exists": True}},
+                                              {"students.tasks": {"$exists": True}}]}):
+        classroom_id = classroom["classroom_id"]
+        records = []  # (collection name, key, record)
+        for array_name, collection_name in (("tasks", classroom_db.tasks_collection),
+                                            ("archived_tasks", classroom_db.archived_tasks_collection)):
+            for task in classroom.get(array_name, []):
+                key = {"classroom_id": classroom_id, "id": task["id"]}
+                records.append((collection_name, key, {**task, **key}))
+        for student in classroom.get("students", []):
+            for answer in student.get("tasks", []):
+                key = {"classroom_id": classroom_id, "task_id": answer["task_id"], "student_id": student["id"]}
+                records.append((classroom_db.submissions_collection, key, {**answer, **key}))
+
+        if not dry_run:
+            for collection_name, key, record in records:
+                database[collection_name].replace_one(key, record, upsert=True)
+            classrooms.update_one({"_id": classroom["_id"]}, {"$unset": {"tasks": "", "archived_tasks": ""}})
+            classrooms.update_one({"_id": classroom["_id"], "students.tasks": {"$exists": True}},
+                                  {"$unset": {"students.$[].tasks": ""}})
+        LOGGER.info(f"Classroom {classroom_id}: {len(records)} records {'to move' if dry_run else 'moved'}")
+        total += len(records)
+
+    LOGGER.info(f"Normalization finished: {total} records {'to move' if dry_run else 'moved'}")
+    return total
+
+
+def main():
+    """
+    Migrations command line entry point
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="migration", required=True)
+    attachments = subparsers.add_parser("attachments", help="move embedded task/submission files to blob store")
+    attachments.add_argument("--dry-run", action="store_true", help="only count files to move")
+    normalize = subparsers.add_parser("normalize", help="move tasks and submissions to their own collections")
+    normalize.add_argument("--dry-run", action="store_true", help="only count records to move")
+    args = parser.parse_args()
+
+    if args.migration == "attachments":
+        migrate_attachments(args.dry_run)
+    elif args.migration == "normalize":
+        migrate_normalized(args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
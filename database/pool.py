@@ -0,0 +1,181 @@
+"""
+Process-wide MongoDB clients registry
+Every database handler shares one pymongo.MongoClient (and its connection pool) per URL.
+With "backend": "memory" in database_config.json handlers share in-process MemoryClient (mongomock) instead
+"""
+
+import re
+import time
+import threading
+
+from typing import Dict, Union
+
+import pymongo
+
+from pymongo import monitoring
+
+from configs.logger_conf import configure_logger
+from database.memory_backend import MemoryClient
+
+LOGGER = configure_logger(__name__)
+
+
+# pylint: disable = logging-fstring-interpolation, missing-function-docstring, unused-argument, too-many-instance-attributes
+
+# database_config.json "pool" keys -> MongoClient keyword arguments
+POOL_OPTIONS = {
+    "max_pool_size": "maxPoolSize",
+    "min_pool_size": "minPoolSize",
+    "max_idle_time_ms": "maxIdleTimeMS",
+    "wait_queue_timeout_ms": "waitQueueTimeoutMS",
+    "connect_timeout_ms": "connectTimeoutMS",
+    "socket_timeout_ms": "socketTimeoutMS",
+    "server_selection_timeout_ms": "serverSelectionTimeoutMS",
+}
+
+BACKENDS = ("mongodb", "memory")
+
+_CLIENTS: Dict[str, Union[pymongo.MongoClient, MemoryClient]] = {}
+_LISTENERS: Dict[str, "PoolStatsListener"] = {}
+_LOCK = threading.Lock()
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Connection pool events collector for pool sizing:
+    open/checked out connections, check outs count, failures and time spent waiting for a connection
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wait_started = threading.local()
+        self.open_connections = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.check_outs = 0
+        self.check_out_failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self) -> dict:
+        """
+        Snapshot of collected statistics
+
+        :return: dict
+        """
+
+        with self._lock:
+            return {
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "check_outs": self.check_outs,
+                "check_out_failures": self.check_out_failures,
+                "avg_wait_ms": self.total_wait / self.check_outs * 1000 if self.check_outs else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+    def _stop_wait(self) -> float:
+        started = getattr(self._wait_started, "value", None)
+        self._wait_started.value = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        self._wait_started.value = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._stop_wait()
+        with self._lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.check_outs += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def connection_check_out_failed(self, event):
+        waited = self._stop_wait()
+        with self._lock:
+            self.check_out_failures += 1
+            self.max_wait = max(self.max_wait, waited)
+        LOGGER.warning(f"Could not check out connection to {event.address}: {event.reason}")
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+def get_client(url: str, pool_options: dict = None, backend: str = None) -> Union[pymongo.MongoClient, MemoryClient]:
+    """
+    Get shared client for URL, create it on first request.
+    Pool options are applied only when the client is created
+
+    :param url: MongoDB connection string
+    :param pool_options: "pool" section of database_config.json (see POOL_OPTIONS)
+    :param backend: "mongodb" (default) or "memory" (in-process stand-in, see memory_backend)
+    :return: MongoClient (or MemoryClient)
+    """
+
+    backend = backend or "mongodb"
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown database backend '{backend}', expected one of {BACKENDS}")
+    with _LOCK:
+        client = _CLIENTS.get(url)
+        if client is None and backend == "memory":
+            client = _CLIENTS[url] = MemoryClient(url)
+            LOGGER.info("Created in-memory database client, data is not persisted")
+        elif client is None:
+            options = {POOL_OPTIONS[key]: value for key, value in (pool_options or {}).items() if key in POOL_OPTIONS}
+            listener = PoolStatsListener()
+            client = pymongo.MongoClient(url, event_listeners=[listener], **options)
+            _CLIENTS[url], _LISTENERS[url] = client, listener
+            LOGGER.info(f"Created MongoDB client, pool options: {options}")
+        return client
+
+
+def get_pool_stats() -> dict:
+    """
+    Connection pools statistics of every created client
+
+    :return: {url (credentials masked): {"checked_out": ..., "avg_wait_ms": ..., ...}}
+    """
+
+    with _LOCK:
+        listeners = dict(_LISTENERS)
+    return {re.sub(r"//[^@/]+@", "//***@", url): listener.stats() for url, listener in listeners.items()}
+
+
+def close_clients():
+    """
+    Close every registered client (call on shutdown)
+
+    :return: None
+    """
+
+    with _LOCK:
+        for client in _CLIENTS.values():
+            client.close()
+        _CLIENTS.clear()
+        _LISTENERS.clear()
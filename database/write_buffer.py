@@ -0,0 +1,206 @@
+"""
+Write-behind buffer for MongoDB writes
+Small writes are queued per collection and sent with one bulk_write when the queue reaches max_ops
+or every interval_ms milliseconds. Callers are answered before the write is done, so writes whose result matters
+(submissions, membership) must not be buffered. Enable with the optional "write_behind" section of database_config.json:
+{"enabled": true, "max_ops": 100, "interval_ms": 50}
+"""
+
+import atexit
+import threading
+
+from typing import Dict, Tuple
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from configs.logger_conf import configure_logger
+from database.log_summary import Summary
+
+LOGGER = configure_logger(__name__)
+
+DUPLICATE_KEY = 11000  # MongoDB error code
+MAX_FLUSH_ATTEMPTS = 3  # Failed flushes (connection errors) before queued writes are dropped
+
+
+# pylint: disable = too-many-instance-attributes
+
+
+class WriteBuffer:
+    """
+    Per-collection queues of pymongo write operations (UpdateOne, ReplaceOne, DeleteOne, ...)
+    flushed in order with bulk_write
+    """
+
+    def __init__(self, database, max_ops=100, interval_ms=50):
+        """
+        :param database: pymongo Database
+        :param max_ops: flush collection queue when it reaches this size
+        :param interval_ms: flush all queues at least this often
+        """
+
+        self._database = database
+        self.max_ops = max_ops
+        self.interval = interval_ms / 1000
+        self._pending: Dict[str, list] = {}
+        self._lock = threading.Lock()  # protects _pending and _closed
+        self._flush_lock = threading.RLock()  # keeps flushes (and thus writes) in order
+        self._closed = False
+        self._stopped = threading.Event()
+        self._attempts: Dict[str, int] = {}  # collection -> failed flushes in a row
+        self.failed = 0  # dropped operations
+        self._flusher = threading.Thread(target=self._flush_periodically, name="altedy-write-behind", daemon=True)
+        self._flusher.start()
+
+    def add(self, collection_name, operation):
+        """
+        Queue write operation
+
+        :param collection_name:
+        :param operation: pymongo bulk write operation, e.g. UpdateOne(...)
+        :return: None
+        """
+
+        full = False
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                queue = self._pending.setdefault(collection_name, [])
+                queue.append(operation)
+                full = len(queue) >= self.max_ops
+        if closed:
+            with self._flush_lock:  # after the writes drained by close
+                self._database[collection_name].bulk_write([operation])
+        elif full:
+            self.flush(collection_name)
+
+    def flush(self, collection_name=None):
+        """
+        Send queued operations to MongoDB.
+        Call before reading a collection to see own writes
+
+        :param collection_name: leave empty to flush all collections
+        :return: None
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                if collection_name is None:
+                    batches, self._pending = self._pending, {}
+                else:
+                    batches = {collection_name: self._pending.pop(collection_name, [])}
+            for name, operations in batches.items():
+                if operations:
+                    self._write(name, operations)
+
+    def _write(self, collection_name, operations: list):
+        """
+        bulk_write operations in order. Ordered bulk write stops at the first failed operation: a duplicate key
+        (concurrent upsert inserted the record first) is retried once, other failed operations are dropped, and
+        the operations after it are written anyway. On connection errors the batch is queued again
+        in front of newer writes and given up after MAX_FLUSH_ATTEMPTS failed flushes
+        """
+
+        retried_duplicate = False
+        while operations:
+            try:
+                result = self._database[collection_name].bulk_write(operations, ordered=True)
+                LOGGER.debug("Flushed %d buffered writes to '%s': matched %d, upserted %d",
+                             len(operations), collection_name, result.matched_count, result.upserted_count)
+                break
+            except BulkWriteError as err:
+                error = err.details["writeErrors"][0]
+                index = error["index"]
+                if error.get("code") == DUPLICATE_KEY and not retried_duplicate:
+                    retried_duplicate = True
+                    operations = operations[index:]  # the upsert matches the inserted record now
+                    continue
+                LOGGER.error("Buffered write to '%s' failed and was dropped: %s (%s)", collection_name,
+                             Summary(error.get("op")), error.get("errmsg"))
+                self.failed += 1
+                retried_duplicate = False
+                operations = operations[index + 1:]
+            except PyMongoError as err:
+                self._requeue(collection_name, operations, err)
+                return
+        self._attempts.pop(collection_name, None)
+
+    def _requeue(self, collection_name, operations: list, err: PyMongoError):
+        attempts = self._attempts.get(collection_name, 0) + 1
+        if attempts >= MAX_FLUSH_ATTEMPTS:
+            LOGGER.critical("Dropped %d buffered writes to '%s' after %d failed flushes: %s", len(operations),
+                            collection_name, attempts, err)
+            self.failed += len(operations)
+            self._attempts.pop(collection_name, None)
+            return
+        LOGGER.error("Could not flush %d buffered writes to '%s', retrying later: %s", len(operations),
+                     collection_name, err)
+        self._attempts[collection_name] = attempts
+        with self._lock:
+            self._pending[collection_name] = operations + self._pending.get(collection_name, [])
+
+    def pending(self) -> int:
+        """
+        :return: number of queued operations
+        """
+
+        with self._lock:
+            return sum(len(operations) for operations in self._pending.values())
+
+    def close(self):
+        """
+        Stop periodic flushing and flush everything left (later writes are executed immediately,
+        after the queued ones)
+
+        :return: None
+        """
+
+        self._stopped.set()
+        self._flusher.join()
+        with self._flush_lock:
+            with self._lock:
+                self._closed = True
+            for _ in range(MAX_FLUSH_ATTEMPTS):
+                self.flush()
+                if not self.pending():
+                    break
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.interval):
+            if self.pending():
+                self.flush()
+
+
+_BUFFERS: Dict[Tuple[str, str], WriteBuffer] = {}
+_LOCK = threading.Lock()
+
+
+def get_write_buffer(client, url, db_name, options: dict) -> WriteBuffer:
+    """
+    Get shared write buffer for database, create it on first request
+
+    :param client: MongoClient
+    :param url: MongoDB connection string (registry key)
+    :param db_name: database name (registry key)
+    :param options: "write_behind" section of database_config.json
+    :return: WriteBuffer
+    """
+
+    with _LOCK:
+        if (url, db_name) not in _BUFFERS:
+            _BUFFERS[(url, db_name)] = WriteBuffer(client[db_name], options.get("max_ops", 100),
+                                                   options.get("interval_ms", 50))
+        return _BUFFERS[(url, db_name)]
+
+
+@atexit.register
+def close_write_buffers():
+    """
+    Flush and close every write buffer (call on shutdown)
+
+    :return: None
+    """
+
+    with _LOCK:
+        for buffer in _BUFFERS.values():
+            buffer.close()
+        _BUFFERS.clear()
@@ -0,0 +1,331 @@
+"""
+Students' answers ZIP-archive builder
+Entries are streamed straight from the blob store into the archive: no temporary answers tree on disk,
+the gradebook is generated in memory and already compressed formats are stored as is.
+Packed archives are cached by fingerprint of submissions: unchanged archive is served as is,
+after new submissions only changed students' entries are fetched from the blob store again
+"""
+
+import io
+import os
+import json
+import time
+import struct
+import zipfile
+import hashlib
+import tempfile
+import threading
+
+from pathlib import Path, PurePath
+from shutil import copyfileobj
+from typing import IO, BinaryIO, Callable, Collection, Dict, Iterable, Iterator, Optional
+
+import xlsxwriter
+
+from common.helper import get_temp_dir, get_md5
+from configs.logger_conf import configure_logger
+from database.blob_store import CHUNK_SIZE, open_attachment
+
+LOGGER = configure_logger(__name__)
+
+ARCHIVE_FORMAT = 2  # Bump when archive layout changes: invalidates cached archives
+MAX_CACHED_ARCHIVES = 64  # Least recently used archives above this number are removed
+
+
+# pylint: disable = too-many-locals, too-many-arguments
+
+# Formats which are already compressed: deflating them again costs CPU and saves nothing
+STORED_EXTENSIONS = {
+    ".zip", ".rar", ".7z", ".gz", ".bz2", ".xz",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+    ".mp3", ".ogg", ".oga", ".m4a", ".mp4", ".mov", ".avi", ".mkv", ".webm",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub",
+}
+
+
+def compress_type(filename) -> int:
+    """
+    ZIP compression method for file
+
+    :param filename:
+    :return: zipfile.ZIP_STORED for already compressed formats, zipfile.ZIP_DEFLATED otherwise
+    """
+
+    return zipfile.ZIP_STORED if PurePath(filename).suffix.lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _entry(name, filename) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = compress_type(filename)
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def _unique_name(filename: str, used: set) -> str:
+    """
+    Name not used in the student dir yet: repeated names get a number, e.g. "answer (2).pdf"
+    (compared ignoring case, archives are often unpacked on case-insensitive file systems)
+    """
+
+    name, number = filename, 1
+    while name.lower() in used:
+        number += 1
+        name = f"{PurePath(filename).stem} ({number}){PurePath(filename).suffix}"
+    used.add(name.lower())
+    return name
+
+
+def build_gradebook(student_ids: Iterable) -> bytes:
+    """
+    Generate gradebook in memory
+
+    :param student_ids: students with answers, one row each
+    :return: xlsx file contents
+    """
+
+    output = io.BytesIO()
+    gradebook = xlsxwriter.Workbook(output, {"in_memory": True})
+    worksheet = gradebook.add_worksheet()
+    for col_num, data in enumerate(["id", "answer_dir", "mark"]):
+        worksheet.write(0, col_num, data)
+
+    for row, student_id in enumerate(student_ids, start=1):
+        worksheet.write(row, 0, str(student_id))
+        worksheet.write_url(row, 1, f'external:{student_id}/', string="Click to open folder",
+                            tip='TIP: Link will work only if this excel table is in the same dir '
+                                'as students answers dirs (same folder structure as in archive).')
+    gradebook.close()
+    return output.getvalue()
+
+
+def _raw_entry(source: zipfile.ZipFile, info: zipfile.ZipInfo) -> Iterator[bytes]:
+    """
+    Compressed data of an entry as it is stored in the archive
+    """
+
+    source.fp.seek(info.header_offset)  # type: ignore
+    header = struct.unpack(zipfile.structFileHeader, source.fp.read(zipfile.sizeFileHeader))  # type: ignore
+    source.fp.seek(header[10] + header[11], os.SEEK_CUR)  # type: ignore # file name and extra field lengths
+    left = info.compress_size
+    while left > 0:
+        chunk = source.fp.read(min(CHUNK_SIZE, left))  # type: ignore
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated entry {info.filename}")
+        left -= len(chunk)
+        yield chunk
+
+
+def _copy_entries(source: zipfile.ZipFile, infos: list, archive: zipfile.ZipFile):
+    """
+    Copy entries without decompressing them: the local header is written from the original CRC, sizes and
+    compression method, then compressed data as is (zipfile has no public API for that)
+    """
+
+    for info in infos:
+        entry = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+        entry.compress_type, entry.external_attr = info.compress_type, info.external_attr
+        entry.CRC, entry.compress_size, entry.file_size = info.CRC, info.compress_size, info.file_size
+        entry.header_offset = archive.fp.tell()  # type: ignore
+        archive.fp.write(entry.FileHeader())  # type: ignore
+        for chunk in _raw_entry(source, info):
+            archive.fp.write(chunk)  # type: ignore
+        archive.filelist.append(entry)
+        archive.NameToInfo[entry.filename] = entry
+        archive.start_dir = archive.fp.tell()  # type: ignore
+        archive._didModify = True  # type: ignore # pylint: disable=protected-access
+
+
+def write_answers_archive(target: IO[bytes], task_id, submissions: list,
+                          progress: Optional[Callable[[int, int], None]] = None, *,
+                          previous: Optional[zipfile.ZipFile] = None, unchanged: Collection = ()):
+    """
+    Write archive with structure: <id>/description.txt, <id>/<files>, ..., gradebook-<task_id>.xlsx
+    (files with equal names are numbered: <id>/<name>, <id>/<name> (2), ...)
+
+    :param target: writable binary stream (seekable streams get smaller archive headers)
+    :param task_id:
+    :param submissions: [{'student_id': ..., 'description': ..., 'files': [...]}]
+    :param progress: called with (packed answers, total answers) after every answer
+    :param previous: archive packed earlier for the same task
+    :param unchanged: IDs of students whose entries are copied from previous archive instead of blob store
+    :return: None
+    """
+
+    previous_entries: Dict[str, list] = {}
+    if previous is not None:
+        for info in previous.infolist():
+            previous_entries.setdefault(info.filename.split("/", 1)[0], []).append(info)
+
+    with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for packed, answer in enumerate(submissions):
+            if progress:
+                progress(packed, len(submissions))
+            root = str(answer["student_id"])
+            if previous is not None and answer["student_id"] in unchanged and root in previous_entries:
+                _copy_entries(previous, previous_entries[root], archive)
+                continue
+            archive.writestr(_entry(f"{root}/description.txt", "description.txt"), answer.get("description") or "")
+            used = {"description.txt"}
+            for file in answer.get("files", []):
+                # user supplied name must not leave student dir or replace another entry
+                filename = _unique_name(PurePath(file["filename"]).name, used)
+                with archive.open(_entry(f"{root}/{filename}", filename), "w",
+                                  force_zip64=file.get("size", 0) >= zipfile.ZIP64_LIMIT) as entry, \
+                        open_attachment(file) as attachment_stream:
+                    copyfileobj(attachment_stream, entry, CHUNK_SIZE)
+        gradebook = build_gradebook([answer["student_id"] for answer in submissions])
+        archive.writestr(_entry(f"gradebook-{task_id}.xlsx", "gradebook.xlsx"), gradebook)
+    if progress:
+        progress(len(submissions), len(submissions))
+
+
+def answer_fingerprint(answer: dict) -> str:
+    """
+    Hash of everything that gets into student's archive entries
+
+    :param answer: submission record
+    :return: hex digest
+    """
+
+    digest = hashlib.sha256(json.dumps([answer.get("description"), answer.get("version"), answer.get("submitted_at")],
+                                       default=str).encode())
+    for file in answer.get("files", []):
+        digest.update(file["filename"].encode())
+        if "file" in file:  # not migrated embedded binary
+            digest.update(hashlib.sha256(bytes(file["file"])).digest())
+        else:
+            digest.update(str(file["blob_id"]).encode())
+    return digest.hexdigest()
+
+
+def _modified(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:  # removed by concurrent eviction
+        return 0.0
+
+
+class ArchiveCache:
+    """
+    Directory of packed answers archives: <task key>-<fingerprint>.zip with .json sidecar
+    {"fingerprint": ..., "students": {student_id: answer fingerprint}}
+    """
+
+    def __init__(self, root, max_archives=MAX_CACHED_ARCHIVES):
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self.max_archives = max_archives
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self.hits = self.rebuilds = self.reused_entries = 0
+
+    def _lock(self, key) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _latest(self, key) -> Optional[dict]:
+        metas = sorted(self._root.glob(f"{key}-*.json"), key=lambda path: path.stat().st_mtime, reverse=True)
+        for meta_path in metas:
+            if meta_path.with_suffix(".zip").exists():
+                with open(meta_path, encoding="utf-8") as meta_file:
+                    return {**json.load(meta_file), "path": meta_path.with_suffix(".zip")}
+        return None
+
+    def get(self, classroom_id, task_id, submissions: list,
+            progress: Optional[Callable[[int, int], None]] = None) -> BinaryIO:
+        """
+        Get archive for current submissions: cached one if nothing changed, otherwise pack it
+        reusing unchanged students' entries of the previous archive
+
+        :param classroom_id:
+        :param task_id:
+        :param submissions: submission records of the task
+        :param progress: see write_answers_archive
+        :return: readable binary stream positioned at start (close after use)
+        """
+
+        key = get_md5(f"{classroom_id}/{task_id}")
+        students = {str(answer["student_id"]): answer_fingerprint(answer) for answer in submissions}
+        fingerprint = hashlib.sha256(json.dumps([ARCHIVE_FORMAT, str(task_id), sorted(students.items())])
+                                     .encode()).hexdigest()
+        path = self._root / f"{key}-{fingerprint[:32]}.zip"
+
+        with self._lock(key):
+            if path.exists():
+                self.hits += 1
+                os.utime(path.with_suffix(".json"))
+                LOGGER.info("Serving cached answers archive of task %s", task_id)
+                return open(path, "rb")  # pylint: disable=consider-using-with
+
+            latest = self._latest(key)
+            unchanged = set()
+            if latest is not None:
+                unchanged = {answer["student_id"] for answer in submissions
+                             if latest["students"].get(str(answer["student_id"])) == students[str(answer["student_id"])]}
+
+            with tempfile.NamedTemporaryFile(dir=self._root, suffix=".part", delete=False) as target:
+                try:
+                    if latest is not None and unchanged:
+                        with zipfile.ZipFile(latest["path"]) as previous:
+                            write_answers_archive(target, task_id, submissions, progress, previous=previous,
+                                                  unchanged=unchanged)
+                    else:
+                        write_answers_archive(target, task_id, submissions, progress)
+                except BaseException:
+                    target.close()
+                    os.unlink(target.name)
+                    raise
+            os.replace(target.name, path)
+            with open(path.with_suffix(".json"), "w", encoding="utf-8") as meta_file:
+                json.dump({"fingerprint": fingerprint, "students": students}, meta_file)
+            self.rebuilds += 1
+            self.reused_entries += len(unchanged)
+            LOGGER.info("Packed answers archive of task %s: %d of %d answers reused", task_id, len(unchanged),
+                        len(submissions))
+            archive = open(path, "rb")  # pylint: disable=consider-using-with
+
+        self._evict()
+        return archive
+
+    def _evict(self):
+        """
+        Remove least recently used archives above max_archives, each under the lock of its task,
+        so an archive is never removed while it is being served or reused by get
+        """
+
+        metas = sorted(self._root.glob("*.json"), key=_modified, reverse=True)
+        for meta_path in metas[self.max_archives:]:
+            with self._lock(meta_path.stem.split("-", 1)[0]):
+                try:
+                    meta_path.with_suffix(".zip").unlink(missing_ok=True)
+                    meta_path.unlink(missing_ok=True)
+                except OSError as err:  # still being sent (Windows keeps opened files)
+                    LOGGER.debug("Could not remove cached archive %s: %s", meta_path.stem, err)
+
+    def stats(self) -> dict:
+        """
+        Cache counters
+
+        :return: dict
+        """
+
+        return {"archives": len(list(self._root.glob("*.json"))), "hits": self.hits, "rebuilds": self.rebuilds,
+                "reused_entries": self.reused_entries}
+
+
+_CACHE: Optional[ArchiveCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_archive_cache() -> ArchiveCache:
+    """
+    Get process-wide archives cache (in temp dir)
+
+    :return: ArchiveCache
+    """
+
+    global _CACHE  # pylint: disable=global-statement
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ArchiveCache(get_temp_dir("archives"))
+        return _CACHE
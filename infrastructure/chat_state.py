@@ -0,0 +1,79 @@
+"""
+Per-chat conversation state of message handlers
+Every chat gets its own last bot message ID (the message edited by inline keyboards), list of messages
+to delete on the next clean up and cached user type. States are kept in a bounded LRU: chats idle longer than TTL
+or least recently active above max_chats start over with an empty state
+"""
+
+import time
+
+from collections import OrderedDict, deque
+from typing import Deque, Optional
+
+MAX_CHATS = 10000  # Chats with state kept in memory
+CHAT_STATE_TTL = 24 * 60 * 60  # Seconds of inactivity before chat state is dropped (Telegram can't delete older messages anyway)
+MAX_CACHED_MSGS = 100  # Messages remembered for clean up per chat, older ones are left in chat
+
+
+# pylint: disable = too-few-public-methods
+
+
+class ChatState:
+    """
+    Conversation state of one chat
+    """
+
+    __slots__ = ("last_msg_id", "cached_msgs", "user_type", "active_at")
+
+    def __init__(self):
+        self.last_msg_id: Optional[int] = None  # Last BOT message ID (for updating)
+        self.cached_msgs: Deque[Optional[int]] = deque(maxlen=MAX_CACHED_MSGS)  # Messages to delete after certain step
+        self.user_type: Optional[str] = None  # student or teacher (to avoid numerous requests to DB)
+        self.active_at = time.monotonic()
+
+
+class ChatStates:
+    """
+    Bounded mapping chat_id -> ChatState (used from the event loop only)
+    """
+
+    def __init__(self, max_chats=MAX_CHATS, ttl=CHAT_STATE_TTL):
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._states: "OrderedDict[int, ChatState]" = OrderedDict()
+        self.evictions = self.expirations = 0
+
+    def get(self, chat_id) -> ChatState:
+        """
+        Get state of chat, new one for unknown or expired chats
+
+        :param chat_id:
+        :return: ChatState
+        """
+
+        now = time.monotonic()
+        state = self._states.pop(chat_id, None)
+        if state is not None and now - state.active_at > self.ttl:
+            self.expirations += 1
+            state = None
+        state = state or ChatState()
+        state.active_at = now
+        self._states[chat_id] = state
+
+        while self._states:  # drop expired states from the least recently active end
+            oldest = next(iter(self._states.values()))
+            if len(self._states) <= self.max_chats and now - oldest.active_at <= self.ttl:
+                break
+            if len(self._states) > self.max_chats:
+                self.evictions += 1
+            else:
+                self.expirations += 1
+            self._states.popitem(last=False)
+        return state
+
+    def stats(self) -> dict:
+        """
+        :return: {"chats": ..., "evictions": ..., "expirations": ...}
+        """
+
+        return {"chats": len(self._states), "evictions": self.evictions, "expirations": self.expirations}
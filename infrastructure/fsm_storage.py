@@ -0,0 +1,308 @@
+"""
+Bounded FSM storage of the dispatcher
+Conversation states (state, data, bucket of every chat/user) are kept in an LRU of at most max_sessions records;
+sessions idle longer than TTL are dropped. With a persistent store the LRU is a cache in front of a local SQLite file:
+changes are written in batches every flush interval, records pushed out of the LRU are read back on the next update
+of their user, so in-flight flows (e.g. task creation) survive restarts while memory stays bounded.
+Configure with the optional "FSM" section of bot_config.json:
+{"PERSISTENT": true, "PATH": "...", "TTL_HOURS": 168, "MAX_SESSIONS": 10000, "FLUSH_INTERVAL": 1.0}
+"""
+
+import copy
+import json
+import time
+import sqlite3
+import asyncio
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from configs.bot_conf import BotConfig
+from configs.logger_conf import configure_logger
+
+LOGGER = configure_logger(__name__)
+
+MAX_SESSIONS = 10000  # Sessions kept in memory
+SESSION_TTL = 7 * 24 * 60 * 60  # Seconds of inactivity before session is dropped
+FLUSH_INTERVAL = 1.0  # Seconds between batched writes to the persistent store
+
+_STORAGE: Optional["BoundedStorage"] = None
+
+
+# pylint: disable = arguments-differ, too-many-instance-attributes, broad-except
+
+
+Key = Tuple[str, str]
+
+
+def _new_record() -> dict:
+    return {"state": None, "data": {}, "bucket": {}, "active_at": time.time()}
+
+
+def _is_empty(record: dict) -> bool:
+    return record["state"] is None and not record["data"] and not record["bucket"]
+
+
+class SQLiteSessions:
+    """
+    Session table in a local SQLite file, used from the single storage thread only
+    """
+
+    def __init__(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS fsm (chat TEXT, user TEXT, state TEXT, data TEXT, "
+                                 "bucket TEXT, active_at REAL, PRIMARY KEY (chat, user))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS fsm_active_at ON fsm (active_at)")
+        self._connection.commit()
+
+    def load(self, key: Key) -> Optional[dict]:
+        """
+        :param key: (chat, user)
+        :return: record or None
+        """
+
+        row = self._connection.execute("SELECT state, data, bucket, active_at FROM fsm WHERE chat = ? AND user = ?",
+                                       key).fetchone()
+        if row is None:
+            return None
+        return {"state": row[0], "data": json.loads(row[1]), "bucket": json.loads(row[2]), "active_at": row[3]}
+
+    def write(self, rows: list, deleted: list, expired_before: float):
+        """
+        Apply one batch in one transaction
+
+        :param rows: (chat, user, state, data json, bucket json, active_at) to insert or replace
+        :param deleted: (chat, user) to delete
+        :param expired_before: drop sessions inactive since this timestamp
+        :return: None
+        """
+
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO fsm VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._connection.executemany("DELETE FROM fsm WHERE chat = ? AND user = ?", deleted)
+            self._connection.execute("DELETE FROM fsm WHERE active_at < ?", (expired_before,))
+
+    def count(self) -> int:
+        """
+        :return: number of stored sessions
+        """
+
+        return self._connection.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+
+    def close(self):
+        """
+        :return: None
+        """
+
+        self._connection.close()
+
+
+class BoundedStorage(BaseStorage):
+    """
+    aiogram FSM storage with LRU + TTL bound and optional SQLite persistence (used from the event loop only)
+    """
+
+    def __init__(self, path=None, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL, flush_interval=FLUSH_INTERVAL):
+        """
+        :param path: SQLite file of the persistent store, None to keep sessions in memory only
+        :param max_sessions: sessions kept in memory
+        :param ttl: seconds of inactivity before session is dropped
+        :param flush_interval: seconds between batched writes
+        """
+
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._records: "OrderedDict[Key, dict]" = OrderedDict()
+        self._dirty: Dict[Key, Optional[dict]] = {}  # key -> record to write (None to delete)
+        self._store: Optional[SQLiteSessions] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if path is not None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-storage")
+            self._store = self._executor.submit(SQLiteSessions, path).result()
+        self._flusher: Optional[asyncio.Task] = None
+        self.evictions = self.expirations = self.loads = self.writes = 0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _key(self, chat, user) -> Key:
+        chat, user = self.check_address(chat=chat, user=user)
+        return str(chat), str(user)
+
+    async def _record(self, chat, user) -> dict:
+        """
+        Get record of session from memory, from the pending batch or from the persistent store
+        """
+
+        key = self._key(chat, user)
+        record = self._records.pop(key, None)
+        if record is None:
+            record = self._dirty.get(key)
+        if record is None and key not in self._dirty and self._store is not None:
+            loaded = await self._run(self._store.load, key)
+            self.loads += 1
+            record = self._records.pop(key, None) or loaded  # updated by another handler while loading
+        now = time.time()
+        if record is not None and now - record["active_at"] > self.ttl:
+            self.expirations += 1
+            record = None
+        record = record or _new_record()
+        self._records[key] = record
+        self._shrink(now)
+        return record
+
+    def _shrink(self, now: float):
+        """
+        Drop sessions above max_sessions (they stay in the persistent store) and expired ones
+        """
+
+        while self._records:
+            key, oldest = next(iter(self._records.items()))
+            if len(self._records) <= self.max_sessions and now - oldest["active_at"] <= self.ttl:
+                break
+            if len(self._records) > self.max_sessions:
+                self.evictions += 1
+            else:
+                self.expirations += 1
+                if self._store is not None:
+                    self._dirty[key] = None
+            self._records.popitem(last=False)
+
+    def _changed(self, chat, user, record: dict):
+        """
+        Refresh activity time and queue record for the next batch
+        """
+
+        key = self._key(chat, user)
+        record["active_at"] = time.time()
+        if _is_empty(record):  # finished conversation, nothing to keep
+            self._records.pop(key, None)
+        if self._store is None:
+            return
+        self._dirty[key] = None if _is_empty(record) else record
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """
+        Write pending changes to the persistent store in one batch
+
+        :return: None
+        """
+
+        if self._store is None or not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        rows, deleted = [], []
+        for key, record in batch.items():
+            if record is None:
+                deleted.append(key)
+                continue
+            try:  # serialized here: records may change in the event loop while the batch is written
+                rows.append((*key, record["state"], json.dumps(record["data"]), json.dumps(record["bucket"]),
+                             record["active_at"]))
+            except (TypeError, ValueError) as err:
+                LOGGER.error("FSM session %s can not be persisted: %s", key, err)
+        try:
+            await self._run(self._store.write, rows, deleted, time.time() - self.ttl)
+            self.writes += 1
+        except Exception as err:
+            LOGGER.error("Could not write %d FSM sessions: %s", len(batch), err)
+            for key, record in batch.items():  # retry with the next batch unless changed since
+                self._dirty.setdefault(key, record)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._store is not None:
+            await self.flush()
+            await self._run(self._store.close)
+            self._store = None
+            self._executor.shutdown()  # type: ignore
+        self._records.clear()
+
+    async def wait_closed(self):
+        return True
+
+    async def get_state(self, *, chat=None, user=None, default=None) -> Optional[str]:
+        record = await self._record(chat, user)
+        return record["state"] if record["state"] is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None) -> dict:
+        record = await self._record(chat, user)
+        return copy.deepcopy(record["data"]) if record["data"] or default is None else copy.deepcopy(default)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        record = await self._record(chat, user)
+        record["data"].update(data or {}, **kwargs)
+        self._changed(chat, user, record)
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        record = await self._record(chat, user)
+        record["state"] = self.resolve_state(state)
+        self._changed(chat, user, record)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        record = await self._record(chat, user)
+        record["data"] = copy.deepcopy(data or {})
+        self._changed(chat, user, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None) -> dict:
+        record = await self._record(chat, user)
+        return copy.deepcopy(record["bucket"]) if record["bucket"] or default is None else copy.deepcopy(default)
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        record = await self._record(chat, user)
+        record["bucket"] = copy.deepcopy(bucket or {})
+        self._changed(chat, user, record)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        record = await self._record(chat, user)
+        record["bucket"].update(bucket or {}, **kwargs)
+        self._changed(chat, user, record)
+
+    async def stats(self) -> dict:
+        """
+        Size of the storage
+
+        :return: {"sessions": in memory, "stored": in the persistent store (None without it), "pending": ...,
+                  "evictions": ..., "expirations": ..., "loads": ..., "writes": ...}
+        """
+
+        stored = await self._run(self._store.count) if self._store is not None else None
+        return {"sessions": len(self._records), "stored": stored, "pending": len(self._dirty), "evictions": self.evictions,
+                "expirations": self.expirations, "loads": self.loads, "writes": self.writes}
+
+
+def get_fsm_storage() -> BoundedStorage:
+    """
+    Get process-wide FSM storage configured in bot_config.json
+
+    :return: BoundedStorage
+    """
+
+    global _STORAGE  # pylint: disable=global-statement
+    if _STORAGE is None:
+        options = BotConfig().properties.get("FSM", {})
+        path = None
+        if options.get("PERSISTENT", True):
+            path = options.get("PATH", Path(__file__).resolve().parent.parent / "temp" / "fsm.sqlite3")
+        _STORAGE = BoundedStorage(path, max_sessions=options.get("MAX_SESSIONS", MAX_SESSIONS),
+                                  ttl=options.get("TTL_HOURS", SESSION_TTL / 3600) * 3600,
+                                  flush_interval=options.get("FLUSH_INTERVAL", FLUSH_INTERVAL))
+    return _STORAGE
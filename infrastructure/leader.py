@@ -0,0 +1,124 @@
+"""
+Leader election between bot instances
+Every instance runs message handlers, but heavy background work (deadline jobs, reminders) must run in one of them.
+Instances compete for a lease (see database.lease): the holder is the leader and renews the lease every third
+of the lease time; when it stops (crash, network split) another instance takes the lease over once it expires
+"""
+
+import os
+import uuid
+import socket
+import asyncio
+
+from typing import Callable, Optional
+
+from configs.logger_conf import configure_logger
+from database.async_database import run_blocking
+from database.lease import Lease
+
+LOGGER = configure_logger(__name__)
+
+
+# pylint: disable = broad-except
+
+
+def instance_id() -> str:
+    """
+    :return: unique ID of this bot process, e.g. "host:1234:1a2b3c4d"
+    """
+
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaderElector:
+    """
+    Keeps trying to acquire the lease and tells when this instance becomes or stops being the leader
+    """
+
+    def __init__(self, lease: Lease, on_elected: Callable[[], None], on_deposed: Callable[[], None],
+                 on_tick: Optional[Callable[[], None]] = None):
+        """
+        :param lease:
+        :param on_elected: called when lease is acquired
+        :param on_deposed: called when lease is lost or can not be renewed before it expires
+        :param on_tick: called by the leader after every renewal
+        """
+
+        self.lease = lease
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.on_tick = on_tick
+        self.is_leader = False
+        self._renewed_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def interval(self) -> float:
+        """
+        :return: seconds between lease renewals
+        """
+
+        return self.lease.seconds / 3
+
+    async def check(self):
+        """
+        Acquire or renew lease once and switch role if needed
+
+        :return: None
+        """
+
+        loop = asyncio.get_running_loop()
+        try:
+            acquired = await run_blocking(self.lease.acquire)
+            if acquired:
+                self._renewed_at = loop.time()
+        except Exception as err:
+            # Lease store is unavailable: keep the role until our lease may have expired, then step down
+            LOGGER.warning("Could not renew leader lease '%s': %s", self.lease.name, err)
+            acquired = self.is_leader and loop.time() - self._renewed_at < self.lease.seconds - self.interval
+
+        if acquired and not self.is_leader:
+            LOGGER.info("Instance %s is the leader of '%s' now", self.lease.owner, self.lease.name)
+            self.is_leader = True
+            self.on_elected()
+        elif not acquired and self.is_leader:
+            LOGGER.warning("Instance %s is not the leader of '%s' any more", self.lease.owner, self.lease.name)
+            self.is_leader = False
+            self.on_deposed()
+        elif acquired and self.on_tick:
+            self.on_tick()
+
+    async def run(self):
+        """
+        Check lease every interval until cancelled
+
+        :return: None
+        """
+
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Run elections in background
+
+        :return: None
+        """
+
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        """
+        Stop elections and release the lease, so another instance takes over right away
+
+        :return: None
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            self.on_deposed()
+            await run_blocking(self.lease.release)
@@ -10,19 +10,19 @@ import os
 from pathlib import Path
 
 from aiogram import Bot, types
-from aiogram.utils.exceptions import TelegramAPIError
+from aiogram.utils.exceptions import TelegramAPIError, MessageToDeleteNotFound, MessageCantBeDeleted
 from aiogram.types import ParseMode
 from aiogram.dispatcher import FSMContext
 from dateutil.parser import parse  # type: ignore
-from bson.binary import Binary
 
 from common.helper import UserStatus, VerifyString, get_md5, get_temp_dir, get_plugins
 from configs.logger_conf import configure_logger
-from database.database import UserDatabase, ClassroomDatabase, DeadlineDatabase
+from database.async_database import AsyncUserDatabase, AsyncClassroomDatabase, AsyncDeadlineDatabase
 from infrastructure.keyboards.inline_keyboards import *
 from infrastructure.keyboards.reply_keyboards import *
 from infrastructure.keyboards.callbacks import *
-from infrastructure.task import Task, pack_answers
+from infrastructure.chat_state import ChatStates
+from infrastructure.task import Task, pack_answers_async, send_attachment
 
 LOGGER = configure_logger(__name__)
 
@@ -32,28 +32,31 @@ class Handler:
     Main class for commands processing and interactions
     """
 
-    def __init__(self, bot: Bot, db: UserDatabase,  # pylint: disable=invalid-name, too-many-arguments
-                 class_db: ClassroomDatabase, deadlines_db: DeadlineDatabase, dispatcher):
+    def __init__(self, bot: Bot, db: AsyncUserDatabase,  # pylint: disable=invalid-name, too-many-arguments
+                 class_db: AsyncClassroomDatabase, deadlines_db: AsyncDeadlineDatabase, dispatcher):
         self.bot = bot
 
         self.db = db  # pylint: disable=invalid-name
         self.class_db = class_db
         self.deadlines_db = deadlines_db
 
-        self.last_msg_id = None  # Last BOT message ID (for updating)
-        self._cached_msgs = []  # type: ignore # Bot & user interactions messages that should be deleted after certain step # noqa
-        self._user_type = None  # student or teacher (to avoid numerous requests to DB)
+        self.chats = ChatStates()  # Conversation state (last bot message, messages to delete, user type) per chat
 
         async def clean_chat(chat_id):
             """
-            Delete messages in list
+            Delete cached messages of chat
             :param chat_id:
             :return:
             """
 
-            for msg in self._cached_msgs:
-                await self.bot.delete_message(chat_id, msg)
-            self._cached_msgs.clear()
+            cached_msgs = self.chats.get(chat_id).cached_msgs
+            messages = [msg for msg in cached_msgs if msg is not None]  # None: state was dropped before message was sent
+            cached_msgs.clear()  # cleared before awaiting, so concurrent updates of the chat do not delete twice
+            for msg in messages:
+                try:
+                    await self.bot.delete_message(chat_id, msg)
+                except (MessageToDeleteNotFound, MessageCantBeDeleted) as err:
+                    LOGGER.debug(f"Could not delete message {msg} in chat {chat_id}: {err}")
 
         # region /commands
 
@@ -62,8 +65,9 @@ class Handler:
             """
             Send a message when the command /start is issued.
             """
+            chat = self.chats.get(message.chat.id)
             user = message.from_user
-            self.last_msg_id = (await self.bot.send_message(message.chat.id,
+            chat.last_msg_id = (await self.bot.send_message(message.chat.id,
                                                             f"Hello, {user.username}! "
                                                             f"Please, complete registration for further actions.",
                                                             reply_markup=await get_register_keyboard())).message_id
@@ -97,23 +101,24 @@ class Handler:
             :return:
             """
 
-            self._cached_msgs.append(message.message_id)
+            chat = self.chats.get(message.chat.id)
+            chat.cached_msgs.append(message.message_id)
 
             if re.fullmatch(VerifyString.EMAIL.value, message.text):
-                self.db.update(message.chat.id, {"email": message.text})
+                await self.db.update(message.chat.id, {"email": message.text})
 
                 await clean_chat(message.chat.id)
 
-                self._cached_msgs.append((await self.bot.send_message(
+                chat.cached_msgs.append((await self.bot.send_message(
                     message.chat.id, "Now please enter your full name, e.g. John Doe or Ivanov Ivan Ivanovich")
-                                          ).message_id)
+                                         ).message_id)
 
                 await UserStatus.WAIT_FULL_NAME.set()
 
             else:
-                self._cached_msgs.append((await self.bot.send_message(message.chat.id,
-                                                                      "Sorry, the email address you entered seems to be invalid. "  # noqa
-                                                                      "Please, check it and send one more time.")).message_id)  # noqa
+                chat.cached_msgs.append((await self.bot.send_message(message.chat.id,
+                                                                     "Sorry, the email address you entered seems to be invalid. "  # noqa
+                                                                     "Please, check it and send one more time.")).message_id)  # noqa
 
         @dispatcher.message_handler(content_types=["text"], state=UserStatus.WAIT_FULL_NAME)
         async def name_handler(message: types.Message):
@@ -125,27 +130,28 @@ class Handler:
             :return:
             """
 
-            self._cached_msgs.append(message.message_id)
+            chat = self.chats.get(message.chat.id)
+            chat.cached_msgs.append(message.message_id)
 
             if re.fullmatch(VerifyString.FULL_NAME.value, message.text):
-                self.db.update(message.chat.id, {"full_name": message.text})
+                await self.db.update(message.chat.id, {"full_name": message.text})
                 await clean_chat(message.chat.id)
 
-                if self._user_type == "student":
+                if chat.user_type == "student":
                     await clean_chat(message.chat.id)
 
-                    self._cached_msgs.append((await self.bot.send_message(
+                    chat.cached_msgs.append((await self.bot.send_message(
                         message.chat.id, "Thanks, now we're ready to go!",
                         reply_markup=await get_main_menu_markup("student"))).message_id)
                     await UserStatus.MAIN_MENU.set()
                 else:  # teacher
                     await ask_classroom_name(chat_id=message.chat.id)
             else:
-                self._cached_msgs.append((await self.bot.send_message(message.chat.id,
-                                                                      "Sorry, the name you entered seems to be invalid."  # noqa
-                                                                      "Write is as in example below:")).message_id)  # noqa
-                self._cached_msgs.append((await self.bot.send_message(message.chat.id, "Ivanov Ivan Ivanovich")
-                                          ).message_id)
+                chat.cached_msgs.append((await self.bot.send_message(message.chat.id,
+                                                                     "Sorry, the name you entered seems to be invalid."  # noqa
+                                                                     "Write is as in example below:")).message_id)  # noqa
+                chat.cached_msgs.append((await self.bot.send_message(message.chat.id, "Ivanov Ivan Ivanovich")
+                                         ).message_id)
 
         @dispatcher.callback_query_handler(lambda callback: callback.data == CALLBACK_REGISTER_1)
         async def reg_begin_registration(callback_query: types.CallbackQuery):
@@ -154,8 +160,9 @@ class Handler:
             :param callback_query:
             :return: None
             """
-            self.db.add_raw(callback_query.from_user.id)
-            await self.bot.edit_message_text("Choose working mode:", callback_query.from_user.id, self.last_msg_id,
+            chat = self.chats.get(callback_query.from_user.id)
+            await self.db.add_raw(callback_query.from_user.id)
+            await self.bot.edit_message_text("Choose working mode:", callback_query.from_user.id, chat.last_msg_id,
                                              reply_markup=await get_student_teacher_keyboard())
             await self.bot.answer_callback_query(callback_query.id)
 
@@ -166,16 +173,17 @@ class Handler:
             :param callback_query:
             :return: None
             """
-            self._cached_msgs.append(self.last_msg_id)
+            chat = self.chats.get(callback_query.from_user.id)
+            chat.cached_msgs.append(chat.last_msg_id)
             await clean_chat(callback_query.from_user.id)
-            if self.db.exists(callback_query.from_user.id):
-                self._user_type = self.db.get_type(callback_query.from_user.id)
-                self._cached_msgs.append((await self.bot.send_message(
+            if await self.db.exists(callback_query.from_user.id):
+                chat.user_type = await self.db.get_type(callback_query.from_user.id)
+                chat.cached_msgs.append((await self.bot.send_message(
                     callback_query.from_user.id, f"Welcome back, {callback_query.from_user.username}!",
-                    reply_markup=await get_main_menu_markup(self._user_type))).message_id)
+                    reply_markup=await get_main_menu_markup(chat.user_type))).message_id)
                 await UserStatus.MAIN_MENU.set()
             else:
-                self.last_msg_id = (await self.bot.send_message(
+                chat.last_msg_id = (await self.bot.send_message(
                     callback_query.from_user.id, "Sorry, you're not registered yet.",
                     reply_markup=await get_register_keyboard())).message_id
             await self.bot.answer_callback_query(callback_query.id)
@@ -188,10 +196,11 @@ class Handler:
             :param callback_query:
             :return: None
             """
-            self.db.update(callback_query.from_user.id, {"type": callback_query.data})
-            self._user_type = callback_query.data
+            chat = self.chats.get(callback_query.from_user.id)
+            await self.db.update(callback_query.from_user.id, {"type": callback_query.data})
+            chat.user_type = callback_query.data
             await self.bot.edit_message_text("Would you like to share your email to receive notifications?",
-                                             callback_query.from_user.id, self.last_msg_id,
+                                             callback_query.from_user.id, chat.last_msg_id,
                                              reply_markup=await get_ask_email_keyboard())
             await self.bot.answer_callback_query(callback_query.id)
 
@@ -204,8 +213,9 @@ class Handler:
             :return: None
             """
 
-            self._cached_msgs.append(self.last_msg_id)  # since next msgs are text from user, we no longer need this one
-            self._cached_msgs.append((await self.bot.send_message(
+            chat = self.chats.get(callback_query.from_user.id)
+            chat.cached_msgs.append(chat.last_msg_id)  # since next msgs are text from user, we no longer need this one
+            chat.cached_msgs.append((await self.bot.send_message(
                 callback_query.from_user.id, "Please, write your email as sample@address.com")).message_id)
             await UserStatus.WAIT_EMAIL.set()
 
@@ -223,24 +233,25 @@ class Handler:
             :return:
             """
 
-            self._cached_msgs.append(message.message_id)
+            chat = self.chats.get(message.chat.id)
+            chat.cached_msgs.append(message.message_id)
 
             # Generate MD5 for group using teacher's ID
             hash_id = get_md5(f"{message.chat.id}-{message.text}")
             # Add a record to classrooms database
-            self.class_db.add_raw(classroom_id=hash_id, teacher_id=message.chat.id,
-                                  additional={"name": message.text})
+            await self.class_db.add_raw(classroom_id=hash_id, teacher_id=message.chat.id,
+                                        additional={"name": message.text})
             # Add classroom ID to managed classrooms list in user DB for quick access
-            self.db.array_append({"user_id": message.chat.id}, "managed_classrooms", hash_id, collection_name=None)
-            self._cached_msgs.append((await self.bot.send_message(
+            await self.db.array_append({"user_id": message.chat.id}, "managed_classrooms", hash_id, collection_name=None)
+            chat.cached_msgs.append((await self.bot.send_message(
                 message.chat.id,
                 f"Classroom {message.text} created successfully! "
                 f"Send its ID (message below) to your students.")).message_id)
-            self._cached_msgs.append((await self.bot.send_message(message.chat.id,
-                                                                  f"Click on ID to copy: `{hash_id}`",  # noqa
-                                                                  parse_mode=ParseMode.MARKDOWN,
-                                                                  reply_markup=await get_main_menu_markup("teacher"))
-                                      ).message_id)
+            chat.cached_msgs.append((await self.bot.send_message(message.chat.id,
+                                                                 f"Click on ID to copy: `{hash_id}`",  # noqa
+                                                                 parse_mode=ParseMode.MARKDOWN,
+                                                                 reply_markup=await get_main_menu_markup("teacher"))
+                                     ).message_id)
             await UserStatus.MAIN_MENU.set()
 
         @dispatcher.callback_query_handler(lambda callback: callback.data == CALLBACK_CREATE_CLASSROOM)
@@ -254,7 +265,8 @@ class Handler:
             """
 
             _id = chat_id if chat_id else callback_query.from_user.id  # type: ignore
-            self._cached_msgs.append((await self.bot.send_message(
+            chat = self.chats.get(_id)
+            chat.cached_msgs.append((await self.bot.send_message(
                 _id, "Please, enter the name of your first classroom. "
                      "You will be able to create more later. "
                      "The recommended format is like: Data Management 19BI-3")).message_id)
@@ -274,9 +286,10 @@ class Handler:
             :return:
             """
 
+            chat = self.chats.get(message.chat.id)
             await clean_chat(message.chat.id)
 
-            self._cached_msgs.append((await self.bot.send_message(
+            chat.cached_msgs.append((await self.bot.send_message(
                 message.chat.id, "Please, send me group ID. "
                                  "If you don't have one, ask your teacher or classmates.")).message_id)
             await UserStatus.STUDENT_ADD_GROUP.set()
@@ -288,19 +301,20 @@ class Handler:
             :param message:
             :return:
             """
-            if self.class_db.add_student(message.chat.id, message.text):
+            chat = self.chats.get(message.chat.id)
+            if await self.class_db.add_student(message.chat.id, message.text):
                 await clean_chat(message.chat.id)
 
-                group_info = self.class_db.get_info(message.text)
+                group_info = await self.class_db.get_info(message.text, {"name": 1, "classroom_id": 1})
                 group_name = group_info["name"]
-                self.db.array_append({"user_id": message.chat.id}, "classrooms",
-                                     group_info["classroom_id"], collection_name=None)
-                self._cached_msgs.append((await self.bot.send_message(
+                await self.db.array_append({"user_id": message.chat.id}, "classrooms",
+                                           group_info["classroom_id"], collection_name=None)
+                chat.cached_msgs.append((await self.bot.send_message(
                     message.chat.id, f"Congratulations, you are now a member of {group_name}!",
                     reply_markup=await get_main_menu_markup("student"))).message_id)
                 await UserStatus.MAIN_MENU.set()
             else:
-                self._cached_msgs.append((await self.bot.send_message(
+                chat.cached_msgs.append((await self.bot.send_message(
                     message.chat.id, "Sorry, couldn't add you to the group.\n"
                                      "Please, check the ID you've entered or list of your classrooms "
                                      "(perhaps you are already a member of this group).")).message_id)
@@ -313,18 +327,17 @@ class Handler:
             :return:
             """
 
-            self._cached_msgs.append(message.message_id)
+            chat = self.chats.get(message.chat.id)
+            chat.cached_msgs.append(message.message_id)
             user_id = message.chat.id
 
-            student_classrooms = []
-            for group_id in self.db.find_one({"user_id": user_id})["classrooms"]:
-                student_classrooms.append(self.class_db.get_info(group_id))
+            student_classrooms = await self.class_db.get_names((await self.db.get_info(user_id)).get("classrooms", []))
 
             keyboard = []
             for group in student_classrooms:
                 keyboard.append([{group["name"]: f"{group['name']}:{group['classroom_id']}"}])
 
-            self.last_msg_id = (await self.bot.send_message(user_id, "Here is a list of your classrooms. "
+            chat.last_msg_id = (await self.bot.send_message(user_id, "Here is a list of your classrooms. "
                                                                      "Select one to view available actions.",
                                                             reply_markup=await get_custom_keyboard(keyboard))
                                 ).message_id
@@ -338,7 +351,8 @@ class Handler:
             :return:
             """
 
-            self._cached_msgs.append(message.message_id)
+            chat = self.chats.get(message.chat.id)
+            chat.cached_msgs.append(message.message_id)
             # TODO: fill
 
         @dispatcher.message_handler(lambda message: message.text in ["Deadlines"], state=UserStatus.all_states)
@@ -349,7 +363,8 @@ class Handler:
             :return:
             """
 
-            self._cached_msgs.append(message.message_id)
+            chat = self.chats.get(message.chat.id)
+            chat.cached_msgs.append(message.message_id)
             # TODO: fill
 
         @dispatcher.callback_query_handler(lambda callback: callback.data in [CALLBACK_STUDENT_CLASSROOM_VIEW_TASKS,
@@ -364,6 +379,7 @@ class Handler:
             :return:
             """
 
+            chat = self.chats.get(callback_query.from_user.id)
             user_id = callback_query.from_user.id
 
             await clean_chat(user_id)
@@ -373,7 +389,7 @@ class Handler:
                 await UserStatus.VIEW_TASKS.set()
                 await state.update_data(data)
 
-            student_tasks = self.class_db.get_info(classroom_id)["tasks"]
+            student_tasks = await self.class_db.get_task_summaries(classroom_id)
 
             keyboard = []
             msg_tasks_list = []
@@ -385,7 +401,7 @@ class Handler:
             await self.bot.edit_message_text(f"{group_name} active tasks: \n{''.join(msg_tasks_list)}\n"
                                              f"Select task ID to view available actions.",
                                              callback_query.from_user.id,
-                                             self.last_msg_id, reply_markup=await get_custom_keyboard(keyboard))
+                                             chat.last_msg_id, reply_markup=await get_custom_keyboard(keyboard))
 
         @dispatcher.callback_query_handler(state=UserStatus.VIEW_TASKS)
         async def view_task_actions(callback_query: types.CallbackQuery, state: FSMContext):
@@ -397,15 +413,16 @@ class Handler:
             :return:
             """
 
+            chat = self.chats.get(callback_query.from_user.id)
             array_task_id, group_id = callback_query.data.split(':')  # Store group ID and action performer's ID
             array_task_id = int(array_task_id)
-            tasks = self.class_db.get_info(group_id)["tasks"]
+            tasks = await self.class_db.get_task_summaries(group_id)
             selected_task = tasks[array_task_id]
 
-            if not self._user_type:
-                self._user_type = self.db.get_type(callback_query.from_user.id)
+            if not chat.user_type:
+                chat.user_type = await self.db.get_type(callback_query.from_user.id)
 
-            if self._user_type == "teacher":
+            if chat.user_type == "teacher":
                 await UserStatus.TEACHER_TASK_ACTIONS.set()
                 await state.update_data(classroom_id=group_id, task_id=selected_task["id"], array_task_id=array_task_id)
                 reply_markup = await get_teacher_task_actions_keyboard(get_files=bool(selected_task["files"]),
@@ -416,7 +433,7 @@ class Handler:
                 reply_markup = await get_student_task_actions_keyboard(get_files=bool(selected_task["files"]))
             await self.bot.edit_message_text(f"Task {array_task_id + 1} description: {selected_task['description']}\n"
                                              f"Available actions:",
-                                             callback_query.from_user.id, self.last_msg_id, reply_markup=reply_markup)
+                                             callback_query.from_user.id, chat.last_msg_id, reply_markup=reply_markup)
             await self.bot.answer_callback_query(callback_query.id)
 
         @dispatcher.callback_query_handler(lambda callback: callback.data == CALLBACK_DOWNLOAD_TASK_ATTCHMENTS,
@@ -432,17 +449,14 @@ class Handler:
 
             await clean_chat(callback_query.from_user.id)
             async with state.proxy() as data:  # classroom_id, task_id, array_task_id
-                tasks = self.class_db.get_info(data["classroom_id"])["tasks"]
-                selected_task = tasks[data["array_task_id"]]
-                files = {file["filename"]: file["file"] for file in selected_task["files"]}
-
-                for filename, file_bin in files.items():
-                    file_path = Path(get_temp_dir(callback_query.from_user.id) / filename)
-                    with open(file_path, "wb+") as handler:
-                        handler.write(Binary(file_bin))
-                    with open(file_path, "rb") as handler:
-                        await bot.send_document(callback_query.from_user.id, (filename, handler))
-                    os.remove(file_path)
+                selected_task = await self.class_db.get_task(data["classroom_id"], data["task_id"])
+
+                files = selected_task.get("files", [])
+                uploaded = False
+                for file in files:
+                    uploaded = await send_attachment(bot, callback_query.from_user.id, file) or uploaded
+                if uploaded:
+                    await Task(data["task_id"], data["classroom_id"], self.class_db).save_file_ids(files)
 
         @dispatcher.callback_query_handler(lambda callback: callback.data == CALLBACK_SUBMIT_TASK,
                                            state=UserStatus.STUDENT_TASK_ACTIONS)
@@ -454,19 +468,20 @@ class Handler:
             :return:
             """
 
-            self._cached_msgs.append(self.last_msg_id)
+            chat = self.chats.get(callback_query.from_user.id)
+            chat.cached_msgs.append(chat.last_msg_id)
             await clean_chat(callback_query.from_user.id)
 
             async with state.proxy() as data:
                 await UserStatus.STUDENT_SUBMIT_TASK.set()
                 await state.update_data(data)  # classroom_id, task_id, array_task_id
-            self._cached_msgs.append((await self.bot.send_message(callback_query.from_user.id,
-                                                                  "Please, send me your answer in the following form:\n"
-                                                                  "1. Just text message with answer\n"
-                                                                  "2. Text + file/image (any format - up to 15MB)\n"
-                                                                  "3. Just file/image\n"
-                                                                  "Use the attachment button to send me photos/files.")
-                                      ).message_id)
+            chat.cached_msgs.append((await self.bot.send_message(callback_query.from_user.id,
+                                                                 "Please, send me your answer in the following form:\n"
+                                                                 "1. Just text message with answer\n"
+                                                                 "2. Text + file/image (any format - up to 15MB)\n"
+                                                                 "3. Just file/image\n"
+                                                                 "Use the attachment button to send me photos/files.")
+                                     ).message_id)
 
         @dispatcher.message_handler(content_types=["text", "document", "photo"], state=UserStatus.STUDENT_SUBMIT_TASK)
         async def handle_student_task(message: types.Message, state: FSMContext):
@@ -476,9 +491,10 @@ class Handler:
             :param state:
             :return:
             """
+            chat = self.chats.get(message.chat.id)
             user_id = message.chat.id
             await clean_chat(user_id)
-            self._cached_msgs.append(message.message_id)
+            chat.cached_msgs.append(message.message_id)
 
             text_answer = message.text
 
@@ -492,22 +508,22 @@ class Handler:
                 task = Task(data["task_id"], data["classroom_id"], self.class_db, self.db, self.deadlines_db)
                 task_files = [file for file in Path(get_temp_dir(user_id)).glob('**/*') if file.is_file()]
                 for file in task_files:
-                    task.add_file(file)
+                    await task.add_file(file)
                     os.remove(str(file))
                 if text_answer:
                     task.add_text_description(text_answer)
-                task.add_student_answer(user_id)
+                await task.add_student_answer(user_id)
                 await clean_chat(user_id)
                 await UserStatus.MAIN_MENU.set()
-                self._cached_msgs.append((await self.bot.send_message(user_id,
-                                                                      f"Received and successfully uploaded "
-                                                                      f"{len(task_files)} files and description: "
-                                                                      f"{text_answer}.\nYou will be able to "
-                                                                      f"re-upload your answer any time before "
-                                                                      f"deadline.",
-                                                                      reply_markup=await get_main_menu_markup(
-                                                                          "student"))
-                                          ).message_id)
+                chat.cached_msgs.append((await self.bot.send_message(user_id,
+                                                                     f"Received and successfully uploaded "
+                                                                     f"{len(task_files)} files and description: "
+                                                                     f"{text_answer}.\nYou will be able to "
+                                                                     f"re-upload your answer any time before "
+                                                                     f"deadline.",
+                                                                     reply_markup=await get_main_menu_markup(
+                                                                         "student"))
+                                         ).message_id)
 
         @dispatcher.callback_query_handler(lambda callback: callback.data == CALLBACK_STUDENT_QUESTION,
                                            state=UserStatus.all_states)
@@ -528,7 +544,8 @@ class Handler:
         # region Teacher: main actions
         @dispatcher.message_handler(lambda message: message.text in ["Create group"], state=UserStatus.all_states)
         async def teacher_create_group(message: types.Message):
-            self._cached_msgs.append(message.message_id)
+            chat = self.chats.get(message.chat.id)
+            chat.cached_msgs.append(message.message_id)
             user_id = message.chat.id
             await clean_chat(user_id)
             await ask_classroom_name(chat_id=user_id)
@@ -541,19 +558,19 @@ class Handler:
             :return:
             """
 
-            self._cached_msgs.append(message.message_id)
+            chat = self.chats.get(message.chat.id)
+            chat.cached_msgs.append(message.message_id)
             user_id = message.chat.id
             await clean_chat(user_id)
 
-            managed_classrooms = []
-            for group_id in self.db.find_one({"user_id": user_id})["managed_classrooms"]:
-                managed_classrooms.append(self.class_db.get_info(group_id))
+            managed_classrooms = await self.class_db.get_names(
+                (await self.db.get_info(user_id)).get("managed_classrooms", []))
 
             keyboard = []
             for group in managed_classrooms:
                 keyboard.append([{group["name"]: f"{group['name']}:{group['classroom_id']}"}])
 
-            self.last_msg_id = (await self.bot.send_message(user_id, "Here are your managed groups. "
+            chat.last_msg_id = (await self.bot.send_message(user_id, "Here are your managed groups. "
                                                                      "Select one to view available actions.",
                                                             reply_markup=await get_custom_keyboard(keyboard))
                                 ).message_id
@@ -569,12 +586,13 @@ class Handler:
             :return:
             """
 
+            chat = self.chats.get(callback_query.from_user.id)
             group_name, group_id = callback_query.data.split(':')  # Store group ID and action performer's ID
 
-            if not self._user_type:
-                self._user_type = self.db.get_type(callback_query.from_user.id)
+            if not chat.user_type:
+                chat.user_type = await self.db.get_type(callback_query.from_user.id)
 
-            if self._user_type == "teacher":
+            if chat.user_type == "teacher":
                 await UserStatus.TEACHER_GROUPS_ACTIONS.set()
                 await state.update_data(classroom_id=group_id, group_name=group_name,
                                         teacher_id=callback_query.from_user.id)
@@ -584,7 +602,7 @@ class Handler:
                 await state.update_data(classroom_id=group_id, group_name=group_name)
                 reply_markup = await get_student_group_actions_keyboard()
             await self.bot.edit_message_text(f"Group {group_name} actions:", callback_query.from_user.id,
-                                             self.last_msg_id, reply_markup=reply_markup)
+                                             chat.last_msg_id, reply_markup=reply_markup)
             await self.bot.answer_callback_query(callback_query.id)
 
         @dispatcher.callback_query_handler(lambda callback: callback.data == CALLBACK_SETUP_PLUGINS,
@@ -599,12 +617,13 @@ class Handler:
             :return:
             """
 
+            chat = self.chats.get(callback_query.from_user.id)
             await clean_chat(callback_query.from_user.id)
             async with state.proxy() as data:  # classroom_id, group_name, teacher_id
                 await UserStatus.TEACHER_SETUP_PLUGINS.set()
                 await state.update_data(data)
 
-            classroom_info = self.class_db.get_info(data['classroom_id'])
+            classroom_info = await self.class_db.get_info(data['classroom_id'], {"plugins": 1})
             all_plugins = get_plugins()
             enabled_plugins = data.get("enabled_plugins", None) or classroom_info.get("plugins", [])
             keyboard = []
@@ -617,7 +636,7 @@ class Handler:
 
             await self.bot.edit_message_text("Here's a list of available free plugins (click to select/unselect):",
                                              callback_query.from_user.id,
-                                             self.last_msg_id, reply_markup=await get_custom_keyboard(keyboard))
+                                             chat.last_msg_id, reply_markup=await get_custom_keyboard(keyboard))
 
         @dispatcher.callback_query_handler(state=UserStatus.TEACHER_SETUP_PLUGINS)
         async def teacher_plugins_change(callback_query: types.CallbackQuery, state: FSMContext):
@@ -629,20 +648,21 @@ class Handler:
             :return:
             """
 
+            chat = self.chats.get(callback_query.from_user.id)
             module_name, group_id = callback_query.data.split(':')
 
             async with state.proxy() as data:
                 enabled_plugins = data.get("enabled_plugins", [])
                 if module_name == "save":
-                    self.class_db.update({"classroom_id": group_id}, {"plugins": enabled_plugins})
-                    self._cached_msgs.append(self.last_msg_id)
+                    await self.class_db.update({"classroom_id": group_id}, {"plugins": enabled_plugins})
+                    chat.cached_msgs.append(chat.last_msg_id)
                     await clean_chat(callback_query.from_user.id)
-                    self._cached_msgs.append((await self.bot.send_message(callback_query.from_user.id,
-                                                                          "Successfully updated your plugins.",
-                                                                          reply_markup=await get_main_menu_markup(
-                                                                              "teacher")
-                                                                          )
-                                              ).message_id)
+                    chat.cached_msgs.append((await self.bot.send_message(callback_query.from_user.id,
+                                                                         "Successfully updated your plugins.",
+                                                                         reply_markup=await get_main_menu_markup(
+                                                                             "teacher")
+                                                                         )
+                                             ).message_id)
                 else:
                     if module_name in enabled_plugins:
                         enabled_plugins.remove(module_name)
@@ -661,11 +681,12 @@ class Handler:
             :return:
             """
 
+            chat = self.chats.get(callback_query.from_user.id)
             await clean_chat(callback_query.from_user.id)
             async with state.proxy() as data:
                 await UserStatus.TEACHER_CREATE_TASK.set()
                 await state.update_data(data)
-            self.last_msg_id = (await self.bot.send_message(callback_query.from_user.id,
+            chat.last_msg_id = (await self.bot.send_message(callback_query.from_user.id,
                                                             "Please, send me the task in the following form:\n"
                                                             "1. Just text message with description\n"
                                                             "2. Text description + file (any format - up to 15MB)\n"
@@ -686,9 +707,10 @@ class Handler:
             :return:
             """
 
+            chat = self.chats.get(message.chat.id)
             user_id = message.chat.id
             await clean_chat(user_id)
-            self._cached_msgs.append(message.message_id)
+            chat.cached_msgs.append(message.message_id)
 
             description = message.text
             task_id = get_md5(f"{user_id}-{description}-{message.message_id}")
@@ -705,16 +727,16 @@ class Handler:
                     task.add_text_description(description)
                 task_files = [file for file in Path(get_temp_dir(user_id)).glob('**/*') if file.is_file()]
                 for file in task_files:
-                    task.add_file(file)
+                    await task.add_file(file)
                     os.remove(str(file))
-                task.prepare(user_id)
+                await task.prepare(user_id)
 
             await UserStatus.TEACHER_WAIT_TASK_DEADLINE.set()
             await state.update_data(task_id=task_id, creator_id=user_id, classroom_id=data["classroom_id"])
-            self._cached_msgs.append((await self.bot.send_message(user_id,
-                                                                  "Now send me the deadline for this task in any form, "
-                                                                  "e.g. 26.04.2022 23:59 or 26 april 2022 23:59.")
-                                      ).message_id)
+            chat.cached_msgs.append((await self.bot.send_message(user_id,
+                                                                 "Now send me the deadline for this task in any form, "
+                                                                 "e.g. 26.04.2022 23:59 or 26 april 2022 23:59.")
+                                     ).message_id)
 
         @dispatcher.message_handler(content_types=["text"], state=UserStatus.TEACHER_WAIT_TASK_DEADLINE)
         async def task_deadline_handler(message: types.Message, state: FSMContext):
@@ -725,48 +747,50 @@ class Handler:
             :return:
             """
 
+            chat = self.chats.get(message.chat.id)
             try:
                 date = parse(message.text, dayfirst=True)
                 async with state.proxy() as data:
                     task_id, classroom_id = data["task_id"], data["classroom_id"]
                     task = Task(task_id, classroom_id, self.class_db, self.db, self.deadlines_db)
-                    task.set_deadline(date)
-                    self.last_msg_id = (await self.bot.send_message(message.chat.id,
+                    await task.set_deadline(date)
+                    chat.last_msg_id = (await self.bot.send_message(message.chat.id,
                                                                     "Your task is ready. Send it to students?",
                                                                     reply_markup=await get_yes_no_keyboard())
                                         ).message_id
                     await UserStatus.TEACHER_SEND_TASK.set()
                     await state.update_data(task_id=task_id, classroom_id=classroom_id)
             except ValueError:
-                self._cached_msgs.append((await self.bot.send_message(message.chat.id,
-                                                                      "Sorry, I couldn't recognize the date format. "
-                                                                      "Try more clear format, e.g. 26.04.2022 23:59")
-                                          ).message_id)
+                chat.cached_msgs.append((await self.bot.send_message(message.chat.id,
+                                                                     "Sorry, I couldn't recognize the date format. "
+                                                                     "Try more clear format, e.g. 26.04.2022 23:59")
+                                         ).message_id)
 
         @dispatcher.callback_query_handler(state=UserStatus.TEACHER_SEND_TASK)
         async def teacher_submit_task(callback_query: types.CallbackQuery, state: FSMContext):
+            chat = self.chats.get(callback_query.from_user.id)
             await clean_chat(callback_query.from_user.id)
             if callback_query.data == CALLBACK_YES:
                 async with state.proxy() as data:
                     task = Task(data["task_id"], data["classroom_id"], self.class_db, self.db, self.deadlines_db)
                     await task.send_students(self.bot)
-                self._cached_msgs.append((await self.bot.send_message(callback_query.from_user.id,
-                                                                      "Task was successfully sent to students! "
-                                                                      "You'll receive solutions after deadline comes.",
-                                                                      reply_markup=await get_main_menu_markup("teacher")
-                                                                      )
-                                          ).message_id)
+                chat.cached_msgs.append((await self.bot.send_message(callback_query.from_user.id,
+                                                                     "Task was successfully sent to students! "
+                                                                     "You'll receive solutions after deadline comes.",
+                                                                     reply_markup=await get_main_menu_markup("teacher")
+                                                                     )
+                                         ).message_id)
             else:
                 async with state.proxy() as data:
                     task = Task(data["task_id"], data["classroom_id"], self.class_db, self.db, self.deadlines_db)
-                    task.set_active(False)
-                self._cached_msgs.append((await self.bot.send_message(callback_query.from_user.id,
-                                                                      "Task was not sent to students. "
-                                                                      "You will be able to send/modify it later "
-                                                                      "in section 'classroom' - 'tasks'.",
-                                                                      reply_markup=await get_main_menu_markup(
-                                                                          "teacher"))
-                                          ).message_id)
+                    await task.set_active(False)
+                chat.cached_msgs.append((await self.bot.send_message(callback_query.from_user.id,
+                                                                     "Task was not sent to students. "
+                                                                     "You will be able to send/modify it later "
+                                                                     "in section 'classroom' - 'tasks'.",
+                                                                     reply_markup=await get_main_menu_markup(
+                                                                         "teacher"))
+                                         ).message_id)
             await UserStatus.MAIN_MENU.set()
 
         @dispatcher.callback_query_handler(lambda callback: callback.data == CALLBACK_GET_TASK_ANSWERS,
@@ -780,24 +804,31 @@ class Handler:
             :return:
             """
 
-            await clean_chat(callback_query.from_user.id)
+            chat = self.chats.get(callback_query.from_user.id)
+            user_id = callback_query.from_user.id
+            await clean_chat(user_id)
             async with state.proxy() as data:  # classroom_id, task_id, array_task_id
-                zip_dir_path = Path(get_temp_dir(callback_query.from_user.id)) / "tasks_packed"
-                zip_file = pack_answers(data["classroom_id"], data["task_id"], zip_dir_path, mail=True)
-                with open(zip_file, "rb") as handler:
-                    self._cached_msgs.append(await self.bot.send_message(callback_query.from_user.id,
-                                                                         "Here is a ZIP-archive with students' answers"
-                                                                         " awailable at this moment. You'll receive "
-                                                                         "the updated version again after deadline. "
-                                                                         "Please, unpack it in single folder and "
-                                                                         "do not rename the excel file. It has links "
-                                                                         "to all students' answers and a mark column.\n"
-                                                                         "After evaluating, please send me this "
-                                                                         "excel file - just by the attachment button "
-                                                                         "from the main menu."))
-                    await self.bot.send_document(callback_query.from_user.id,
-                                                 (f"task_{data['array_task_id']}.zip", handler),
-                                                 reply_markup=await get_main_menu_markup("teacher"))
+                classroom_id, task_id, array_task_id = data["classroom_id"], data["task_id"], data["array_task_id"]
+
+            progress_msg = await self.bot.send_message(user_id, "Packing students' answers, please wait...")
+            chat.cached_msgs.append(progress_msg.message_id)
+
+            async def show_progress(packed, total):
+                await progress_msg.edit_text(f"Packing students' answers: {packed} of {total} done...")
+
+            with await pack_answers_async(classroom_id, task_id, mail=True, on_progress=show_progress) as archive:
+                chat.cached_msgs.append((await self.bot.send_message(user_id,
+                                                                     "Here is a ZIP-archive with students' answers"
+                                                                     " awailable at this moment. You'll receive "
+                                                                     "the updated version again after deadline. "
+                                                                     "Please, unpack it in single folder and "
+                                                                     "do not rename the excel file. It has links "
+                                                                     "to all students' answers and a mark column.\n"
+                                                                     "After evaluating, please send me this "
+                                                                     "excel file - just by the attachment button "
+                                                                     "from the main menu.")).message_id)
+                await self.bot.send_document(user_id, (f"task_{array_task_id}.zip", archive),
+                                             reply_markup=await get_main_menu_markup("teacher"))
             await UserStatus.MAIN_MENU.set()
 
         # endregion
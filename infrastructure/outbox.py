@@ -0,0 +1,246 @@
+"""
+Rate-limited outbox for Telegram notifications
+Bulk notifications are fanned out concurrently, while every API call waits for a token of the global bucket
+(Telegram allows about 30 messages per second per bot) and of the recipient's bucket (about 1 message per second
+per chat, short bursts are tolerated). RetryAfter pauses sending for the requested time, network errors are retried
+with backoff and a failed recipient (blocked the bot, deleted account, ...) does not stop delivery to the others.
+Limits are set by the optional "OUTBOX" section of bot_config.json:
+{"RATE": 25, "CHAT_RATE": 1, "CHAT_BURST": 3, "CONCURRENCY": 16, "MAX_RETRIES": 3}
+"""
+
+import asyncio
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import Bot
+from aiogram.utils.exceptions import NetworkError, RestartingTelegram, RetryAfter, TelegramAPIError
+
+from configs.bot_conf import BotConfig
+from configs.logger_conf import configure_logger
+
+LOGGER = configure_logger(__name__)
+
+MAX_CHAT_BUCKETS = 10000  # Least recently used per-chat buckets above this number are dropped
+
+
+# pylint: disable = too-many-instance-attributes, too-many-arguments, too-few-public-methods
+
+
+class Upload:
+    """
+    Argument built anew for every attempt of a request: aiohttp closes uploaded streams, so a retried upload
+    needs a fresh InputFile, e.g. Upload(lambda: InputFile(io.BytesIO(contents), filename="task.pdf"))
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self.factory = factory
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket: rate tokens per second, at most capacity tokens saved up for bursts
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = 0.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        if self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """
+        Wait for a token and take it
+
+        :return: None
+        """
+
+        loop = asyncio.get_running_loop()
+        async with self._lock:  # waiters are served in order
+            while True:
+                now = loop.time()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Give no tokens for some time (after RetryAfter), saved up tokens are dropped
+
+        :param seconds:
+        :return: None
+        """
+
+        now = asyncio.get_running_loop().time()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
+
+
+def _build(argument):
+    return argument.factory() if isinstance(argument, Upload) else argument
+
+
+class Outbox:
+    """
+    Sends Bot API requests within global and per-chat rate limits
+    """
+
+    def __init__(self, bot: Bot, *, rate=25.0, chat_rate=1.0, chat_burst=3, concurrency=16, max_retries=3):
+        """
+        :param bot:
+        :param rate: requests per second for the whole bot
+        :param chat_rate: requests per second to one chat
+        :param chat_burst: requests to one chat sent without waiting
+        :param concurrency: recipients served simultaneously by broadcast
+        :param max_retries: attempts after RetryAfter or network error before giving up
+        """
+
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._global = TokenBucket(rate, rate)
+        self._chats: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        self._counters = {"sent": 0, "retried": 0, "retry_after_waits": 0, "failed": 0, "broadcasts": 0}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.pop(chat_id, None) or TokenBucket(self.chat_rate, self.chat_burst)
+        self._chats[chat_id] = bucket
+        if len(self._chats) > MAX_CHAT_BUCKETS:
+            self._chats.popitem(last=False)
+        return bucket
+
+    async def call(self, chat_id, method: Callable[..., Awaitable], *args, **kwargs):
+        """
+        Call Bot API method addressed to chat within rate limits, retry on RetryAfter and network errors
+
+        :param chat_id: recipient, used for per-chat rate limit
+        :param method: bound Bot method, e.g. bot.send_message
+        :param args: method arguments, Upload arguments are built for every attempt
+        :param kwargs: method keyword arguments
+        :return: method result
+        """
+
+        bucket = self._chat_bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                result = await method(*map(_build, args), **{name: _build(value) for name, value in kwargs.items()})
+                self._counters["sent"] += 1
+                return result
+            except RetryAfter as err:
+                if attempt == self.max_retries:
+                    raise
+                LOGGER.warning("Flood control for chat %s: waiting %d seconds", chat_id, err.timeout)
+                self._counters["retry_after_waits"] += 1
+                self._global.pause(err.timeout)  # limit may be bot-wide, so everything waits
+            except (NetworkError, RestartingTelegram) as err:
+                if attempt == self.max_retries:
+                    raise
+                LOGGER.warning("Request to chat %s failed, retrying: %s", chat_id, err)
+                await asyncio.sleep(2 ** attempt)
+            self._counters["retried"] += 1
+        raise AssertionError("unreachable")
+
+    async def send_message(self, chat_id, text, **kwargs):
+        """
+        Rate-limited bot.send_message
+
+        :return: sent Message
+        """
+
+        return await self.call(chat_id, self.bot.send_message, chat_id, text, **kwargs)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        """
+        Rate-limited bot.send_document, pass a new file as Upload to have it retried
+
+        :return: sent Message
+        """
+
+        return await self.call(chat_id, self.bot.send_document, chat_id, document, **kwargs)
+
+    async def broadcast(self, chat_ids: Iterable, deliver: Callable[[Any], Awaitable[Any]]) -> dict:
+        """
+        Run deliver(chat_id) for every recipient concurrently. Messages of one recipient are sent in order
+        by deliver itself; an error of one recipient is logged and does not affect the others
+
+        :param chat_ids: recipients
+        :param deliver: coroutine function sending everything to one recipient through this outbox
+        :return: {"delivered": number of recipients, "failed": {chat_id: error description}}
+        """
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        report: Dict[str, Any] = {"delivered": 0, "failed": {}}
+
+        async def deliver_one(chat_id):
+            async with semaphore:
+                try:
+                    await deliver(chat_id)
+                    report["delivered"] += 1
+                except TelegramAPIError as err:
+                    LOGGER.warning("Could not deliver notification to %s: %s", chat_id, err)
+                    report["failed"][chat_id] = str(err)
+                except Exception as err:  # pylint: disable=broad-except
+                    LOGGER.exception("Notification to %s failed", chat_id)
+                    report["failed"][chat_id] = repr(err)
+
+        self._counters["broadcasts"] += 1
+        await asyncio.gather(*(deliver_one(chat_id) for chat_id in chat_ids))
+        self._counters["failed"] += len(report["failed"])
+        LOGGER.info("Broadcast finished: %d delivered, %d failed", report["delivered"], len(report["failed"]))
+        return report
+
+    def stats(self) -> dict:
+        """
+        Delivery counters
+
+        :return: dict
+        """
+
+        return {**self._counters, "chats": len(self._chats)}
+
+
+_OUTBOX: Optional[Outbox] = None
+
+
+def get_outbox(bot: Bot) -> Outbox:
+    """
+    Get process-wide outbox, create it for bot on first request
+
+    :param bot:
+    :return: Outbox
+    """
+
+    global _OUTBOX  # pylint: disable=global-statement
+    if _OUTBOX is None:
+        options = BotConfig().properties.get("OUTBOX", {})
+        _OUTBOX = Outbox(bot, rate=options.get("RATE", 25.0), chat_rate=options.get("CHAT_RATE", 1.0),
+                         chat_burst=options.get("CHAT_BURST", 3), concurrency=options.get("CONCURRENCY", 16),
+                         max_retries=options.get("MAX_RETRIES", 3))
+    return _OUTBOX
+
+
+def get_outbox_stats() -> dict:
+    """
+    Delivery counters of the outbox (empty if nothing was sent)
+
+    :return: dict
+    """
+
+    return _OUTBOX.stats() if _OUTBOX is not None else {}
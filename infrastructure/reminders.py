@@ -0,0 +1,108 @@
+"""
+Deadline reminders for students who have not submitted answers yet
+Every REMINDER_INTERVAL each reminder window ("24h", "1h") is checked with one range scan over the deadlines date index:
+deadlines coming within the window and not reminded yet. Tasks, submissions and students of all found deadlines are
+loaded in bulk, so the work depends on the number of due reminders only, not on the number of users or classrooms
+"""
+
+from datetime import datetime, timedelta
+from typing import Set, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import NetworkError, RestartingTelegram, RetryAfter
+
+from configs.logger_conf import configure_logger
+from database.async_database import AsyncClassroomDatabase, AsyncDeadlineDatabase
+from infrastructure.outbox import get_outbox
+from infrastructure.task import SCHEDULER
+
+LOGGER = configure_logger(__name__)
+
+REMINDERS = {"1h": timedelta(hours=1), "24h": timedelta(hours=24)}  # Name -> time left to deadline
+REMINDER_INTERVAL = timedelta(minutes=5)  # How often reminder windows are checked
+REMINDER_BATCH = 100  # Recipients per outbox broadcast
+
+
+# pylint: disable = logging-fstring-interpolation, too-many-locals
+
+
+def start_reminders(bot: Bot):
+    """
+    Check reminder windows periodically (first check right away)
+    :param bot: Bot instance for notification sending
+    :return:
+    """
+
+    SCHEDULER.add_job(send_reminders, "interval", args=[bot], seconds=REMINDER_INTERVAL.total_seconds(),
+                      id="deadline_reminders", next_run_time=datetime.now(), replace_existing=True, coalesce=True,
+                      max_instances=1, misfire_grace_time=None)  # missed checks run once the scheduler is resumed
+
+
+def _time_left(offset: timedelta) -> str:
+    hours = int(offset.total_seconds() // 3600)
+    return f"{hours} hour" if hours == 1 else f"{hours} hours"
+
+
+async def send_reminders(bot: Bot):
+    """
+    Remind students without answers about coming deadlines.
+    Windows are checked from the shortest one: a deadline found in it is marked as reminded for the longer windows too,
+    so a student never gets "24 hours left" after "1 hour left"
+    :param bot:
+    :return:
+    """
+
+    deadlines_db = AsyncDeadlineDatabase()
+    classroom_db = AsyncClassroomDatabase()
+    now = datetime.now()
+    for reminder, offset in sorted(REMINDERS.items(), key=lambda item: item[1]):
+        deadlines = await deadlines_db.get_deadlines_to_remind(reminder, now, now + offset)
+        if not deadlines:
+            continue
+
+        keys = [(deadline["classroom_id"], deadline["task_id"]) for deadline in deadlines]
+        tasks = await classroom_db.get_tasks(keys, {"_id": 0, "description": 1})
+        submitted = await classroom_db.get_submitted_students(keys)
+        students = await classroom_db.get_student_ids(list({classroom_id for classroom_id, _ in keys}))
+        sent = 0
+        done = []  # deadlines reminded, or with nobody to remind: not checked again
+        for deadline in deadlines:
+            key = (deadline["classroom_id"], deadline["task_id"])
+            task = tasks.get(key)
+            missing = [student_id for student_id in students.get(key[0], []) if student_id not in submitted[key]]
+            if not task or not missing:
+                done.append(key[1])
+                continue
+            text = (f"Reminder: less than {_time_left(offset)} left until the deadline ({deadline['date']:%d %B, %H:%M}) "
+                    f"of the task:\n<<{task.get('description', 'empty')}>>\nYou have not sent your answer yet.")
+            delivered, unreachable = await _remind(bot, missing, text)
+            sent += delivered
+            if delivered or not unreachable:  # otherwise Telegram was unreachable, try again on the next check
+                done.append(key[1])
+
+        if done:
+            await deadlines_db.mark_reminded(done, [name for name, other in REMINDERS.items() if other >= offset])
+        LOGGER.info(f"Reminder '{reminder}': {len(deadlines)} deadlines, {sent} students reminded, "
+                    f"{len(deadlines) - len(done)} deadlines postponed.")
+
+
+async def _remind(bot: Bot, student_ids: list, text: str) -> Tuple[int, int]:
+    """
+    :return: number of reminded students, number of students not reached because of network errors
+    """
+
+    outbox = get_outbox(bot)
+    delivered = 0
+    unreachable: Set = set()
+
+    async def deliver(student_id):
+        try:
+            await outbox.send_message(student_id, text)
+        except (NetworkError, RestartingTelegram, RetryAfter):
+            unreachable.add(student_id)
+            raise
+
+    for start in range(0, len(student_ids), REMINDER_BATCH):
+        report = await outbox.broadcast(student_ids[start:start + REMINDER_BATCH], deliver)
+        delivered += report["delivered"]
+    return delivered, len(unreachable)
@@ -2,201 +2,293 @@
 General tools for task actions
 """
 
+import io
 import os
+import asyncio
+import functools
 
-from datetime import datetime, timedelta
-from pathlib import Path
-from shutil import make_archive, rmtree
-
-import xlsxwriter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Awaitable, BinaryIO, Callable, Optional, Union
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiogram import Bot
-from bson.binary import Binary
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import WrongFileIdentifier, WrongRemoteFileIdSpecified
 
-from common.helper import get_temp_dir
 from common.email_api import send_mail
 from configs.logger_conf import configure_logger
-from database.database import UserDatabase, ClassroomDatabase, DeadlineDatabase
+from database.database import UserDatabase, ClassroomDatabase
+from database.async_database import AsyncUserDatabase, AsyncClassroomDatabase, AsyncDeadlineDatabase, run_blocking
+from database.blob_store import get_blob_store, read_attachment
+from database.job_store import get_job_store
+from database.lease import get_lease
+from infrastructure.answers_archive import get_archive_cache
 from infrastructure.keyboards.reply_keyboards import get_main_menu_markup
+from infrastructure.leader import LeaderElector, instance_id
+from infrastructure.outbox import Outbox, Upload, get_outbox
 
 LOGGER = configure_logger(__name__)
 SCHEDULER = AsyncIOScheduler()
+DEADLINES_JOBSTORE = "deadlines"  # Persistent job store alias (see database.job_store)
+_BOT: Optional[Bot] = None  # Jobs are stored by function reference, so they get the bot from here
+_ELECTOR: Optional[LeaderElector] = None
+
+PACK_WORKERS = 2  # Upper bound of simultaneously packed archives, other requests wait in queue
+PACK_EXECUTOR = ThreadPoolExecutor(max_workers=PACK_WORKERS, thread_name_prefix="altedy-pack")
+PROGRESS_INTERVAL = 2.0  # Seconds between packing progress reports
 
 
 # pylint: disable = logging-fstring-interpolation, unnecessary-pass, too-many-locals
 
 
-def check_deadlines(bot: Bot):
+def deadline_job_id(classroom_id, task_id) -> str:
+    """
+    :return: ID of the scheduled deadline job of task
+    """
+
+    return f"deadline:{classroom_id}:{task_id}"
+
+
+async def start_scheduler(bot: Bot):
     """
-    Auto-checker for upcoming deadlines.
-    Checks if today is deadline for any task.
-    If so, checks every hour if it has deadlines, then every minute (only if deadlines found)
+    Start deadlines scheduler with persistent job store.
+    Every deadline is a date-triggered job which survives restarts; deadlines missed while the bot
+    was down fire right after start. Deadlines without a job (stored before jobs were persistent) are scheduled here.
+    With several bot instances jobs run only in the elected leader (see LeaderElector)
     :param bot: Bot instance for notification sending
     :return:
     """
 
-    LOGGER.info("Starting deadlines check job.")
-    SCHEDULER.add_job(lambda: job_daily_deadlines(bot), "interval", hours=24, id='daily_deadlines_check')
-    SCHEDULER.start()
+    global _BOT, _ELECTOR  # pylint: disable=global-statement
+    _BOT = bot
+    SCHEDULER.add_jobstore(await run_blocking(get_job_store), DEADLINES_JOBSTORE)
+    SCHEDULER.start(paused=True)  # jobs run only in the leader instance, the others just add them to the store
+    # The leader wakes up on every lease renewal to see jobs added to the shared store by other instances
+    _ELECTOR = LeaderElector(await run_blocking(get_lease, "scheduler", instance_id()),
+                             SCHEDULER.resume, SCHEDULER.pause, SCHEDULER.wakeup)
+    _ELECTOR.start()
 
+    deadlines_db = AsyncDeadlineDatabase()
+    for deadline in await deadlines_db.get_deadlines():
+        job_id = deadline_job_id(deadline["classroom_id"], deadline["task_id"])
+        if deadline.get("date") and not await run_blocking(SCHEDULER.get_job, job_id, DEADLINES_JOBSTORE):
+            await schedule_deadline(deadline["classroom_id"], deadline["task_id"], deadline["date"])
+    LOGGER.info(f"Deadlines scheduler started: {len(SCHEDULER.get_jobs(DEADLINES_JOBSTORE))} deadlines pending.")
 
-async def job_daily_deadlines(bot: Bot):
+
+async def stop_scheduler():
     """
-    Daily running job that checks today's deadlines
+    Stop scheduler and give leadership up, so another instance takes over jobs right away
     :return:
     """
 
-    deadlines_db = DeadlineDatabase()  # probably should optimize databases instances
-    if deadlines_db.get_today_deadlines():
-        LOGGER.info("Found deadlines for today. Starting hourly check...")
-        SCHEDULER.add_job(lambda: job_hourly_deadlines(bot), "interval", hours=1, id='hourly_deadlines_check')
-    LOGGER.info("Daily deadlines check started.")
+    if _ELECTOR is not None:
+        await _ELECTOR.stop()
+    if SCHEDULER.running:
+        SCHEDULER.shutdown(wait=False)
 
 
-async def job_hourly_deadlines(bot: Bot):
+async def schedule_deadline(classroom_id, task_id, date: datetime):
     """
-    Hourly running job that checks current hour's deadlines
-    Executes only when current DAY has deadlines
+    Add or move deadline job of task
+    :param classroom_id:
+    :param task_id:
+    :param date:
     :return:
     """
 
-    deadlines_db = DeadlineDatabase()
+    LOGGER.info(f"Scheduling deadline of task {task_id} at {date}")
+    await run_blocking(SCHEDULER.add_job, fire_deadline, "date", run_date=date, args=[classroom_id, task_id],
+                       id=deadline_job_id(classroom_id, task_id), jobstore=DEADLINES_JOBSTORE, replace_existing=True,
+                       misfire_grace_time=None, coalesce=True)
+
+
+async def fire_deadline(classroom_id, task_id):
+    """
+    Deadline job: send answers to teachers, notify students and archive the task
+    :param classroom_id:
+    :param task_id:
+    :return:
+    """
 
-    current_time = datetime.today()
-    begin_time = current_time.replace(hour=current_time.hour, minute=0, second=0, microsecond=0)
-    end_time = begin_time + timedelta(hours=1)
-    if deadlines_db.get_deadlines_between(begin_time, end_time):
-        LOGGER.info("Found deadlines for current hour. Starting minutely check...")
-        SCHEDULER.remove_job('hourly_deadlines_check')
-        SCHEDULER.add_job(lambda: job_minutely_deadlines(bot), "interval", minutes=1, id='minutely_deadlines_check')
+    classroom_db = AsyncClassroomDatabase()
+    deadlines_db = AsyncDeadlineDatabase()
+    if await classroom_db.get_task(classroom_id, task_id):
+        LOGGER.info(f"Deadline of task {task_id} has come.")
+        await notify_deadline(get_outbox(_BOT), classroom_db, classroom_id, task_id)
+        await Task(task_id, classroom_id, classroom_db=classroom_db, deadlines_db=deadlines_db).archive()
+    else:
+        LOGGER.warning(f"Deadline of task {task_id} has come, but the task is not active any more")
+    await deadlines_db.remove_deadline(task_id)
 
 
-async def job_minutely_deadlines(bot: Bot):
+async def notify_deadline(outbox: Outbox, classroom_db: AsyncClassroomDatabase, classroom_id, task_id):
     """
-    Minutely running job that checks current minute's deadlines
-    Executes only when current HOUR has deadlines
+    Notify classroom members that task deadline has come: teachers get answers archive, students get a reminder
+    :param outbox: rate-limited outbox of the bot
+    :param classroom_db:
+    :param classroom_id:
+    :param task_id:
     :return:
     """
 
-    deadlines_db = DeadlineDatabase()
-    classroom_db = ClassroomDatabase()
+    members = await classroom_db.get_member_ids(classroom_id)
+    task_info = await classroom_db.get_task(classroom_id, task_id)
+
+    async def deliver_teacher(teacher_id):
+        nonlocal document
+        await outbox.send_message(teacher_id, "Hello, the deadline has finally come for your task with the "
+                                              f"description:\n<<{task_info.get('description', 'empty')}>>")
+        await outbox.send_message(teacher_id,
+                                  "Here is a ZIP-archive with students' answers awailable at this moment."
+                                  "Please, unpack it in single folder and do not rename the excel file. "
+                                  "It has links to all students' answers and a mark column.\n"
+                                  "After evaluating, please send me this excel file - just by the "
+                                  "attachment button from the main menu.")
+        message = await outbox.send_document(teacher_id, document,
+                                             reply_markup=await get_main_menu_markup("teacher"))
+        document = message.document.file_id
+
+    async def deliver_student(student_id):
+        await outbox.send_message(student_id, "Hello, the deadline has finally come for your task with the "
+                                              f"description:\n<<{task_info.get('description', 'empty')}>>\n"
+                                              f"Your answers were already sent to teacher.\n"
+                                              f"You will receive a notification when your work is evaluated. "
+                                              f"Have a nice day!")
+
+    with await pack_answers_async(classroom_id, task_id) as archive:
+        # aiohttp closes uploaded streams: every upload attempt reads the archive through a duplicate of its descriptor
+        # (the cached file may be evicted meanwhile, the opened one stays readable)
+        document: Union[str, Upload] = Upload(lambda: InputFile(_reopen(archive), filename=f"task_{task_id}.zip"))
+        teachers = list(members["teachers"])
+        # Archive is uploaded to the first reachable teacher, the others get it by file_id
+        while teachers and not isinstance(document, str):
+            await outbox.broadcast(teachers[:1], deliver_teacher)
+            teachers = teachers[1:]
+        await outbox.broadcast(teachers, deliver_teacher)
+    await outbox.broadcast(members["students"], deliver_student)
+
+
+def _reopen(stream: BinaryIO) -> BinaryIO:
+    """
+    :param stream: opened file
+    :return: new file object of the same file positioned at start, closing it keeps stream open
+    """
+
+    duplicate = os.fdopen(os.dup(stream.fileno()), "rb")
+    duplicate.seek(0)
+    return duplicate
 
-    current_time = datetime.today()
-    begin_time = current_time.replace(second=0, microsecond=0)
-    end_time = begin_time + timedelta(minutes=1)
-    current_deadlines = deadlines_db.get_deadlines_between(begin_time, end_time)
-
-    if current_deadlines:
-        LOGGER.info("Found deadlines for current minute.")
-        SCHEDULER.remove_job('minutely_deadlines_check')  # Add actions for deadline
-        for deadline in current_deadlines:
-            task_id = deadline["task_id"]
-            classroom_id = deadline["classroom_id"]
-
-            classroom_info = classroom_db.get_info(classroom_id)
-            task_info = {}
-            for task in classroom_info["tasks"]:
-                if task["id"] == task_id:
-                    task_info = task
-
-            zip_dir_path = Path(get_temp_dir("auto")) / "tasks_packed"
-            zip_file = pack_answers(classroom_id, task_id, zip_dir_path, classroom_db)
-
-            for teacher_id in classroom_info["teachers"]:
-                with open(zip_file, "rb") as handler:
-                    await bot.send_message(teacher_id, "Hello, the deadline has finally come for your task with the "
-                                                       f"description:\n<<{task_info.get('description', 'empty')}>>")
-                    await bot.send_message(teacher_id,
-                                           "Here is a ZIP-archive with students' answers awailable at this moment."
-                                           "Please, unpack it in single folder and do not rename the excel file. "
-                                           "It has links to all students' answers and a mark column.\n"
-                                           "After evaluating, please send me this excel file - just by the "
-                                           "attachment button from the main menu.")
-                    await bot.send_document(teacher_id, (f"task_{task_id}.zip", handler),
-                                            reply_markup=await get_main_menu_markup("teacher"))
-            for student_id in classroom_info["students"]:
-                await bot.send_message(student_id, "Hello, the deadline has finally come for your task with the "
-                                                   f"description:\n<<{task_info.get('description', 'empty')}>>\n"
-                                                   f"Your answers were already sent to teacher.\n"
-                                                   f"You will receive a notification when your work is evaluated. "
-                                                   f"Have a nice day!")
-
-            task = Task(task_id, classroom_id)
-            task.archive()
-
-
-def pack_answers(classroom_id, task_id, destination_dir, mail=True):
+
+def pack_answers(classroom_id, task_id, mail=True, progress: Optional[Callable[[int, int], None]] = None) -> BinaryIO:
     """
     Generates ZIP-archive with structure: <id>/<files>, <id>/<files>, ..., gradebook.xlsx
     gradebook.xlsx is a MANAGER file with all the necessary links and grading column,
     which is necessary for further task processing.
+    Attachments are streamed from blob store into the archive, nothing is unpacked to disk.
+    Archive is cached until submissions change (see ArchiveCache)
     :param classroom_id:
     :param task_id:
-    :param destination_dir:
     :param mail: bool Whether to send zip to teachers
-    :return:
+    :param progress: called with (packed answers, total answers) while packing
+    :return: readable binary stream with archive, positioned at start (close after use)
     """
 
     classroom_db = ClassroomDatabase()
     users_db = UserDatabase()
 
-    classroom_info = classroom_db.get_info(classroom_id)
-
-    students_answers = {}
-    task_info = {}
-    students_tasks = {student["id"]: student["tasks"] for student in classroom_info["students"]}
-    for student_id, tasks in students_tasks.items():
-        for task in tasks:
-            if task["task_id"] == task_id:
-                students_answers[student_id] = task
-                break
-    for task in classroom_info["tasks"]:
-        if task["id"] == task_id:
-            task_info = task
-            break
-
-    gradebook = xlsxwriter.Workbook(Path(destination_dir) / "temp" / f"gradebook-{task_id}.xlsx")
-    worksheet = gradebook.add_worksheet()
-    header_row = ["id", "answer_dir", "mark"]
-    for col_num, data in enumerate(header_row):
-        worksheet.write(0, col_num, data)
-
-    row, col = 1, 0
-    for student_id, task_data in students_answers.items():
-        destination_root = Path(destination_dir) / "temp" / str(student_id)
-        destination_root.mkdir(exist_ok=True, parents=True)
-        with open(Path(destination_root / "description.txt"), "w+", encoding="UTF-8") as description_file:
-            description_file.write(task_data["description"])
-        for file in task_data["files"]:
-            with open(Path(destination_root / file["filename"]), "wb+") as attachment_file:
-                attachment_file.write(Binary(file["file"]))
-        worksheet.write(row, col, str(student_id))
-        worksheet.write_url(row, col + 1, f'external:{student_id}/', string="Click to open folder",
-                            tip='TIP: Link will work only if this excel table is in the same dir '
-                                'as students answers dirs (same folder structure as in archive).')
-        row += 1
-    gradebook.close()
-
-    archive_path = Path(destination_dir) / f"{task_id}"
-    make_archive(str(archive_path), "zip", Path(destination_dir) / "temp")
-    rmtree(Path(destination_dir) / "temp")
+    archive = get_archive_cache().get(classroom_id, task_id, classroom_db.get_submissions(classroom_id, task_id), progress)
 
     # Send email
     if mail:
         teachers_emails = []
-        for _id in classroom_info["teachers"]:
+        for _id in classroom_db.get_member_ids(classroom_id)["teachers"]:
             teacher_email = users_db.get_info(_id).get("email", None)
             if teacher_email:
                 teachers_emails.append(teacher_email)
-        with open(Path(destination_dir) / f"{task_id}.zip", "rb") as archive:
-            to_send = {"filename": f"{task_id}.zip", "file": archive.read()}
+        if teachers_emails:
+            classroom_info = classroom_db.get_info(classroom_id, {"name": 1})
+            task_info = classroom_db.get_task(classroom_id, task_id)
             send_mail(teachers_emails, f"Group {classroom_info['name']} answers",
                       "Greetings! The attached archive contains all answers "
-                      f"sent by students on task with the following description:\n{task_info['description']}",
-                      to_send)
+                      f"sent by students on task with the following description:\n{task_info.get('description')}",
+                      [{"filename": f"{task_id}.zip", "file": archive}])
+            archive.seek(0)
 
-    return Path(destination_dir) / f"{task_id}.zip"
+    return archive
+
+
+async def send_attachment(bot: Bot, chat_id, attachment: dict, **kwargs) -> bool:
+    """
+    Send task attachment as document through the outbox. Attachments uploaded to Telegram before are sent by their
+    file_id without uploading bytes again; expired file_id falls back to upload from blob store
+
+    :param bot:
+    :param chat_id:
+    :param attachment: {"filename": ..., "blob_id": ..., "telegram_file_id": ...}, gets new file_id after upload
+    :param kwargs: other send_document parameters
+    :return: True if attachment got a new file_id (record should be saved)
+    """
+
+    outbox = get_outbox(bot)
+    file_id = attachment.get("telegram_file_id")
+    if file_id:
+        try:
+            await outbox.send_document(chat_id, file_id, **kwargs)
+            return False
+        except (WrongFileIdentifier, WrongRemoteFileIdSpecified) as err:
+            LOGGER.warning(f"Telegram file_id of {attachment['filename']} is not valid any more, uploading it: {err}")
+
+    contents = await run_blocking(read_attachment, attachment)
+    message = await outbox.send_document(chat_id, Upload(lambda: InputFile(io.BytesIO(contents), filename=attachment["filename"])),
+                                         **kwargs)
+    attachment["telegram_file_id"] = message.document.file_id
+    return True
+
+
+def _close_packed_archive(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+async def pack_answers_async(classroom_id, task_id, mail=True,
+                             on_progress: Optional[Callable[[int, int], Awaitable]] = None) -> BinaryIO:
+    """
+    Run pack_answers on packing worker pool (at most PACK_WORKERS at once) and wait for it
+    without blocking the event loop
+
+    :param classroom_id:
+    :param task_id:
+    :param mail: bool Whether to send zip to teachers
+    :param on_progress: coroutine function (packed answers, total answers), awaited on the event loop
+    at most once per PROGRESS_INTERVAL and only when progress changed
+    :return: readable binary stream with archive (close after use)
+    """
+
+    state = {"packed": 0, "total": 0}
+
+    def report(packed, total):  # runs in worker thread
+        state["packed"], state["total"] = packed, total
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(PACK_EXECUTOR, functools.partial(pack_answers, classroom_id, task_id, mail, report))
+    reported = (0, 0)
+    try:
+        while not future.done():
+            await asyncio.wait([future], timeout=PROGRESS_INTERVAL)
+            current = (state["packed"], state["total"])
+            if on_progress and not future.done() and current[1] and current != reported:
+                reported = current
+                try:
+                    await on_progress(*current)
+                except Exception as err:  # pylint: disable=broad-except
+                    LOGGER.warning(f"Could not report packing progress: {err}")
+    except asyncio.CancelledError:
+        # Nobody will read the archive, close it when packing is finished
+        future.add_done_callback(_close_packed_archive)
+        raise
+    return future.result()
 
 
 class Task:
@@ -209,41 +301,24 @@ class Task:
         self._task_id = task_id
         self._classroom_id = classroom_id
 
-        self._classroom_db: ClassroomDatabase = classroom_db or ClassroomDatabase()
-        self._user_db: UserDatabase = user_db or UserDatabase()
-        self._deadlines_db: DeadlineDatabase = deadlines_db or DeadlineDatabase()
+        self._classroom_db: AsyncClassroomDatabase = classroom_db or AsyncClassroomDatabase()
+        self._user_db: AsyncUserDatabase = user_db or AsyncUserDatabase()
+        self._deadlines_db: AsyncDeadlineDatabase = deadlines_db or AsyncDeadlineDatabase()
 
         self._files = []
         self._description = "See attachments"
 
-    def _get_array_id(self):
+    async def add_file(self, file_path):
         """
-        Get task id in classroom array
-        :return: int
-        """
-
-        tasks = self._classroom_db.find_one({"classroom_id": self._classroom_id})["tasks"]
-        for index, element in enumerate(tasks):
-            if element["id"] == self._task_id:
-                return index
-        return None
-
-    def add_file(self, file_path):
-        """
-        Add file to task
+        Add file to task: upload it to blob store and keep a reference for the task record
 
         :param file_path:
         :return:
         """
-        with open(file_path, "rb") as file:
-            encoded = Binary(file.read())
-        filename = Path(file_path).name
 
-        self._files.append({
-            "filename": filename,
-            "file": encoded
-        })
-        LOGGER.info(f"[Task] Added file for uploading to DB: {filename}")
+        reference = await run_blocking(get_blob_store().put_file, file_path)
+        self._files.append(reference)
+        LOGGER.info(f"[Task] Uploaded file to blob store: {reference['filename']}")
 
     def add_text_description(self, description):
         """
@@ -255,7 +330,7 @@ class Task:
         self._description = description
         LOGGER.info("[Task] Updated description")
 
-    def set_active(self, active: bool = True):
+    async def set_active(self, active: bool = True):
         """
         Activate/deactivate new tasks
         Warning: old tasks (after deadline) will be archived, NOT deactivated.
@@ -265,32 +340,36 @@ class Task:
         """
 
         LOGGER.info(f"[Task] Trying to set activeness status: {active}")
-        element_id = self._get_array_id()
-        self._classroom_db.update({"classroom_id": self._classroom_id}, {f"tasks.{element_id}.active": active})
+        await self._classroom_db.update_task(self._classroom_id, self._task_id, {"active": active})
 
-    def archive(self):
+    async def archive(self):
         """
         Make task archived after deadline and remove it from active tasks.
         :return:
         """
 
         LOGGER.info(f"[Task] Archiving task: {self._task_id}")
-        element_id = self._get_array_id()
-        self._classroom_db.move_element({"classroom_id": self._classroom_id}, "tasks", element_id, "archived_tasks")
+        await self._classroom_db.archive_task(self._classroom_id, self._task_id)
 
-    def set_deadline(self, date: datetime):
+    async def set_deadline(self, date: datetime):
         """
-        Add/update task deadline
+        Add/update task deadline (and its scheduled job if task is already sent)
 
         :param date:
         :return:
         """
 
         LOGGER.info("[Task] Trying to update deadline")
-        element_id = self._get_array_id()
-        self._classroom_db.update({"classroom_id": self._classroom_id}, {f"tasks.{element_id}.deadline": date})
-
-    def prepare(self, creator_id):
+        await self._classroom_db.update_task(self._classroom_id, self._task_id, {"deadline": date})
+        scheduled = await run_blocking(SCHEDULER.get_job, deadline_job_id(self._classroom_id, self._task_id),
+                                       DEADLINES_JOBSTORE)
+        if scheduled or (await self._classroom_db.get_task(self._classroom_id, self._task_id) or {}).get("active"):
+            # Task was already sent to students (maybe without deadline), schedule or move its deadline job
+            # (new tasks are scheduled by send_students)
+            await self._deadlines_db.add_deadline(self._classroom_id, self._task_id, date)
+            await schedule_deadline(self._classroom_id, self._task_id, date)
+
+    async def prepare(self, creator_id):
         """
         Initial task actions after submitting all the files/descriptions
         :param creator_id:
@@ -302,10 +381,10 @@ class Task:
             "files": self._files,
             "description": self._description
         }
-        self._classroom_db.add_task(task_id=self._task_id, creator_id=creator_id,
-                                    classroom_id=self._classroom_id, info=task_info)
+        await self._classroom_db.add_task(task_id=self._task_id, creator_id=creator_id,
+                                          classroom_id=self._classroom_id, info=task_info)
 
-    def add_student_answer(self, student_id):
+    async def add_student_answer(self, student_id):
         """
         STUDENT task submission method
         :param student_id:
@@ -318,43 +397,60 @@ class Task:
             "files": self._files,
             "description": self._description
         }
-        self._classroom_db.submit_task(student_id=student_id, classroom_id=self._classroom_id, info=task_info)
+        previous = await self._classroom_db.get_submission(self._classroom_id, self._task_id, student_id, {"files": 1})
+        await self._classroom_db.submit_task(student_id=student_id, classroom_id=self._classroom_id, info=task_info)
+        if previous:  # replaced answer does not refer to its files any more
+            await run_blocking(get_blob_store().release_files, previous.get("files", []))
 
     async def send_students(self, bot: Bot):
         """
         Send task to students
 
         This function gets task info (files and/or description),
-        decodes files binary strings and sends them to students from
-        classroom list.
+        sends attachments to students from classroom list through the outbox
+        (read from blob store only for the first upload, see send_attachment).
         :return:
         """
 
-        classroom_info = self._classroom_db.get_info(self._classroom_id)
-
-        # task-related variables
-        files = {}
-        creator_id = None
-        description = None
-        deadline = None
-
-        for task in classroom_info["tasks"]:
-            if task["id"] == self._task_id:
-                files = {file["filename"]: file["file"] for file in task["files"]}
-                creator_id, description, deadline = task["creator_id"], task["description"], task["deadline"]
-                self._deadlines_db.add_deadline(self._classroom_id, self._task_id, deadline)
-                self.set_active()
-                break
-
-        for student in classroom_info["students"]:
-            await bot.send_message(student["id"], f"Greetings! You've received a new task:\n{description}\n"
+        task = await self._classroom_db.get_task(self._classroom_id, self._task_id)
+        if not task:
+            LOGGER.warning(f"Task {self._task_id} was not sent: it does not exist")
+            return
+        files, description, deadline = task.get("files", []), task.get("description"), task.get("deadline")
+        if deadline:  # the scheduler would run a job without date right away and archive the task
+            await self._deadlines_db.add_deadline(self._classroom_id, self._task_id, deadline)
+            await schedule_deadline(self._classroom_id, self._task_id, deadline)
+        await self.set_active()
+
+        outbox = get_outbox(bot)
+        uploaded = False
+
+        async def deliver(student_id):
+            nonlocal uploaded
+            await outbox.send_message(student_id, f"Greetings! You've received a new task:\n{description}\n"
                                                   f"Deadline: {deadline}\n"
                                                   f"Good luck!")
-            if files:
-                for filename, file_bin in files.items():
-                    file_path = Path(get_temp_dir(creator_id) / filename)
-                    with open(file_path, "wb+") as handler:
-                        handler.write(Binary(file_bin))
-                    with open(file_path, "rb") as handler:
-                        await bot.send_document(student["id"], (filename, handler))
-                    os.remove(file_path)
+            for file in files:
+                uploaded = await send_attachment(bot, student_id, file) or uploaded
+
+        students = list((await self._classroom_db.get_member_ids(self._classroom_id))["students"])
+        failed = {}
+        # Attachments are uploaded to the first reachable student, then everyone else gets them by file_id
+        while students and not all(file.get("telegram_file_id") for file in files):
+            failed.update((await outbox.broadcast(students[:1], deliver))["failed"])
+            students = students[1:]
+        failed.update((await outbox.broadcast(students, deliver))["failed"])
+        if uploaded:
+            await self.save_file_ids(files)
+        if failed:
+            LOGGER.warning(f"Task {self._task_id} was not delivered to {len(failed)} students")
+
+    async def save_file_ids(self, files: list):
+        """
+        Store Telegram file_id of attachments uploaded by send_attachment in task record
+
+        :param files: task attachments list with "telegram_file_id" keys
+        :return:
+        """
+
+        await self._classroom_db.update_task(self._classroom_id, self._task_id, {"files": files})
@@ -0,0 +1,265 @@
+"""
+Update ingestion: long polling or webhook, both processed by bounded workers
+Updates of one chat are handled strictly in arrival order (handlers keep per-chat state), updates of different chats
+run concurrently, at most `concurrency` at a time. At most `max_pending` received updates wait for processing:
+above that polling stops fetching and webhook requests are answered later, so Telegram keeps the rest queued.
+Updates queued while the bot was down are processed at startup (the webhook is not removed on shutdown).
+Configure with the optional "UPDATES" section of bot_config.json:
+{"MODE": "polling"} or {"MODE": "webhook", "WEBHOOK_URL": "https://host/bot", "WEBHOOK_PATH": "/bot", "PORT": 8080},
+both with "CONCURRENCY" and "MAX_PENDING"
+"""
+
+import time
+import asyncio
+
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional, Set
+
+import aiohttp
+
+from aiogram import Bot, Dispatcher, types, executor
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+
+from configs.bot_conf import BotConfig
+from configs.logger_conf import configure_logger
+
+LOGGER = configure_logger(__name__)
+
+CONCURRENCY = 32  # Updates processed at the same time
+MAX_PENDING = 1000  # Received updates waiting for processing
+POLLING_TIMEOUT = 20  # Seconds of getUpdates long poll
+WEBHOOK_MAX_CONNECTIONS = 40  # Parallel webhook requests from Telegram
+
+_CHAT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member", "chat_member",
+                "chat_join_request")
+_USER_FIELDS = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer")
+
+
+# pylint: disable = broad-except, arguments-differ, too-many-arguments, too-many-positional-arguments, too-many-instance-attributes
+
+
+def update_chat(update: types.Update) -> Hashable:
+    """
+    :param update:
+    :return: chat (or user) ID the update belongs to, unique key for updates without one (e.g. polls)
+    """
+
+    for field in _CHAT_FIELDS:
+        if (event := getattr(update, field)) is not None:
+            return event.chat.id
+    if (query := update.callback_query) is not None:
+        return query.message.chat.id if query.message else query.from_user.id
+    for field in _USER_FIELDS:
+        if (event := getattr(update, field)) is not None:
+            return event.user.id if field == "poll_answer" else event.from_user.id
+    return ("update", update.update_id)
+
+
+class UpdateWorkers:
+    """
+    Per-chat queues of updates drained by at most `concurrency` running handlers (used from the event loop only)
+    """
+
+    def __init__(self, process: Callable[[types.Update], Awaitable], concurrency=CONCURRENCY, max_pending=MAX_PENDING):
+        """
+        :param process: coroutine function handling one update
+        :param concurrency: updates processed at the same time
+        :param max_pending: received updates after which submit waits
+        """
+
+        self._process = process
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._queues: Dict[Hashable, Deque[types.Update]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._space = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._space.set()
+        self._idle.set()
+        self.pending = self.running = 0
+        self.processed = self.failed = self.max_running = 0
+        self._busy_since: Optional[float] = None
+        self.busy_seconds = 0.0
+
+    async def submit(self, update: types.Update):
+        """
+        Queue update after the previous updates of its chat, wait while too many updates are pending
+
+        :param update:
+        :return: None
+        """
+
+        while self.pending >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if not self.pending:
+            self._idle.clear()
+            self._busy_since = time.perf_counter()
+        self.pending += 1
+
+        key = update_chat(update)
+        queue = self._queues.get(key)
+        if queue is not None:  # chat worker is running, it takes the update in turn
+            queue.append(update)
+            return
+        self._queues[key] = deque([update])
+        task = asyncio.get_running_loop().create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key: Hashable):
+        queue = self._queues[key]
+        while queue:
+            async with self._semaphore:  # type: ignore
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+                try:
+                    await self._process(queue[0])
+                    self.processed += 1
+                except Exception:
+                    self.failed += 1
+                    LOGGER.exception("Update %s failed", queue[0].update_id)
+                finally:
+                    self.running -= 1
+            queue.popleft()
+            self._done()
+        del self._queues[key]
+
+    def _done(self):
+        self.pending -= 1
+        self._space.set()
+        if not self.pending:
+            self.busy_seconds += time.perf_counter() - (self._busy_since or time.perf_counter())
+            self._idle.set()
+
+    async def join(self):
+        """
+        Wait until all submitted updates are processed
+
+        :return: None
+        """
+
+        await self._idle.wait()
+
+    def stats(self) -> dict:
+        """
+        :return: {"processed", "failed", "pending", "max_running", "per_sec": processed per second of busy time}
+        """
+
+        busy = self.busy_seconds + (time.perf_counter() - self._busy_since if self.pending and self._busy_since else 0)
+        return {"processed": self.processed, "failed": self.failed, "pending": self.pending, "max_running": self.max_running,
+                "per_sec": round((self.processed + self.failed) / busy, 1) if busy else 0.0}
+
+
+class WorkerDispatcher(Dispatcher):
+    """
+    Dispatcher handing updates to UpdateWorkers instead of processing every received batch at once
+    """
+
+    def __init__(self, bot: Bot, *args, concurrency=CONCURRENCY, max_pending=MAX_PENDING, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+        self.workers = UpdateWorkers(self.updates_handler.notify, concurrency, max_pending)
+
+    async def process_updates(self, updates, fast: bool = True):
+        for update in updates:
+            await self.workers.submit(update)
+        return []
+
+    async def start_polling(self, timeout=POLLING_TIMEOUT, relax=0.1, limit=None, reset_webhook=None, fast: bool = True,
+                            error_sleep: int = 5, allowed_updates=None):
+        """
+        Long polling which fetches the next batch only when it fits into the pending limit
+        (updates are confirmed to Telegram by the offset of the next request)
+        """
+
+        if self._polling:  # type: ignore
+            raise RuntimeError("Polling already started")
+        LOGGER.info("Start polling")
+        Dispatcher.set_current(self)
+        Bot.set_current(self.bot)
+        if reset_webhook is not False:  # keeps updates queued while the webhook was set
+            await self.reset_webhook(check=bool(reset_webhook))
+
+        self._polling = True
+        offset = None
+        request_timeout = None
+        if isinstance(self.bot.timeout, aiohttp.ClientTimeout):  # long poll must not hit the request timeout
+            request_timeout = aiohttp.ClientTimeout(total=self.bot.timeout.total + timeout)
+        try:
+            while self._polling:
+                try:
+                    with self.bot.request_timeout(request_timeout):
+                        updates = await self.bot.get_updates(limit=limit, offset=offset, timeout=timeout,
+                                                             allowed_updates=allowed_updates)
+                except asyncio.CancelledError:
+                    break
+                except Exception:
+                    LOGGER.exception("Could not get updates")
+                    await asyncio.sleep(error_sleep)
+                    continue
+                if updates:
+                    offset = updates[-1].update_id + 1
+                    await self.process_updates(updates)
+                elif relax:
+                    await asyncio.sleep(relax)
+        finally:
+            self._close_waiter.set_result(None)
+            LOGGER.warning("Polling is stopped")
+
+
+class QueuedWebhookHandler(WebhookRequestHandler):
+    """
+    Webhook request handler answering as soon as the update is queued (handlers never reply through the webhook)
+    """
+
+    async def process_update(self, update):
+        await self.get_dispatcher().process_updates([update])
+        return []
+
+
+def create_dispatcher(bot: Bot, **kwargs) -> WorkerDispatcher:
+    """
+    Create dispatcher with workers configured in bot_config.json
+
+    :param bot:
+    :param kwargs: other Dispatcher arguments (storage, loop, ...)
+    :return: WorkerDispatcher
+    """
+
+    options = BotConfig().properties.get("UPDATES", {})
+    return WorkerDispatcher(bot, concurrency=options.get("CONCURRENCY", CONCURRENCY),
+                            max_pending=options.get("MAX_PENDING", MAX_PENDING), **kwargs)
+
+
+def start_updates(dispatcher: WorkerDispatcher, on_startup: Callable, on_shutdown: Callable):
+    """
+    Receive updates in the configured mode until the process is stopped.
+    Callbacks are awaited with dispatcher: startup before the first update is processed (queued ones included),
+    shutdown after the last one is received
+
+    :param dispatcher:
+    :param on_startup:
+    :param on_shutdown:
+    :return: None
+    """
+
+    options = BotConfig().properties.get("UPDATES", {})
+    if options.get("MODE", "polling") == "polling":
+        LOGGER.info("Receiving updates by long polling")
+        executor.start_polling(dispatcher, skip_updates=False, on_startup=on_startup, on_shutdown=on_shutdown,
+                               timeout=options.get("POLLING_TIMEOUT", POLLING_TIMEOUT))
+        return
+
+    async def set_webhook(dp: WorkerDispatcher):
+        await dp.bot.set_webhook(options["WEBHOOK_URL"], drop_pending_updates=False,
+                                 max_connections=options.get("MAX_CONNECTIONS", WEBHOOK_MAX_CONNECTIONS))
+        LOGGER.info("Receiving updates by webhook %s", options["WEBHOOK_URL"])
+
+    runner = executor.Executor(dispatcher, skip_updates=False, check_ip=options.get("CHECK_IP", False))
+    runner.on_startup([on_startup, set_webhook])
+    runner.on_shutdown(on_shutdown)
+    runner.start_webhook(options.get("WEBHOOK_PATH", "/bot"), request_handler=QueuedWebhookHandler,
+                         host=options.get("HOST", "0.0.0.0"), port=options.get("PORT", 8080))
@@ -0,0 +1,126 @@
+"""
+Answers archive layout and archives cache
+"""
+
+import io
+import time
+import zlib
+import zipfile
+
+from infrastructure import answers_archive
+from infrastructure.answers_archive import ArchiveCache, write_answers_archive
+
+
+# pylint: disable = missing-function-docstring, too-few-public-methods
+
+
+def _answer(student_id, *files, description="answer") -> dict:
+    return {"student_id": student_id, "description": description,
+            "files": [{"filename": name, "file": contents} for name, contents in files]}
+
+
+def test_equal_file_names_are_numbered(tmp_path):
+    path = tmp_path / "answers.zip"
+    answer = _answer(1, ("a.pdf", b"1"), ("A.pdf", b"2"), ("a.pdf", b"3"), ("../description.txt", b"4"))
+
+    with open(path, "wb") as target:
+        write_answers_archive(target, "task", [answer])
+
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        assert names[:5] == ["1/description.txt", "1/a.pdf", "1/A (2).pdf", "1/a (3).pdf", "1/description (2).txt"]
+        assert [archive.read(name) for name in names[1:5]] == [b"1", b"2", b"3", b"4"]
+        assert archive.read("1/description.txt") == b"answer"
+
+
+def test_cached_archive_is_served_and_rebuilt_after_changes(tmp_path):
+    cache = ArchiveCache(tmp_path)
+    submissions = [_answer(1, ("a.txt", b"1")), _answer(2, ("b.txt", b"2"))]
+
+    with cache.get("class", "task", submissions) as first:
+        first_contents = first.read()
+    with cache.get("class", "task", submissions) as second:
+        assert second.read() == first_contents
+    submissions[1] = _answer(2, ("b.txt", b"new"), description="changed")
+    with cache.get("class", "task", submissions) as third, zipfile.ZipFile(third) as archive:
+        assert archive.read("1/a.txt") == b"1"
+        assert archive.read("2/b.txt") == b"new"
+
+    assert cache.stats() == {"archives": 2, "hits": 1, "rebuilds": 2, "reused_entries": 1}
+
+
+def test_least_recently_used_archives_are_evicted(tmp_path):
+    cache = ArchiveCache(tmp_path, max_archives=2)
+
+    for task in range(4):
+        cache.get("class", task, [_answer(1, ("a.txt", bytes([task])))]).close()
+        time.sleep(0.02)  # archives are ordered by modification time
+
+    assert cache.stats()["archives"] == 2
+    assert len(list(tmp_path.glob("*.zip"))) == 2
+    with cache.get("class", 3, [_answer(1, ("a.txt", bytes([3])))]) as archive, zipfile.ZipFile(archive) as contents:
+        assert contents.read("1/a.txt") == bytes([3])
+    assert cache.hits == 1
+
+
+def test_unchanged_entries_are_copied_without_recompression(tmp_path, monkeypatch):
+    monkeypatch.setattr(answers_archive, "build_gradebook", lambda student_ids: b"gradebook")  # stored, not deflated
+    compressors = []
+
+    def compressobj(*args, **kwargs):
+        compressors.append(args)
+        return zlib_compressobj(*args, **kwargs)
+
+    zlib_compressobj = zlib.compressobj
+    monkeypatch.setattr(zlib, "compressobj", compressobj)
+    cache = ArchiveCache(tmp_path)
+    large = bytes(range(256)) * 4096
+    submissions = [_answer(1, ("large.txt", large)), _answer(2, ("b.txt", b"2"))]
+    cache.get("class", "task", submissions).close()
+    with zipfile.ZipFile(next(tmp_path.glob("*.zip"))) as first:
+        reused = first.getinfo("1/large.txt")
+    compressors.clear()
+
+    submissions[1] = _answer(2, ("b.txt", b"new"))
+    with cache.get("class", "task", submissions) as rebuilt, zipfile.ZipFile(rebuilt) as archive:
+        entry = archive.getinfo("1/large.txt")
+        assert archive.testzip() is None
+        assert archive.read("1/large.txt") == large
+        assert archive.read("2/b.txt") == b"new"
+
+    assert len(compressors) == 2  # description.txt and b.txt of the changed answer only
+    assert (entry.CRC, entry.compress_size, entry.file_size, entry.compress_type) == \
+        (reused.CRC, reused.compress_size, reused.file_size, reused.compress_type)
+
+
+class Unseekable(io.RawIOBase):
+    """
+    Write-only stream without tell and seek, like a network response
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def test_copied_entries_in_unseekable_target(tmp_path):
+    path = tmp_path / "previous.zip"
+    with open(path, "wb") as target:
+        write_answers_archive(target, "task", [_answer(1, ("a.txt", b"a" * 1000)), _answer(2, ("b.txt", b"b"))])
+    target = Unseekable()
+
+    with zipfile.ZipFile(path) as previous:
+        write_answers_archive(target, "task", [_answer(1, ("a.txt", b"a" * 1000)), _answer(2, ("b.txt", b"new"))],
+                              previous=previous, unchanged={1})
+
+    with zipfile.ZipFile(io.BytesIO(bytes(target.data))) as archive:
+        assert archive.testzip() is None
+        assert archive.read("1/a.txt") == b"a" * 1000
+        assert archive.read("2/b.txt") == b"new"
@@ -0,0 +1,107 @@
+"""
+Blob stores: interface, deduplication and garbage collection
+"""
+
+import threading
+
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from database import blob_store
+from database.blob_store import BlobStore, LocalBlobStore, MemoryBlobStore
+
+
+# pylint: disable = missing-function-docstring, too-few-public-methods, redefined-outer-name
+
+
+class Clock:
+    """
+    Replaces datetime in the blob store module (reference counters get timestamps from mongomock)
+    """
+
+    offset = timedelta(0)
+
+    @classmethod
+    def utcnow(cls):
+        return datetime.utcnow() + cls.offset
+
+
+@pytest.fixture(params=["memory", "local"])
+def store(request, tmp_path, monkeypatch) -> BlobStore:
+    Clock.offset = timedelta(0)
+    monkeypatch.setattr(blob_store, "datetime", Clock)
+    client: mongomock.MongoClient = mongomock.MongoClient()
+    if request.param == "memory":
+        return MemoryBlobStore(client.blobs.blob_refs)
+    return LocalBlobStore(tmp_path / "blobs", client.blobs.blob_refs)
+
+
+def test_incomplete_store_can_not_be_created():
+    class ReadOnlyStore(BlobStore):  # pylint: disable=abstract-method
+        """
+        Store without _store and delete
+        """
+
+        def open(self, blob_id):
+            raise FileNotFoundError(blob_id)
+
+    with pytest.raises(TypeError):
+        ReadOnlyStore()  # pylint: disable=abstract-class-instantiated
+
+
+def test_equal_contents_are_stored_once(store):
+    first = store.put(b"answer", "a.txt")
+    second = store.put(b"answer", "b.txt")
+
+    assert first["blob_id"] == second["blob_id"]
+    assert (first["filename"], second["filename"], first["size"]) == ("a.txt", "b.txt", 6)
+    assert store.read(first["blob_id"]) == b"answer"
+    assert store._refs.find_one({"_id": first["blob_id"]})["refs"] == 2  # pylint: disable=protected-access
+
+
+def test_blob_is_collected_after_last_release_and_grace_period(store):
+    reference = store.put(b"answer", "a.txt")
+    store.put(b"answer", "b.txt")
+    store.release(reference["blob_id"])
+    Clock.offset = timedelta(hours=2)
+    assert store.collect_garbage() == 0  # still referenced
+
+    store.release(reference["blob_id"])
+    assert store.collect_garbage(timedelta(hours=3)) == 0  # released recently
+    assert store.collect_garbage() == 1
+
+    with pytest.raises((KeyError, FileNotFoundError)):
+        store.read(reference["blob_id"])
+    assert store.put(b"answer", "c.txt")["blob_id"] == reference["blob_id"]
+    assert store.read(reference["blob_id"]) == b"answer"
+
+
+def test_put_waits_for_blob_removal_and_stores_contents_again(store, monkeypatch):
+    reference = store.put(b"answer", "a.txt")
+    store.release(reference["blob_id"])
+    Clock.offset = timedelta(hours=2)
+    removing, put_waits = threading.Event(), threading.Event()
+    original_delete, original_sleep = store.delete, blob_store.time.sleep
+
+    def delete(blob_id):  # collect_garbage removes the blob while another put arrives
+        removing.set()
+        put_waits.wait(5)
+        original_delete(blob_id)
+
+    def sleep(seconds):
+        put_waits.set()
+        original_sleep(seconds)
+
+    monkeypatch.setattr(store, "delete", delete)
+    monkeypatch.setattr(blob_store.time, "sleep", sleep)
+    collector = threading.Thread(target=store.collect_garbage)
+    collector.start()
+    removing.wait(5)
+
+    assert store.put(b"answer", "b.txt")["blob_id"] == reference["blob_id"]
+    collector.join()
+    assert put_waits.is_set()
+    assert store.read(reference["blob_id"]) == b"answer"
+    assert store._refs.find_one({"_id": reference["blob_id"]})["refs"] == 1  # pylint: disable=protected-access
@@ -0,0 +1,113 @@
+"""
+Read-through cache expiration, eviction and invalidation
+"""
+
+from database import cache as cache_module
+from database.cache import TTLCache
+from database.database import Database
+
+
+# pylint: disable = missing-function-docstring, too-few-public-methods, protected-access
+
+
+def test_invalidate_drops_every_variant_of_record():
+    cache = TTLCache()
+    cache.set((1, None), {"name": "a"})
+    cache.set((1, "projection"), {"name": "a"})
+    cache.set((2, None), {"name": "b"})
+
+    cache.invalidate(1)
+
+    assert cache.get((1, None)) is None
+    assert cache.get((1, "projection")) is None
+    assert cache.get((2, None)) == {"name": "b"}
+
+    cache.invalidate()
+    assert cache.get((2, None)) is None
+
+
+def test_value_loaded_before_invalidation_is_not_cached():
+    cache = TTLCache()
+
+    def stale_load():
+        cache.invalidate(1)  # record is written while the old version is being read
+        return {"name": "old"}
+
+    assert cache.get_or_load((1,), stale_load) == {"name": "old"}
+    assert cache.get((1,)) is None
+    assert cache.get_or_load((1,), lambda: {"name": "new"}) == {"name": "new"}
+    assert cache.get((1,)) == {"name": "new"}
+
+
+def test_cached_values_are_copies():
+    cache = TTLCache()
+    value = {"items": [1]}
+    cache.set((1,), value)
+    value["items"].append(2)
+    cache.get((1,))["items"].append(3)
+
+    assert cache.get((1,)) == {"items": [1]}
+
+
+def test_entries_expire_and_least_recently_used_are_evicted(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = TTLCache(max_size=2, ttl=10)
+    cache.set((1,), "a")
+    cache.set((2,), "b")
+    cache.get((1,))
+    cache.set((3,), "c")  # (2,) was used least recently
+
+    assert cache.get((2,)) is None
+    now[0] += 11
+    assert cache.get((1,)) is None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["expirations"] == 1
+
+
+def test_database_write_invalidates_cached_record():
+    database = Database("mongodb://cache-test", "cache_test", "users", backend="memory")
+    database._cache, database._cache_field = TTLCache(), "user_id"
+    database.update({"user_id": 1}, {"name": "old"}, buffered=False)
+    assert database.cached_find_one(1)["name"] == "old"
+
+    database.update({"user_id": 1}, {"name": "new"}, buffered=False)
+
+    assert database.cached_find_one(1)["name"] == "new"
+    assert database._cache.stats()["hits"] == 0
+
+
+def test_empty_values_expire_sooner(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = TTLCache(ttl=60, empty_ttl=2)
+    cache.set((1,), {})
+    cache.set((2,), {"name": "b"})
+
+    now[0] += 3
+
+    assert cache.get((1,)) is None
+    assert cache.get((2,)) == {"name": "b"}
+
+
+def test_empty_values_are_not_cached_without_empty_ttl():
+    cache = TTLCache(empty_ttl=0)
+
+    assert cache.get_or_load((1,), dict) == {}
+    assert cache.get((1,)) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_record_created_by_another_instance_is_found_after_empty_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    database = Database("mongodb://cache-test-replicas", "cache_test", "users", backend="memory")
+    other_instance = Database("mongodb://cache-test-replicas", "cache_test", "users", backend="memory")
+    database._cache, database._cache_field = TTLCache(ttl=60, empty_ttl=2), "user_id"
+
+    assert database.cached_find_one(1) == {}
+    other_instance.update({"user_id": 1}, {"name": "registered"}, buffered=False)  # not invalidated here
+    assert database.cached_find_one(1) == {}
+
+    now[0] += 3
+    assert database.cached_find_one(1)["name"] == "registered"
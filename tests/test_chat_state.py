@@ -0,0 +1,74 @@
+"""
+Per-chat conversation state: LRU bound, expiration and message history
+"""
+
+import pytest
+
+from infrastructure import chat_state
+from infrastructure.chat_state import CHAT_STATE_TTL, MAX_CACHED_MSGS, MAX_CHATS, ChatStates
+
+
+# pylint: disable = missing-function-docstring, too-few-public-methods, redefined-outer-name
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list:
+    now = [1000.0]
+    monkeypatch.setattr(chat_state.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_state_is_kept_per_chat(clock):  # pylint: disable=unused-argument
+    states = ChatStates()
+    states.get(1).last_msg_id = 10
+    states.get(2).user_type = "teacher"
+
+    assert states.get(1).last_msg_id == 10
+    assert states.get(1).user_type is None
+    assert states.get(2).user_type == "teacher"
+    assert states.max_chats == MAX_CHATS and states.ttl == CHAT_STATE_TTL
+
+
+def test_least_recently_active_chat_is_evicted(clock):
+    states = ChatStates(max_chats=3)
+    for chat_id in (1, 2, 3):
+        states.get(chat_id).last_msg_id = chat_id
+        clock[0] += 1
+    states.get(1)  # chat 2 is the least recently active one now
+
+    states.get(4)
+
+    assert states.stats() == {"chats": 3, "evictions": 1, "expirations": 0}
+    assert states.get(1).last_msg_id == 1
+    assert states.get(3).last_msg_id == 3
+    assert states.get(2).last_msg_id is None  # started over
+
+
+def test_idle_chat_expires_after_ttl(clock):
+    states = ChatStates(ttl=60)
+    states.get(1).last_msg_id = 10
+    states.get(2).last_msg_id = 20
+
+    clock[0] += 30
+    assert states.get(2).last_msg_id == 20  # activity renews the state
+    clock[0] += 31
+    state = states.get(1)
+
+    assert state.last_msg_id is None
+    assert states.get(2).last_msg_id == 20
+    assert states.stats()["expirations"] == 1
+
+    clock[0] += 61
+    states.get(3)  # expired chats 1 and 2 are dropped without being requested
+    assert states.stats() == {"chats": 1, "evictions": 0, "expirations": 3}
+
+
+def test_message_history_keeps_latest_ids(clock):  # pylint: disable=unused-argument
+    state = ChatStates().get(1)
+
+    state.cached_msgs.extend(range(MAX_CACHED_MSGS + 20))
+    state.cached_msgs.append(None)
+
+    assert len(state.cached_msgs) == MAX_CACHED_MSGS
+    assert state.cached_msgs[0] == 21
+    assert state.cached_msgs[-1] is None
@@ -0,0 +1,97 @@
+"""
+Bounded FSM storage: LRU eviction, persistence and expiration
+"""
+
+import asyncio
+
+from infrastructure import fsm_storage
+from infrastructure.fsm_storage import BoundedStorage
+
+
+# pylint: disable = missing-function-docstring, too-few-public-methods
+
+
+def test_evicted_session_is_reloaded_from_store(tmp_path):
+    async def run():
+        storage = BoundedStorage(tmp_path / "fsm.sqlite3", max_sessions=2, flush_interval=60)
+        for user in range(3):
+            await storage.set_state(chat=user, user=user, state="creating_task")
+            await storage.update_data(chat=user, user=user, description=f"task {user}")
+        await storage.flush()
+        stats, loads = await storage.stats(), storage.loads
+
+        data = await storage.get_data(chat=0, user=0)  # pushed out of memory by users 1 and 2
+        state = await storage.get_state(chat=0, user=0)
+        loads = storage.loads - loads
+        await storage.close()
+        return stats, data, state, loads
+
+    stats, data, state, loads = asyncio.run(run())
+
+    assert stats["sessions"] == 2
+    assert stats["stored"] == 3
+    assert stats["evictions"] == 1
+    assert data == {"description": "task 0"}
+    assert state == "creating_task"
+    assert loads == 1
+
+
+def test_sessions_survive_restart(tmp_path):
+    async def first_run():
+        storage = BoundedStorage(tmp_path / "fsm.sqlite3", flush_interval=60)
+        await storage.set_state(chat=1, user=1, state="waiting_answer")
+        await storage.set_data(chat=1, user=1, data={"task_id": "t1"})
+        await storage.set_state(chat=2, user=2, state="finished")
+        await storage.reset_state(chat=2, user=2, with_data=True)  # finished conversation is not kept
+        await storage.close()  # writes pending changes
+
+    async def second_run():
+        storage = BoundedStorage(tmp_path / "fsm.sqlite3", flush_interval=60)
+        result = (await storage.get_state(chat=1, user=1), await storage.get_data(chat=1, user=1),
+                  await storage.get_state(chat=2, user=2), (await storage.stats())["stored"])
+        await storage.close()
+        return result
+
+    asyncio.run(first_run())
+
+    assert asyncio.run(second_run()) == ("waiting_answer", {"task_id": "t1"}, None, 1)
+
+
+def test_idle_sessions_expire(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(fsm_storage.time, "time", lambda: now[0])
+
+    async def run():
+        storage = BoundedStorage(tmp_path / "fsm.sqlite3", ttl=60, flush_interval=60)
+        await storage.set_state(chat=1, user=1, state="waiting_answer")
+        await storage.flush()
+        now[0] += 61
+        state = await storage.get_state(chat=1, user=1)
+        await storage.set_state(chat=2, user=2, state="waiting_answer")
+        await storage.flush()  # expired sessions are removed from the store with the next batch
+        stats = await storage.stats()
+        await storage.close()
+        return state, stats
+
+    state, stats = asyncio.run(run())
+
+    assert state is None
+    assert stats["expirations"] == 1
+    assert stats["stored"] == 1
+
+
+def test_memory_only_storage_is_bounded():
+    async def run():
+        storage = BoundedStorage(max_sessions=10)
+        for user in range(25):
+            await storage.set_state(chat=user, user=user, state="creating_task")
+        result = await storage.stats(), await storage.get_state(chat=24, user=24)
+        await storage.close()
+        return result
+
+    stats, state = asyncio.run(run())
+
+    assert stats["sessions"] == 10
+    assert stats["stored"] is None
+    assert stats["evictions"] == 15
+    assert state == "creating_task"
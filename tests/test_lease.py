@@ -0,0 +1,85 @@
+"""
+Leader leases: holding, renewal, takeover after expiration
+"""
+
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from database import lease as lease_module
+from database.lease import FileLease, Lease, MongoLease
+
+
+# pylint: disable = missing-function-docstring, too-few-public-methods, redefined-outer-name
+
+
+class Clock:
+    """
+    Replaces datetime in the lease module
+    """
+
+    now = datetime(2026, 1, 1, 12, 0)
+
+    @classmethod
+    def utcnow(cls):
+        return cls.now
+
+
+@pytest.fixture(params=["mongodb", "file"])
+def make_lease(request, tmp_path, monkeypatch):
+    Clock.now = datetime(2026, 1, 1, 12, 0)
+    monkeypatch.setattr(lease_module, "datetime", Clock)
+    collection = mongomock.MongoClient().leases.leases
+
+    def make(owner):
+        if request.param == "mongodb":
+            return MongoLease(collection, "scheduler", owner, seconds=30)
+        return FileLease(tmp_path / "leases.sqlite3", "scheduler", owner, seconds=30)
+
+    return make
+
+
+def test_lease_is_held_until_expiration(make_lease):
+    first, second = make_lease("first"), make_lease("second")
+
+    assert first.acquire()
+    assert not second.acquire()
+    Clock.now += timedelta(seconds=20)
+    assert first.acquire()  # renewed for 30 more seconds
+    Clock.now += timedelta(seconds=20)
+    assert not second.acquire()
+
+
+def test_expired_lease_is_taken_over(make_lease):
+    first, second = make_lease("first"), make_lease("second")
+    assert first.acquire()
+
+    Clock.now += timedelta(seconds=31)
+
+    assert second.acquire()
+    assert not first.acquire()
+
+
+def test_released_lease_is_taken_at_once(make_lease):
+    first, second = make_lease("first"), make_lease("second")
+    assert first.acquire()
+
+    second.release()  # not held, nothing happens
+    assert not second.acquire()
+    first.release()
+
+    assert second.acquire()
+
+
+def test_incomplete_lease_can_not_be_created():
+    class EternalLease(Lease):  # pylint: disable=abstract-method
+        """
+        Lease without release
+        """
+
+        def acquire(self) -> bool:
+            return True
+
+    with pytest.raises(TypeError):
+        EternalLease("scheduler", "first")  # pylint: disable=abstract-class-instantiated
@@ -0,0 +1,99 @@
+"""
+Outbox retries and rate limits
+"""
+
+import io
+import asyncio
+
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import BotBlocked, RetryAfter
+
+from infrastructure.outbox import Outbox, Upload
+
+
+# pylint: disable = missing-function-docstring, too-few-public-methods
+
+
+class FakeBot:
+    """
+    Records sent documents, fails first `failures` requests; reads and closes the uploaded stream like aiohttp does
+    """
+
+    def __init__(self, failures=0, error=None):
+        self.failures = failures
+        self.error = error or RetryAfter(0)
+        self.uploads = []
+
+    async def send_document(self, chat_id, document, **kwargs):  # pylint: disable=unused-argument
+        if isinstance(document, InputFile):
+            stream = document.file
+            try:
+                contents = stream.read()
+            finally:
+                stream.close()
+        else:
+            contents = document
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        self.uploads.append((chat_id, contents))
+        return contents
+
+
+def _outbox(bot, **kwargs) -> Outbox:
+    return Outbox(bot, rate=1000, chat_rate=1000, chat_burst=1000, **kwargs)
+
+
+def _send(outbox_kwargs: dict, bot: FakeBot, document):
+    """
+    Create outbox in the event loop (its locks belong to it) and send document to chat 1
+    """
+
+    async def send():
+        outbox = _outbox(bot, **outbox_kwargs)
+        try:
+            return await outbox.send_document(1, document), outbox
+        except RetryAfter:
+            return None, outbox
+
+    return asyncio.run(send())
+
+
+def test_upload_is_rebuilt_for_retry():
+    bot = FakeBot(failures=2)
+
+    result, outbox = _send({}, bot, Upload(lambda: InputFile(io.BytesIO(b"answer"), filename="a.txt")))
+
+    assert result == b"answer"
+    assert bot.uploads == [(1, b"answer")]
+    assert outbox.stats()["retried"] == 2
+    assert outbox.stats()["retry_after_waits"] == 2
+
+
+def test_retries_are_limited():
+    bot = FakeBot(failures=5)
+
+    result, outbox = _send({"max_retries": 1}, bot, Upload(lambda: InputFile(io.BytesIO(b"x"))))
+
+    assert result is None
+    assert not bot.uploads
+    assert bot.failures == 3
+    assert outbox.stats()["sent"] == 0
+
+
+def test_broadcast_reports_failed_recipients():
+    bot = FakeBot(failures=1, error=BotBlocked("Forbidden: bot was blocked by the user"))
+
+    async def broadcast():
+        outbox = _outbox(bot, concurrency=1)
+
+        async def deliver(chat_id):
+            await outbox.send_document(chat_id, "file-id")
+
+        return await outbox.broadcast([1, 2, 3], deliver)
+
+    report = asyncio.run(broadcast())
+
+    assert report["delivered"] == 2
+    assert list(report["failed"]) == [1]
+    assert [chat_id for chat_id, _ in bot.uploads] == [2, 3]
@@ -0,0 +1,107 @@
+"""
+Update workers: per-chat ordering, bounded concurrency and pending limit
+"""
+
+import asyncio
+
+from aiogram import types
+
+from infrastructure.updates import UpdateWorkers, update_chat
+
+
+# pylint: disable = missing-function-docstring, too-few-public-methods
+
+
+def _update(update_id, chat_id) -> types.Update:
+    return types.Update(**{"update_id": update_id,
+                           "message": {"message_id": update_id, "date": 0, "text": "text",
+                                       "chat": {"id": chat_id, "type": "private"},
+                                       "from": {"id": chat_id, "is_bot": False, "first_name": "user"}}})
+
+
+class Handler:
+    """
+    Records handled updates per chat and updates of one chat running at the same time
+    """
+
+    def __init__(self, fail_update=None):
+        self.handled: dict = {}
+        self.running: dict = {}
+        self.overlaps = self.max_running = 0
+        self.fail_update = fail_update
+
+    async def __call__(self, update: types.Update):
+        chat_id = update.message.chat.id
+        self.overlaps += bool(self.running.get(chat_id))
+        self.running[chat_id] = self.running.get(chat_id, 0) + 1
+        self.max_running = max(self.max_running, sum(self.running.values()))
+        await asyncio.sleep(0.001 * (update.update_id % 3))  # later updates often finish first
+        self.running[chat_id] -= 1
+        if update.update_id == self.fail_update:
+            raise RuntimeError("handler failed")
+        self.handled.setdefault(chat_id, []).append(update.update_id)
+
+
+def _process(updates: list, handler: Handler, **kwargs) -> UpdateWorkers:
+    async def run():
+        workers = UpdateWorkers(handler, **kwargs)  # its events belong to the running loop
+        for update in updates:
+            await workers.submit(update)
+        await workers.join()
+        return workers
+
+    return asyncio.run(run())
+
+
+def test_updates_of_one_chat_are_handled_in_order():
+    updates = [_update(update_id, update_id % 5) for update_id in range(1, 101)]
+    handler = Handler()
+
+    workers = _process(updates, handler, concurrency=8)
+
+    assert handler.overlaps == 0
+    for chat_id, handled in handler.handled.items():
+        assert handled == [update_id for update_id in range(1, 101) if update_id % 5 == chat_id]
+    assert 1 < handler.max_running <= 5  # different chats run concurrently
+    assert workers.stats()["processed"] == 100
+
+
+def test_concurrency_and_pending_are_limited():
+    updates = [_update(update_id, update_id) for update_id in range(1, 51)]
+    handler = Handler()
+    pending = []
+
+    async def run():
+        workers = UpdateWorkers(handler, concurrency=4, max_pending=10)
+        for update in updates:
+            await workers.submit(update)
+            pending.append(workers.pending)
+        await workers.join()
+        return workers
+
+    workers = asyncio.run(run())
+
+    assert handler.max_running <= 4
+    assert max(pending) <= 10
+    assert workers.stats()["pending"] == 0
+    assert sum(len(handled) for handled in handler.handled.values()) == 50
+
+
+def test_failed_update_does_not_stop_its_chat():
+    handler = Handler(fail_update=2)
+
+    workers = _process([_update(update_id, 1) for update_id in range(1, 5)], handler)
+
+    assert handler.handled == {1: [1, 3, 4]}
+    assert workers.stats()["failed"] == 1
+    assert workers.stats()["processed"] == 3
+
+
+def test_update_chat_keys():
+    callback = types.Update(**{"update_id": 7, "callback_query": {
+        "id": "1", "chat_instance": "1", "data": "x", "from": {"id": 5, "is_bot": False, "first_name": "user"},
+        "message": {"message_id": 1, "date": 0, "chat": {"id": 9, "type": "private"}}}})
+
+    assert update_chat(_update(1, 3)) == 3
+    assert update_chat(callback) == 9
+    assert update_chat(types.Update(update_id=8)) == ("update", 8)
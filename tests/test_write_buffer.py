@@ -0,0 +1,151 @@
+"""
+Write-behind buffer flushing and failure handling
+"""
+
+from types import SimpleNamespace
+
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from database.write_buffer import MAX_FLUSH_ATTEMPTS, WriteBuffer
+
+
+# pylint: disable = missing-function-docstring, too-few-public-methods
+
+
+def _write_error(index, code, operation) -> BulkWriteError:
+    return BulkWriteError({"writeErrors": [{"index": index, "code": code, "errmsg": "failed", "op": operation}],
+                           "nInserted": 0, "nUpserted": 0, "nMatched": index, "nModified": index, "nRemoved": 0})
+
+
+class FakeCollection:
+    """
+    Ordered bulk_write: executes operations up to the scripted failure
+    """
+
+    def __init__(self, written: list, failures: list):
+        self.written = written
+        self.failures = failures
+
+    def bulk_write(self, operations, ordered=True):
+        assert ordered
+        failure = self.failures.pop(0) if self.failures else None
+        if isinstance(failure, tuple):  # (index, code): operations before index are written
+            index, code = failure
+            self.written.extend(operations[:index])
+            raise _write_error(index, code, operations[index])
+        if failure is not None:
+            raise failure
+        self.written.extend(operations)
+        return SimpleNamespace(matched_count=len(operations), upserted_count=0)
+
+
+class FakeDatabase(dict):
+    """
+    pymongo Database with one scripted collection
+    """
+
+    def __init__(self, failures=None):
+        super().__init__()
+        self.written: list = []
+        self.collection = FakeCollection(self.written, failures or [])
+
+    def __getitem__(self, name):
+        return self.collection
+
+
+def _ops(count) -> list:
+    return [UpdateOne({"user_id": index}, {"$set": {"n": index}}, upsert=True) for index in range(count)]
+
+
+def _buffer(database) -> WriteBuffer:
+    return WriteBuffer(database, max_ops=100, interval_ms=60000)
+
+
+def test_flush_writes_in_order():
+    database = FakeDatabase()
+    buffer = _buffer(database)
+    operations = _ops(3)
+    for operation in operations:
+        buffer.add("users", operation)
+    assert buffer.pending() == 3
+
+    buffer.flush()
+
+    assert database.written == operations
+    assert buffer.pending() == 0
+    buffer.close()
+
+
+def test_duplicate_key_upsert_is_retried():
+    database = FakeDatabase([(1, 11000)])
+    buffer = _buffer(database)
+    operations = _ops(3)
+    for operation in operations:
+        buffer.add("users", operation)
+
+    buffer.flush()
+
+    assert database.written == operations
+    assert buffer.failed == 0
+    buffer.close()
+
+
+def test_failed_operation_is_dropped_and_the_rest_is_written():
+    database = FakeDatabase([(1, 121)])  # document validation failure
+    buffer = _buffer(database)
+    operations = _ops(4)
+    for operation in operations:
+        buffer.add("users", operation)
+
+    buffer.flush()
+
+    assert database.written == [operations[0], *operations[2:]]
+    assert buffer.failed == 1
+    buffer.close()
+
+
+def test_connection_error_requeues_batch_before_newer_writes():
+    database = FakeDatabase([AutoReconnect("down")])
+    buffer = _buffer(database)
+    operations = _ops(3)
+    buffer.add("users", operations[0])
+    buffer.add("users", operations[1])
+
+    buffer.flush()
+    assert not database.written
+    assert buffer.pending() == 2
+
+    buffer.add("users", operations[2])
+    buffer.flush()
+
+    assert database.written == operations
+    buffer.close()
+
+
+def test_batch_is_dropped_after_max_attempts():
+    database = FakeDatabase([AutoReconnect("down")] * MAX_FLUSH_ATTEMPTS)
+    buffer = _buffer(database)
+    buffer.add("users", _ops(1)[0])
+
+    for _ in range(MAX_FLUSH_ATTEMPTS):
+        buffer.flush()
+
+    assert buffer.pending() == 0
+    assert buffer.failed == 1
+    assert not database.written
+    buffer.close()
+
+
+def test_close_drains_queue_before_later_writes():
+    database = FakeDatabase()
+    buffer = _buffer(database)
+    operations = _ops(3)
+    buffer.add("users", operations[0])
+    buffer.add("users", operations[1])
+
+    buffer.close()
+    buffer.add("users", operations[2])  # executed immediately
+
+    assert database.written == operations
+    assert buffer.pending() == 0